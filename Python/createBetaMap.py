@@ -5,39 +5,58 @@
 # This module reads an ASC file that contains the PfPR for the two to ten age
 # bracket and generates three ASC files with beta values.
 import argparse
+import multiprocessing
+import numpy as np
 import os
 import sys
 
 # Import our libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
 import include.ascFile as asc
+import include.betaCurve as bc
+import include.betaLookup as bl
 import include.calibrationLib as cl
 import include.standards as std
 import include.utility as utility
 
 
-# Starting epsilon and delta to be used
+# Epsilon step to be used when searching for betas
 EPSILON = 0.00001
-MAX_EPSILON = 0.1
+
+# Number of bands of rows for each job when running in parallel
+BANDS_PER_JOB = 4
 
 # Warnings to be passed between functions
 WARNINGS = ''
 
-def create_beta_map(betas, configuration, gisPath, prefix, age, pfpr_file):
-   
+# Rasters and lookup used when processing bands of rows, these are set before
+# the worker processes are forked so they are shared rather than pickled
+RASTERS = None
+
+# Cells with the same zone, bins, and PfPR have the same betas, so the epsilon
+# and mean beta for each key are noted as they are found
+MEMO = {}
+
+def create_beta_map(betas, configuration, gisPath, prefix, age, pfpr_file, jobs=1, interpolate=False):
+    # Start from a clean memo in case of an earlier call in the same process
+    global RASTERS
+    RASTERS = None
+    MEMO.clear()
+
     # Load the relevant raster files
-    filename = os.path.join(gisPath, std.PFPR_FILE.format(prefix))
+    filename = cl.get_gis_file(gisPath, std.PFPR_FILE.format(prefix))
     if pfpr_file:
         print('Using supplied PfPR file...')
         filename = pfpr_file    
-    ascHeader, pfpr = asc.load_asc(filename)
-    filename = os.path.join(gisPath, std.POPULATION_FILE.format(prefix))    
-    _, population = asc.load_asc(filename)
+    ascHeader, pfpr, mask = asc.load_asc_array(filename)
+    filename = cl.get_gis_file(gisPath, std.POPULATION_FILE.format(prefix))
+    _, population, _ = asc.load_asc_array(filename)
 
     # Defer to the library to load the rest
-    climate = cl.get_climate_zones(configuration, gisPath)
-    treatments = cl.get_treatments_raster(configuration, gisPath)
-    pfprBand, lookup = cl.load_betas(betas)
+    climate = np.asarray(cl.get_climate_zones(configuration, gisPath), dtype=float)
+    treatments = np.asarray(cl.get_treatments_raster(configuration, gisPath), dtype=float)
+    index = cl.load_index(betas, climate[~mask], population[~mask], treatments[~mask])
+    pfprBand, lookup = index.pfpr, bl.BetaLookup(index, EPSILON)
 
     # Make sure the data loaded correct, or that there is data
     if len(lookup) == 0:
@@ -55,71 +74,59 @@ def create_beta_map(betas, configuration, gisPath, prefix, age, pfpr_file):
     if error is not None:
         raise Exception('Mismatch between parameters and calibration file, expected {}'.format(error))
 
-    # Prepare for the ASC data
-    epsilons, meanBeta = [], []
-    maxEpsilon = 0
-
-    # Prepare to track the distribution
-    distribution = [0] * 5
-
-    # Scan each of the rows 
+    # Scan each of the rows, in bands of rows if there are multiple jobs, or interpolate them all at once
     print("Determining betas for {}\nRaster Size: {} rows, {} columns".format(ageBand, ascHeader['nrows'], ascHeader['ncols']))
-    for row in range(0, ascHeader['nrows']):
-
-        # Append the empty rows
-        epsilons.append([])
-        meanBeta.append([])
-
-        # Scan each of the PfPR values    
-        for col in range(0, ascHeader['ncols']):
-
-            # Append nodata and continue
-            if pfpr[row][col] == ascHeader['nodata']:
-                epsilons[row].append(ascHeader['nodata'])
-                meanBeta[row].append(ascHeader['nodata'])
-                continue
-
-            # Get the beta values
-            values, epsilon = get_betas(climate[row][col], pfpr[row][col], population[row][col], treatments[row][col], lookup)
-
-            # Update the distribution
-            for exponent in range(1, len(distribution) + 1):
-                if epsilon >= pow(10, -exponent):
-                    distribution[exponent - 1] += 1
-                    break
-
-            # Was nothing returned?
-            if len(values) == 0:
-                epsilons[row].append(0)
-                meanBeta[row].append(0)
-                continue
-
-            # Note the epsilon and the mean
-            epsilons[row].append(epsilon)
-            if epsilon > maxEpsilon: 
-                maxEpsilon = epsilon
-
-                # Determine the population and treatment bin we are working with
-                zone = climate[row][col]
-                maxValues = "PfPR: {}, Population: {} (Bin: {}), Treatment: {}".format(
-                    pfpr[row][col], population[row][col], cl.get_bin(population[row][col], lookup[zone].keys()), treatments[row][col])
-            meanBeta[row].append(sum(values) / len(values))
-
-        # Note the progress
-        utility.progressBar(row + 1, ascHeader['nrows'])
+    try:
+        populationBins, treatmentBins = np.full(pfpr.shape, np.nan), np.full(pfpr.shape, np.nan)
+        populationBins[~mask], treatmentBins[~mask] = cl.resolve_bins(lookup, climate[~mask], population[~mask],
+                                                                      treatments[~mask])
+        RASTERS = [ascHeader, climate, pfpr, population, treatments, populationBins, treatmentBins, lookup]
+        epsilons, meanBeta, warnings = [], [], ''
+        maxEpsilon, maxValues = 0, None
+        distribution, found = [0] * 5, 0
+        memo, hits = 0, 0
+        rows = 0
+        bands = [interpolate_band(index)] if interpolate else run_bands(ascHeader['nrows'], jobs)
+        for band in bands:
+            epsilons.append(band['epsilons'])
+            meanBeta.append(band['betas'])
+            rows += len(band['epsilons'])
+
+            # Combine the statistics in row order so the results match a single job
+            if band['maxEpsilon'] > maxEpsilon:
+                maxEpsilon, maxValues = band['maxEpsilon'], band['maxValues']
+            distribution = [a + b for a, b in zip(distribution, band['distribution'])]
+            found += band['found']
+            memo, hits = memo + band['memo'], hits + band['hits']
+            for warning in band['warnings'].split('\n')[1:]:
+                if warning not in warnings:
+                    warnings += '\n' + warning
+
+            # Note the progress
+            utility.progressBar(rows, ascHeader['nrows'])
+    finally:
+        # Release the rasters and lookup so repeated calls start clean
+        RASTERS = None
+        MEMO.clear()
 
     # Print the warnings, if any
-    if len(WARNINGS) > 0:
-        print(WARNINGS)
+    if len(warnings) > 0:
+        print(warnings)
 
     # Write the results
-    print("\n Max epsilon: {:.6f} / {}".format(maxEpsilon, maxValues))
-    print("Epsilon Distribution")
-    total = 0
+    label = 'residual' if interpolate else 'epsilon'
+    print("\n Max {}: {:.6f} / {}".format(label, maxEpsilon, maxValues))
+    print("{} Distribution".format(label.capitalize()))
     for ndx in range(0, len(distribution)):
         print("{:>6} : {}".format(pow(10, -(ndx + 1)), distribution[ndx]))
-        total += distribution[ndx]
-    print("Total Cells: {}".format(total))
+
+    # Interpolated cells may have a residual of zero, which is below the smallest bucket
+    if found > sum(distribution):
+        print("{:>6} : {}".format('< ' + str(pow(10, -len(distribution))), found - sum(distribution)))
+    print("Total Cells: {}".format(found))
+    # Each worker has its own memo when running in parallel, so the hit rate is only meaningful for a single job
+    if jobs == 1 and memo + hits > 0:
+        print("Unique Lookups: {}, Hit Rate: {:.2f}%".format(memo, hits * 100 / (memo + hits)))
     
     # Create the directory if need be
     if not os.path.isdir('out'): os.mkdir('out')
@@ -127,37 +134,160 @@ def create_beta_map(betas, configuration, gisPath, prefix, age, pfpr_file):
     # Save the maps        
     filename = std.EPSILON_VALUES.format(prefix)
     print("\nSaving {}".format(filename))
-    asc.write_asc(ascHeader, epsilons, filename)
+    asc.write_asc(ascHeader, np.concatenate(epsilons), filename)
     filename = std.BETA_VALUES.format(prefix)
     print("Saving {}".format(filename))
-    asc.write_asc(ascHeader, meanBeta, filename)
+    asc.write_asc(ascHeader, np.concatenate(meanBeta), filename)
 
 
-# Get the beta values that generate the PfPR for the given population and 
-# treatment level, this function will start with the lowest epsilon value 
-# and increase it until at least one value is found to be returned
-def get_betas(zone, pfpr, population, treatment, lookup):
+# Process the bands of rows, in parallel if there is more than one job, and
+# return the results for each band in row order
+def run_bands(nrows, jobs):
+    if jobs == 1:
+        for row in range(nrows):
+            yield process_band((row, row + 1))
+        return
+
+    size = max(1, -(-nrows // (jobs * BANDS_PER_JOB)))
+    bands = [(start, min(start + size, nrows)) for start in range(0, nrows, size)]
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        for result in pool.imap(process_band, bands):
+            yield result
+
+
+# Determine the betas for the band of rows, [start, end), returning the rows
+# for the epsilon and beta rasters along with the statistics for the band
+def process_band(band):
     global WARNINGS
+    ascHeader, climate, pfpr, population, treatments, populationBins, treatmentBins, lookup = RASTERS
+    start, end = band
+    WARNINGS = ''
+
+    # Note the valid cells in the band, in row order
+    cells = np.flatnonzero(pfpr[start:end].ravel() != ascHeader['nodata'])
+    values = [raster[start:end].ravel()[cells] for raster in (climate, populationBins, treatmentBins, pfpr)]
+
+    # Get the beta values for each unique key if they have not already been found, the
+    # keys are checked in the order they first appear
+    known = len(MEMO)
+    unique, first, inverse = np.unique(np.column_stack(values), axis=0, return_index=True, return_inverse=True)
+    results = np.zeros((len(unique), 3))
+    for ndx in np.argsort(first, kind='stable'):
+        key = tuple(unique[ndx].tolist())
+        if key not in MEMO:
+            zone, populationBin, treatmentBin, value = key
+            betas, epsilon = get_betas(zone, value, populationBin, treatmentBin, lookup)
+            MEMO[key] = [epsilon, sum(betas) / len(betas) if len(betas) > 0 else None]
+        epsilon, mean = MEMO[key]
+        results[ndx] = [epsilon, mean if mean is not None else 0, mean is not None]
+    epsilon, mean, found = results[inverse.ravel()].T
+    found = found.astype(bool)
+
+    # Update the distribution
+    distribution = get_distribution(epsilon)
+
+    # Prepare the ASC data, nodata is retained and nothing returned is zero
+    shape = pfpr[start:end].shape
+    epsilons = np.full(shape, float(ascHeader['nodata']))
+    meanBeta = np.full(shape, float(ascHeader['nodata']))
+    epsilons.ravel()[cells] = np.where(found, epsilon, 0)
+    meanBeta.ravel()[cells] = np.where(found, mean, 0)
+
+    # Note the first cell with the largest epsilon
+    maxEpsilon, maxValues = 0, None
+    if len(cells) > 0:
+        ndx = np.argmax(np.where(found, epsilon, 0))
+        if found[ndx] and epsilon[ndx] > 0:
+            maxEpsilon = epsilon[ndx].item()
+            row, col = divmod(cells[ndx].item(), shape[1])
+            row, zone = row + start, climate[row + start][col].item()
+
+            # Determine the population and treatment bin we are working with
+            maxValues = "PfPR: {}, Population: {} (Bin: {}), Treatment: {}".format(
+                pfpr[row][col].item(), population[row][col].item(),
+                cl.get_bin(population[row][col].item(), lookup.population_bins(zone)), treatments[row][col].item())
+
+    return {'epsilons': epsilons, 'betas': meanBeta, 'maxEpsilon': maxEpsilon, 'maxValues': maxValues,
+            'distribution': distribution, 'found': int(np.count_nonzero(found)), 'memo': len(MEMO) - known,
+            'hits': len(cells) - (len(MEMO) - known), 'warnings': WARNINGS}
+
+
+# Interpolate the betas for all of the rows using a monotone curve fit to the
+# calibration data for each bin, returning the results as a single band with
+# the residual in place of the epsilon
+def interpolate_band(index):
+    ascHeader, climate, pfpr, population, treatments, populationBins, treatmentBins, _ = RASTERS
+
+    # Note the valid cells, in row order
+    cells = np.flatnonzero(pfpr.ravel() != ascHeader['nodata'])
+    values = [raster.ravel()[cells] for raster in (climate, populationBins, treatmentBins)]
+    keys, inverse = np.unique(np.column_stack(values), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    # Fit the curve for each bin and evaluate it for all of the cells at once
+    residual, beta = np.zeros(len(cells)), np.zeros(len(cells))
+    found = np.zeros(len(cells), dtype=bool)
+    warnings = ''
+    for ndx, (zone, populationBin, treatmentBin) in enumerate(keys.tolist()):
+        pfprs, betas, _ = index.curve(int(zone), int(populationBin), treatmentBin)
+        if len(pfprs) == 0:
+            warnings += '\nWARNING: No calibration data for bin = Zone: {}, Population: {}, Treatment: {}'.format(
+                zone, int(populationBin), treatmentBin)
+            continue
+        inBin = inverse == ndx
+        beta[inBin], residual[inBin] = bc.MonotoneCurve(pfprs, betas).invert(pfpr.ravel()[cells[inBin]])
+        found |= inBin
+
+    # Prepare the ASC data, nodata is retained and nothing returned is zero
+    epsilons = np.full(pfpr.shape, float(ascHeader['nodata']))
+    meanBeta = np.full(pfpr.shape, float(ascHeader['nodata']))
+    epsilons.ravel()[cells] = residual
+    meanBeta.ravel()[cells] = beta
+
+    # Note the first cell with the largest residual
+    maxResidual, maxValues = 0, None
+    if len(cells) > 0 and residual.max() > 0:
+        ndx = np.argmax(residual)
+        maxResidual = residual[ndx].item()
+        row, col = divmod(cells[ndx].item(), pfpr.shape[1])
+        maxValues = "PfPR: {}, Population: {} (Bin: {}), Treatment: {}".format(
+            pfpr[row][col].item(), population[row][col].item(), int(populationBins[row][col]),
+            treatments[row][col].item())
+
+    return {'epsilons': epsilons, 'betas': meanBeta, 'maxEpsilon': maxResidual, 'maxValues': maxValues,
+            'distribution': get_distribution(residual[found]), 'found': int(np.count_nonzero(found)), 'memo': 0,
+            'hits': 0, 'warnings': warnings}
+
+
+# Get the count of the values at least 0.1, then 0.01 (but less than 0.1), and
+# so on to 0.00001
+def get_distribution(values):
+    distribution = [0] * 5
+    counted = np.zeros(len(values), dtype=bool)
+    for exponent in range(1, len(distribution) + 1):
+        match = ~counted & (values >= pow(10, -exponent))
+        distribution[exponent - 1] = int(np.count_nonzero(match))
+        counted |= match
+    return distribution
 
-    # Initial values
-    epsilon = 0
-    betas = []
 
-    # Increase the epsilon until at least one value is found
-    while len(betas) == 0:
-        epsilon += EPSILON
-        betas = get_betas_scan(zone, pfpr, population, treatment, lookup, epsilon)
+# Get the beta values that generate the PfPR for the given population and 
+# treatment level, the lookup will find the lowest epsilon value that results
+# in at least one value being returned
+def get_betas(zone, pfpr, population, treatment, lookup):
+    global WARNINGS
 
-        # Prevent an infinite loop, will result in an error
-        if epsilon == MAX_EPSILON:
-            print('Match not found!\nPfPR: ', pfpr, 'Population: ', population)
-            return [None, None]
+    # Find the betas, note that nothing will be found if the bin has no data
+    betas, epsilon = lookup.get_betas(zone, pfpr, population, treatment)
+    if len(betas) == 0:
+        print('Match not found!\nPfPR: ', pfpr, 'Population: ', population)
+        return [], 0
 
     # If the PfPR is zero then verify that beta returned will be zero
     if pfpr == 0 and sum(betas) > 0:
         # Resolve the bins
-        populationBin = int(cl.get_bin(population, lookup[zone].keys()))
-        treatmentBin = cl.get_bin(treatment, lookup[zone][populationBin].keys())
+        populationBin = int(cl.get_bin(population, lookup.population_bins(zone)))
+        treatmentBin = cl.get_bin(treatment, lookup.treatment_bins(zone, populationBin))
 
         # Append a warning for this bin if it hasn't already been added
         binning = "Zone: {}, Population: {}, Treatment: {}".format(zone, populationBin, treatmentBin)
@@ -167,43 +297,10 @@ def get_betas(zone, pfpr, population, treatment, lookup):
 
     # Return the results
     return betas, epsilon
-
-
-# Get the beta values that generate the PfPR for the given population and 
-# treatment level, within the given margin of error.
-def get_betas_scan(zone, pfpr, population, treatment, lookup, epsilon):
-
-    # The zone is a bin, so it should just be there
-    if not zone in lookup:
-        raise ValueError("Zone {} was not found in lookup".format(zone))
-
-    # Determine the population and treatment bin we are working with
-    populationBin = cl.get_bin(population, lookup[zone].keys())
-    treatmentBin = cl.get_bin(treatment, lookup[zone][populationBin].keys())
-    
-    # Note the bounds
-    low = pfpr - epsilon
-    high = pfpr + epsilon
-
-    # Scan the PfPR values for the population and treatment level that are 
-    # within the margin
-    betas = []
-    for value in lookup[zone][populationBin][treatmentBin]:
-
-        # Add the value if it is in the bounds
-        if low <= value[0] and value[0] <= high:
-            betas.append(value[1])
-            
-        # We assume the data is stored, so break once the high value is less
-        # than the current PfPR
-        if high < value[0]: break
-
-    # Return the betas collected
-    return betas
     
 
 # Main entry point for the script
-def main(betas, configuration, gisPath, age, pfpr):
+def main(betas, configuration, gisPath, age, pfpr, jobs=1, interpolate=False):
 
     # Parse the country prefix
     prefix = cl.get_prefix(configuration)
@@ -215,14 +312,15 @@ def main(betas, configuration, gisPath, age, pfpr):
     cfg = cl.load_configuration(configuration)
 
     # Proceed with creating beta map
-    create_beta_map(betas, cfg, gisPath, prefix, age, pfpr)
+    create_beta_map(betas, cfg, gisPath, prefix, age, pfpr, jobs, interpolate)
 
 
 if __name__ == "__main__":
     # Parse the parameters
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', action='store', dest='betas', required=True, 
-        help='The filename and path of the CSV file that contains calibration data')
+        help='The filename and path of the CSV file, or calibration store (.db, .sqlite), that contains '
+             'calibration data')
     parser.add_argument('-c', action='store', dest='configuration', required=True, 
         help='The YAML configuration file to reference when creating the beta map')
     parser.add_argument('-g', action='store', dest='gis', required=True,
@@ -231,16 +329,27 @@ if __name__ == "__main__":
         help='The age band to use for map generation, either 0-59 or 2-10 (default)')
     parser.add_argument('--pfpr', action='store', dest='pfpr', default=None, 
         help='Override the default PfPR file with the one supplied')
+    parser.add_argument('--jobs', action='store', dest='jobs', type=int, default=1,
+        help='The number of processes to use when determining the betas, default 1')
+    parser.add_argument('--interpolate', action='store_true', dest='interpolate',
+        help='Interpolate the betas from a monotone curve fit to the calibration data, the epsilon file will '
+             'contain the residual')
     args = parser.parse_args()
 
     # Check to make sure the age band supplied is valid
     if args.age not in ['0-59', '2-10']:
         sys.stderr.write("The age band supplied is not valid, expected \'0-59\' or \'2-10\', got: {}\n".format(args.age))
         sys.exit(cl.EXIT_FAILURE)
+    if args.jobs < 1:
+        sys.stderr.write("The number of jobs must be at least one, got: {}\n".format(args.jobs))
+        sys.exit(cl.EXIT_FAILURE)
+    if args.interpolate and args.jobs > 1:
+        sys.stderr.write("The betas are interpolated in a single pass, --jobs cannot be used with --interpolate\n")
+        sys.exit(cl.EXIT_FAILURE)
     
     # Call the main function with the parameters
     try:
-        main(args.betas, args.configuration, args.gis, args.age, args.pfpr)
+        main(args.betas, args.configuration, args.gis, args.age, args.pfpr, args.jobs, args.interpolate)
     except Exception as err:
         sys.stderr.write("ERROR: {}\n".format(str(err)))
         sys.exit(cl.EXIT_FAILURE)
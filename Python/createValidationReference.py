@@ -14,40 +14,27 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), 'include'))
 import include.ascFile as asc
 import include.standards as std
+import include.zonal as zonal
 
 
 def main(gis):
-    # Get the prefix and open the ASC files
+    # Get the prefix and the ASC files
     prefix = scan_prefix(gis)
-    header, districts = asc.load_asc(os.path.join(gis, std.DISTRICT_FILE.format(prefix)))
-    _, pfpr = asc.load_asc(os.path.join(gis, std.PFPR_FILE.format(prefix)))
-    _, population = asc.load_asc(os.path.join(gis, std.POPULATION_FILE.format(prefix)))
-    
-    # Iterate through the district file to guide the calculation
-    data = {}
-    for row in range(0, header['nrows']):
-        for col in range(0, header['ncols']):
+    filenames = [asc.find_asc(os.path.join(gis, template.format(prefix)))
+                 for template in (std.DISTRICT_FILE, std.PFPR_FILE, std.POPULATION_FILE)]
+    header = asc.load_header(filenames[0])
 
-            # Continue on no data
-            if districts[row][col] == header['nodata']:
-                continue
-
-            # Prepare our dictionary as needed
-            district = int(districts[row][col])
-            if district not in data:
-                data[district] = [0, 0]
-
-            # First value is the weighted PfPR sum
-            data[district][0] += ((pfpr[row][col] * population[row][col]) * 100.0)
-
-            # Second value is the population sum
-            data[district][1] += population[row][col]
+    # Calculate the population weighted PfPR, as a percentage, for each district
+    accumulator = zonal.ZonalAccumulator(['district'], ['pfpr'], nodata=header['nodata'])
+    for _, [districts, pfpr, population] in asc.iter_rows(filenames):
+        accumulator.add({'district': districts}, {'pfpr': pfpr * 100.0}, weights=population)
+    data = accumulator.results()['district']
 
     # Generate the results file
     filename = std.WEIGHTED_PFPR.format(prefix)
     with open(filename, 'w') as output:
-        for district in sorted(data.keys()):
-            output.write("{},{}\n".format(district, round(data[district][0] / data[district][1], 2)))
+        for district, mean in zip(data['ids'].tolist(), data['mean']['pfpr'].tolist()):
+            output.write("{},{}\n".format(int(district), round(mean, 2)))
     print("{} created".format(filename))        
 
 
@@ -56,8 +43,8 @@ def main(gis):
 # country code.
 def scan_prefix(directory):
     prefix = None
-    for file in glob.glob(os.path.join(directory, "*.asc")):
-        match = re.search(r"^.*\/([a-z]{3})[-_].*\.asc", file)
+    for file in glob.glob(os.path.join(directory, "*.asc*")):
+        match = re.search(r"^.*\/([a-z]{3})[-_].*" + asc.ASC_PATTERN, file)
         if match is None: 
             continue
         if prefix is None: 
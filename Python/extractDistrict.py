@@ -4,45 +4,62 @@
 #
 # Filter the indicated raster files by the district id values indicated.
 import argparse
+import numpy as np
 import os
 import sys
 
 # Import our libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), 'include'))
 import include.ascFile as asc
+import include.calibrationLib as cl
 
 
-def main(districtsFile, targetFiles, districts):
-    # Load the reference districts raster
-    [ascHeader, ascDistricts] = asc.load_asc(districtsFile)
+def main(districtsFile, targetFiles, districts, crop=False):
+    # Load the reference districts header
+    ascHeader = asc.load_header(districtsFile)
 
-    # Load the target extraction rasters
-    rasters = []
+    # Determine the bounding box of the districts if we are cropping
+    rows, cols = (0, ascHeader['nrows']), slice(None)
+    header = ascHeader
+    if crop:
+        try:
+            [rows, cols], header = get_bounds(districtsFile, ascHeader, districts)
+        except ValueError as err:
+            sys.stderr.write("{}\n".format(str(err)))
+            sys.exit(cl.EXIT_FAILURE)
+
+    # Extract from each target raster and save the data to disk, informing the user
     for file in targetFiles:
-        _, data = asc.load_asc(file)
-        rasters.append(data)
-
-    # Iterate over the reference raster
-    for row in range(ascHeader['nrows']):
-        for col in range(ascHeader['ncols']):
-            
-            # Pass on no data
-            if ascDistricts[row][col] == ascHeader['nodata']:
-                continue
-                
-            # Pass if the district matches
-            if ascDistricts[row][col] in districts:
-                continue
-
-            # This must not be a valid district, so replace it with no data
-            for ndx in range(len(rasters)):
-                rasters[ndx][row][col] = ascHeader['nodata']
-
-    # Done, so save the data to disk, informing the user
-    for ndx in range(len(targetFiles)):
-        out = "extract_{}".format(targetFiles[ndx])
-        print("Saving {} as {}".format(targetFiles[ndx], out))
-        asc.write_asc(ascHeader, rasters[ndx], out)
+        out = "extract_{}".format(file)
+        print("Saving {} as {}".format(file, out))
+        with asc.AscWriter(header, out) as writer:
+            for start, [ascDistricts, data] in asc.iter_rows([districtsFile, file]):
+                # Cells that are not nodata and not one of the districts are replaced with nodata
+                data[(ascDistricts != ascHeader['nodata']) & ~np.isin(ascDistricts, districts)] = ascHeader['nodata']
+                writer.write(data[max(rows[0] - start, 0):max(rows[1] - start, 0), cols])
+
+
+# Get the bounding box of the districts as the (first, last + 1) rows and a
+# slice of the columns, along with the header for the cropped raster
+def get_bounds(districtsFile, ascHeader, districts):
+    selected = []
+    columns = np.zeros(ascHeader['ncols'], dtype=bool)
+    for start, [ascDistricts] in asc.iter_rows([districtsFile]):
+        found = np.isin(ascDistricts, districts)
+        selected.extend((start + np.flatnonzero(found.any(axis=1))).tolist())
+        columns |= found.any(axis=0)
+    cols = np.flatnonzero(columns)
+    if len(selected) == 0:
+        raise ValueError("None of the districts were found in the raster")
+    rows = (selected[0], selected[-1] + 1)
+
+    # Update the dimensions and shift the lower left corner
+    header = dict(ascHeader)
+    header['nrows'] = rows[1] - rows[0]
+    header['ncols'] = int(cols[-1] - cols[0] + 1)
+    header['xllcorner'] = ascHeader['xllcorner'] + cols[0].item() * ascHeader['cellsize']
+    header['yllcorner'] = ascHeader['yllcorner'] + (ascHeader['nrows'] - rows[1]) * ascHeader['cellsize']
+    return [rows, slice(cols[0], cols[-1] + 1)], header
 
 
 if __name__ == "__main__":
@@ -54,10 +71,12 @@ if __name__ == "__main__":
         help='Raster file(s) have to specified district(s) extracted')
     parser.add_argument('-i', action='store', dest='districts', nargs='*', required=True,
         help='The list of one or more district identification values to filter by')
+    parser.add_argument('--crop', action='store_true', dest='crop',
+        help='Crop the rasters to the bounding box of the district(s)')
     args = parser.parse_args()
 
     # Parse the districts to integers
     districts = [int(i) for i in args.districts]
 
     # Defer to main for everything else
-    main(args.districtsFile, args.targetFile, districts)
+    main(args.districtsFile, args.targetFile, districts, args.crop)
@@ -4,27 +4,28 @@
 #
 # This script generates the bins that need to be run to determine the beta values
 import argparse
+import csv
+import numpy as np
 import os
 import sys
 
 # Import our libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
 import include.ascFile as asc
+import include.betaPlanner as planner
 import include.calibrationLib as cl
 import include.stats as stats
 import include.bashWriter as bash
 
 
 # Process the configuration file, GIS files, and produce the bins
-def process(configuration, gisPath, prefix, type):
+def process(configuration, gisPath, prefix, type, samples=None):
     # Load the configuration
     cfg = cl.load_configuration(configuration)
 
     # Load the data, remove the NODATA, and bin the population
-    ascHeader, population = get_population(gisPath, prefix)
-    data = list(i for j in population for i in j)
-    data = list(i for i in data if i != ascHeader['nodata'])
-    populationBreaks = bin_data(data, 'population')
+    ascHeader, population, mask = get_population(gisPath, prefix)
+    populationBreaks = bin_data(population[~mask], 'population', samples=samples)
 
     # Get the access to treatments rate and bin if need be
     treatments, needsBinning = cl.get_treatments_list(cfg, gisPath)
@@ -33,7 +34,7 @@ def process(configuration, gisPath, prefix, type):
     if needsBinning:
         data = list(i for j in treatments for i in j)
         data = list(i for i in data if i != ascHeader['nodata'])
-        treatments = bin_data(data, 'treatments')
+        treatments = bin_data(data, 'treatments', samples=samples)
     
     # Load the binning range type
     if type == 'pfpr':
@@ -42,70 +43,85 @@ def process(configuration, gisPath, prefix, type):
         filename = "{}/{}_incidence.asc".format(gisPath, prefix)
     else:
         raise Exception("Unknown binning range type, {}".format(type))
-    _, data = load(filename, "PfPR")
+    _, data, _ = load(filename, "PfPR")
     
     # Load the climate and treatment rasters
-    climate = cl.get_climate_zones(cfg, gisPath)
-    treatment = cl.get_treatments_raster(cfg, gisPath)
+    climate = np.asarray(cl.get_climate_zones(cfg, gisPath), dtype=float)
+    treatment = np.asarray(cl.get_treatments_raster(cfg, gisPath), dtype=float)
 
-    # Process the data
-    rangeBins, zoneTreatments = {}, {}
-    for row in range(0, ascHeader['nrows']):
-        for col in range(0, ascHeader['ncols']):
-
-            # Press on if there is nothing to do
-            zone = climate[row][col]
-            if zone == ascHeader['nodata']: continue
+    # Bin the cells that have a zone, in row order
+    cells = climate != ascHeader['nodata']
+    zones, data = climate[cells], data[cells]
+    popBins = cl.get_bins(population[cells], populationBreaks).astype(int)
+    treatBins = cl.get_bins(treatment[cells], treatments)
 
-            # Note the bins
-            popBin = int(cl.get_bin(population[row][col], populationBreaks))
-            treatBin = cl.get_bin(treatment[row][col], treatments)
+    # Process the data, adding the zones, bins, and treatments in the order they first appear
+    rangeBins, zoneTreatments = {}, {}
+    for zone in ordered_unique(zones):
+        inZone = zones == zone
+        rangeBins[zone] = {}
+        for popBin in ordered_unique(popBins[inZone]):
+            rangeBins[zone][popBin] = data[inZone & (popBins == popBin)].tolist()
+        zoneTreatments[zone] = ordered_unique(treatBins[inZone])
 
-            # Add to the dictionary as needed
-            if zone not in rangeBins:
-                rangeBins[zone] = {}
-            if popBin not in rangeBins[zone]:
-                rangeBins[zone][popBin] = []
-            if zone not in zoneTreatments:
-                zoneTreatments[zone] = []
+    # Count the cells for each (zone, population bin, treatment bin) that occurs, in the order they first appear
+    keys, first, counts = np.unique(np.column_stack((zones, popBins, treatBins)), axis=0, return_index=True,
+                                    return_counts=True)
+    combinations = {}
+    for ndx in np.argsort(first):
+        zone, popBin, treatBin = keys[ndx].tolist()
+        combinations[(zone, int(popBin), treatBin)] = int(counts[ndx])
 
-            # Add to our data sets
-            rangeBins[zone][popBin].append(data[row][col])
-            if treatBin not in zoneTreatments[zone]:
-                zoneTreatments[zone].append(treatBin)
+    return rangeBins, zoneTreatments, populationBreaks, combinations
 
-    return rangeBins, zoneTreatments, populationBreaks
+# Helper function, get the unique values in the order they first appear as a list
+def ordered_unique(values):
+    _, first = np.unique(values, return_index=True)
+    return values[np.sort(first)].tolist()
 
 # Helper function, get the correct population file
 def get_population(gisPath, prefix):
     for name in ['population', 'init_pop']:
-        filename = "{}/{}_{}.asc".format(gisPath, prefix, name)
+        filename = asc.find_asc("{}/{}_{}.asc".format(gisPath, prefix, name))
         if os.path.exists(filename):
             return load(filename, "population")
     raise Exception("Could not find a population file in: {} with prefix '{}'".format(gisPath, prefix))
 
-# Helper function, load the ASC file indicated
+# Helper function, load the ASC file indicated as an array
 def load(filename, fileType):
+    filename = asc.find_asc(filename)
     if not os.path.exists(filename):
         raise Exception("Could not find {} file, tried: {}".format(fileType, filename))
-    return asc.load_asc(filename)    
+    return asc.load_asc_array(filename)
 
 
-# Bin the data provided using Jenks natural breaks optimization
-def bin_data(data, type, minimumClasses=5, maximumClasses=30, delta=0.01):
+# Bin the data provided using Jenks natural breaks optimization, if samples is
+# set and there is more data than that, the breaks are approximated using a
+# stratified sample of the data and the GVF for the full data is reported
+def bin_data(data, type, minimumClasses=5, maximumClasses=30, delta=0.01, samples=None):
 
     # Alert the user since this can take awhile for large data sets
     sys.stdout.write('Binning {}...'.format(type))
     sys.stdout.flush()
 
+    # Prepare the data, and the sample if one is being used
+    prepared = stats.prepare_gvf(data)
+    sample = prepared
+    if samples is not None:
+        sample = stats.stratified_sample(prepared, samples)
+
     # Iterate from the the minimum to the maximum number classes and 
     # return the breaks with the lowest goodness of variance fit (GVF)
     previousGvf = 0
     for classes in range(minimumClasses, maximumClasses + 1):
-        gvf, breaks = stats.goodness_of_variance_fit(data, classes)
+        gvf, breaks = stats.goodness_of_variance_fit(data, classes, sample)
+        sampleGvf = gvf
+        if sample is not prepared:
+            gvf = stats.breaks_gvf(prepared, breaks)
         if abs(previousGvf - gvf) <= delta:
             # Note that the first index contains the lower bound
             print('done!')
+            report_approximation(sample, prepared, sampleGvf, gvf)
             return breaks[1:]
         previousGvf = gvf
 
@@ -113,9 +129,58 @@ def bin_data(data, type, minimumClasses=5, maximumClasses=30, delta=0.01):
     print(classes, maximumClasses)
     if classes == maximumClasses:
         print("done!\nUnable to find optimal fit, classes = {}, GVF = {}".format(classes, gvf))
+        report_approximation(sample, prepared, sampleGvf, gvf)
         return breaks[1:]
+
+
+# Helper function, report how far the GVF of the sample is from the GVF for
+# the full data when the breaks were approximated
+def report_approximation(sample, prepared, sampleGvf, gvf):
+    if sample is prepared:
+        return
+    print("Approximated using {:,} of {:,} values, GVF = {:.6f}, sample GVF = {:.6f}, difference = {:.6f}".format(
+        len(sample[0]), len(prepared[0]), gvf, sampleGvf, sampleGvf - gvf))
     
 
+# Plan the next round of adaptive calibration runs using the results so far,
+# the runs are saved as a CSV file with a script to run them
+def write_plan(ranges, treatments, combinations, prefix, args):
+    runs = planner.load_runs(args.results) if args.results else {}
+    rows, unreachable, stalled = planner.plan(ranges, treatments, runs, args.tolerance, combinations, args.interpolate)
+    if args.prioritize:
+        rows.sort(key=lambda row: -combinations[(row[0], row[1], row[2])])
+    for zone, population, treatment in unreachable:
+        print("Warning: PfPR for zone {}, population {}, access {} cannot be reached with betas up to {}".format(
+            zone, population, treatment, planner.MAX_BETA))
+    for zone, population, treatment in stalled:
+        print("Warning: PfPR for zone {}, population {}, access {} cannot be resolved to within {}, "
+              "the betas needed have already been run".format(zone, population, treatment, args.tolerance))
+
+    bins = len(combinations)
+    if len(rows) == 0:
+        unresolved = len(set(unreachable) | set(stalled))
+        if unresolved > 0:
+            print("\n{} of {} bins are not resolved to within {} PfPR, nothing to run".format(
+                unresolved, bins, args.tolerance))
+        else:
+            print("\nAll {} bins are resolved to within {} PfPR, nothing to run".format(bins, args.tolerance))
+        return
+    print("\nPlanned {} runs for {} bins, the sweep is {} runs".format(
+        len(rows), len({tuple(row[:3]) for row in rows}), bins * planner.SWEEP_RUNS))
+
+    with open('out/calibration.csv', 'w', newline='') as output:
+        csv.writer(output).writerows(rows)
+    populations = {row[1] for row in rows}
+    zones = dict.fromkeys(row[0] for row in rows)
+    if args.username and args.array:
+        bash.reduce_cluster_array('out/calibration.sh', prefix, populations, zones, 'calibration.csv', len(rows),
+                                  args.array)
+    elif args.username:
+        bash.reduce_cluster('out/calibration.sh', prefix, populations, zones, 'calibration.csv', args.username)
+    else:
+        bash.reduce_local('out/calibration.sh', prefix, populations, zones, 'calibration.csv')
+
+
 def main(args):
     # Check to see if it looks like there is a country prefix
     prefix = args.prefix
@@ -136,7 +201,8 @@ def main(args):
 
     # Process and print the relevant ranges for the user
     try:
-        [ranges, treatments, breaks] = process(args.configuration, args.gis, prefix, args.type)
+        [ranges, treatments, breaks, combinations] = process(
+            args.configuration, args.gis, prefix, args.type, args.samples)
         for zone in ranges.keys():
             if len(ranges.keys()) != 1: print("\nClimate Zone {}".format(int(zone)))
             print("Treatments: {}".format(sorted(treatments[zone])))
@@ -144,13 +210,22 @@ def main(args):
             for bin in sorted(ranges[zone].keys()):
                 print("{} - {} to {} {}".format(bin, min(ranges[zone][bin]), max(ranges[zone][bin]), label))
             print
+        total = sum([len(breaks) * len(treatments[zone]) for zone in ranges.keys()])
+        print("\n{} of {} combinations of zone, population, and treatment occur on the map".format(
+            len(combinations), total))
 
         # Save the bash script
         os.makedirs('out', exist_ok=True)
-        if args.username: 
-            bash.run_cluster(ranges, treatments, breaks, 'out/calibration.sh', prefix, args.username)
+        if args.adaptive:
+            write_plan(ranges, treatments, combinations, prefix, args)
+        elif args.username and args.array:
+            bash.run_cluster_array(ranges, treatments, breaks, 'out/calibration.sh', 'manifest.csv', prefix, args.array,
+                                   combinations, args.prioritize)
+        elif args.username:
+            bash.run_cluster(ranges, treatments, breaks, 'out/calibration.sh', prefix, args.username, combinations,
+                             args.prioritize)
         else: 
-            bash.run_local(ranges, treatments, breaks, 'out/calibration.sh', prefix)
+            bash.run_local(ranges, treatments, breaks, 'out/calibration.sh', prefix, combinations, args.prioritize)
             
     except Exception as ex:
         print(ex)
@@ -170,7 +245,46 @@ if __name__ == '__main__':
         help='Optional, default \'pfpr\', the type of processing to be done either \'pfpr\' or \'incidence\'')
     parser.add_argument('-u', action='store', dest='username', required=False,
         help='Optional, if supplied scripts will be produced to run on the cluster with the user indicated')    
+    parser.add_argument('-a', action='store', dest='samples', type=int, required=False,
+        help='Optional, approximate the natural breaks using a stratified sample of the size given')
+    parser.add_argument('--prioritize', action='store_true', dest='prioritize',
+        help='Optional, run the combinations of zone, population, and treatment that cover the most cells first')
+    parser.add_argument('--array', action='store', dest='array', type=int, required=False,
+        help='Optional, with -u, submit the runs as a SLURM job array with the number of runs per task given')
+    parser.add_argument('--adaptive', action='store_true', dest='adaptive',
+        help='Optional, plan the next round of an adaptive search for the betas instead of the full sweep')
+    parser.add_argument('-r', action='store', dest='results', required=False,
+        help='Optional, with --adaptive, the CSV file, or calibration store (.db, .sqlite), with the results so far')
+    parser.add_argument('--tolerance', action='store', dest='tolerance', type=float, default=planner.TOLERANCE,
+        help='Optional, with --adaptive, the largest gap in PfPR between runs, default {}'.format(planner.TOLERANCE))
+    parser.add_argument('--interpolate', action='store_true', dest='interpolate',
+        help='Optional, with --adaptive, plan for betas interpolated by createBetaMap.py --interpolate, cells '
+             'between two runs are resolved once the interpolation is within the tolerance')
     args = parser.parse_args()
 
+    # The adaptive search is based upon the PfPR
+    if args.results and not args.adaptive:
+        print("The -r option requires --adaptive")
+        exit(cl.EXIT_FAILURE)
+    if args.interpolate and not args.adaptive:
+        print("The --interpolate option requires --adaptive")
+        exit(cl.EXIT_FAILURE)
+    if args.adaptive and args.type != 'pfpr':
+        print("The adaptive search can only be used with the pfpr type")
+        exit(cl.EXIT_FAILURE)
+    if args.tolerance <= 0:
+        print("The tolerance must be greater than zero")
+        exit(cl.EXIT_FAILURE)
+
+    # Job arrays are only used on the cluster
+    if args.array is not None and (args.array < 1 or not args.username):
+        print("The --array option requires a username and at least one run per task")
+        exit(cl.EXIT_FAILURE)
+
+    # The sample needs to be large enough for the maximum number of classes
+    if args.samples is not None and args.samples < 100:
+        print("The sample size should be at least 100, got {}".format(args.samples))
+        exit(cl.EXIT_FAILURE)
+
     # Defer to main
     main(args)
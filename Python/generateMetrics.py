@@ -4,100 +4,100 @@
 #
 # This module contains functions relevant to getting metrics from ASC files.
 import argparse
+import numpy as np
 import os
 import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
 import include.ascFile as asc
-
-# Note some constants
-NUMERATOR, DENOMINATOR = 0, 1
- 
-def calculate(gisPath, prefix, division, populationFilename=None):
-
-    # Attempt to load the files
-    filename = "{}/{}_{}.asc".format(gisPath, prefix, division)
-    header, district = load(filename, division)        
-    filename = "{}/{}_pfpr2to10.asc".format(gisPath, prefix)
-    _, pfpr = load(filename, "PfPR")
-
+import include.zonal as zonal
+
+def calculate(gisPath, prefix, divisions, populationFilename=None):
+    # Allow a single division to be supplied
+    if isinstance(divisions, str):
+        divisions = [divisions]
+
+    # Make sure the files exist
+    filenames = []
+    for division in divisions:
+        filenames.append(check("{}/{}_{}.asc".format(gisPath, prefix, division), division))
+    filenames.append(check("{}/{}_pfpr2to10.asc".format(gisPath, prefix), "PfPR"))
     if populationFilename is None:
-        filename = "{}/{}_population.asc".format(gisPath, prefix)
-    else:
-        filename = populationFilename
-    _, population = load(filename, "population")
-
-    # Loop over the data that's been loaded
-    data = {}
-    cells = 0
-    totalPopulation = 0
-    for row in range(header['nrows']):
-        for col in range(header['ncols']):
-            # Continue if there is no data
-            if district[row][col] == header['nodata']:
-                continue
-
-            # Create the district if it does not exist
-            key = district[row][col]
-            if not key in data.keys():
-                data[key] = [0, 0]
-
-            # Warn the user if there is a no data in the PfPR
-            if pfpr[row][col] == header['nodata']:
-                print('No data in PfPR values at {}, {}'.format(row, col))
-
-            data[key][NUMERATOR] += pfpr[row][col] * population[row][col]
-            data[key][DENOMINATOR] += population[row][col]
-            totalPopulation += population[row][col]
-            cells += 1
-
-    # Write the weighted values to disk
-    numerator = 0
-    denominator = 0
-    filename = "weighted_pfpr_{}.csv".format(division)
-    print("Saving data to: {}".format(filename))
-    with open(filename, 'w') as out:
-        for key in sorted(data.keys()):
-            numerator += data[key][NUMERATOR]
-            denominator += data[key][DENOMINATOR]
-            result = round((data[key][NUMERATOR] / data[key][DENOMINATOR]) * 100, 2)
-            message = "{}: {}, PfPR: {}%".format(division.capitalize(), int(key), result)
-            
-            out.write("{},{}\n".format(int(key), result))
-            print(message)
+        populationFilename = "{}/{}_population.asc".format(gisPath, prefix)
+    filenames.append(check(populationFilename, "population"))
+
+    # Calculate the weighted PfPR for each division in one pass over the files
+    header = asc.load_header(filenames[0])
+    accumulator = zonal.ZonalAccumulator(divisions, ['pfpr'], nodata=header['nodata'])
+    missing = {division: [] for division in divisions}
+    cells = {division: 0 for division in divisions}
+    totalPopulation = {division: 0 for division in divisions}
+    for start, blocks in asc.iter_rows(filenames):
+        zones = dict(zip(divisions, blocks))
+        pfpr, population = blocks[-2:]
+        accumulator.add(zones, {'pfpr': pfpr}, weights=population)
+
+        # Note the no data in the PfPR, and the totals for each division
+        for division in divisions:
+            valid = zones[division] != header['nodata']
+            missing[division].extend((np.argwhere(valid & (pfpr == header['nodata'])) + [start, 0]).tolist())
+            cells[division] += int(np.count_nonzero(valid))
+            totalPopulation[division] += population[valid].sum()
+    data = accumulator.results()
 
     # Calculate the initial population if present
     initial = calculate_initial(gisPath, prefix)
 
-    result = round(numerator * 100 / denominator, 2)
-    print("\nFull Map, PfPR: {0}%".format(result))
-    print("Population: {:,}".format(totalPopulation))
-    if initial is not None:
-        print("Initial Population: {:,}".format(initial))
-    print("Cells: {}\n".format(cells))
+    for division in divisions:
+        # Warn the user if there is a no data in the PfPR
+        for row, col in missing[division]:
+            print('No data in PfPR values at {}, {}'.format(row, col))
+
+        # Write the weighted values to disk
+        numerator = 0
+        denominator = 0
+        filename = "weighted_pfpr_{}.csv".format(division)
+        print("Saving data to: {}".format(filename))
+        with open(filename, 'w') as out:
+            results = data[division]
+            for key, weighted, total in zip(results['ids'].tolist(), results['sum']['pfpr'].tolist(),
+                                            results['weight'].tolist()):
+                numerator += weighted
+                denominator += total
+                result = round((weighted / total) * 100, 2)
+                message = "{}: {}, PfPR: {}%".format(division.capitalize(), int(key), result)
+
+                out.write("{},{}\n".format(int(key), result))
+                print(message)
+
+        result = round(numerator * 100 / denominator, 2)
+        print("\nFull Map, PfPR: {0}%".format(result))
+        print("Population: {:,}".format(totalPopulation[division]))
+        if initial is not None:
+            print("Initial Population: {:,}".format(initial))
+        print("Cells: {}\n".format(cells[division]))
 
 
 def calculate_initial(gisPath, prefix):
     # Check to make sure the file exists
-    filename = "{}/{}_init_pop.asc".format(gisPath, prefix)
+    filename = asc.find_asc("{}/{}_init_pop.asc".format(gisPath, prefix))
     if not os.path.exists(filename):
         return None
 
     # Calculate and return the initial population value
-    population = 0
-    header, data = asc.load_asc(filename)
-    for row in range(header['nrows']):
-        for col in range(header['ncols']):
-            if data[row][col] != header['nodata']:
-                population += data[row][col]
-    return population
+    nodata = asc.load_header(filename)['nodata']
+    total = 0
+    for _, [data] in asc.iter_rows([filename]):
+        total += data[data != nodata].sum()
+    return total
 
 
-def load(filename, fileType):
+def check(filename, fileType):
+    filename = asc.find_asc(filename)
     if not os.path.exists(filename):
         print("Could not find {} file, tried: {}".format(fileType, filename))
         exit(1)
-    return asc.load_asc(filename)    
+    return filename
 
 
 if __name__ == '__main__':
@@ -107,16 +107,17 @@ if __name__ == '__main__':
         help='The path to the directory that the GIS files can be found in')
     parser.add_argument('-p', action='store', dest='prefix', required=True,
         help='The country code prefix used')        
-    parser.add_argument('-d', action='store', dest='division', default='district',
-        help='(optional) District or province level metrics, default district')
+    parser.add_argument('-d', action='store', dest='division', nargs='+', default=['district'],
+        help='(optional) District and/or province level metrics, default district')
     parser.add_argument('--pf', action='store', dest='population', default=None,
         help='(optional) Population file to use when summing the total population')
     args = parser.parse_args()
 
     # Check the parameters
-    if args.division not in ("district", "province"):
-        print("Unknown division: {}, expected 'district' or 'province'".format(args.division))
-        sys.exit(1)
+    for division in args.division:
+        if division not in ("district", "province"):
+            print("Unknown division: {}, expected 'district' or 'province'".format(division))
+            sys.exit(1)
     if args.population is not None:
         print("Using population file: {}".format(args.population))
         calculate(args.gis, args.prefix, args.division, populationFilename = args.population)
@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+
+# harvestCalibration.py
+#
+# This script harvests the results of the calibration runs into the CSV file
+# (zone, population, access, beta, PfPR) used by createBetaMap.py and
+# reduceEpsilons.py. The runs are named ZONE-POPULATION-ACCESS-BETA-COUNTRY
+# (see bash/calibrationLocal.sh) and the SQLite database written by the
+# SQLitePixelReporter for each run is named after the job number (-j) of the
+# run. The job number of each run is recovered from the state file written by
+# runCalibration.py (scheduler.state) or the jobs.csv file written by
+# calibrationLocal.sh. Databases that are named after the run are read as well.
+# The PfPR is the mean of the last months of the monthly site data.
+#
+# A checkpoint of the databases that have been harvested is kept next to the
+# output so that rerunning the script only ingests new runs. Job numbers may be
+# reused by later sweeps, so a database is identified by its filename, the run
+# it belongs to, and its size and modification time.
+import argparse
+import csv
+import json
+import numpy as np
+import os
+import re
+import sqlite3
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Import our libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
+import include.calibrationLib as cl
+import include.calibrationStore as cs
+import include.scheduler as scheduler
+
+
+# Pattern for the run names, the groups are the zone, population, access, beta, and country
+NAME = r'^(\d+(?:\.0)?)-(\d+)-(\d*\.?\d+)-(\d*\.?\d+)-([a-z]{3})'
+
+# Pattern for the databases named after the job number, the group is the job
+DATABASE = r'^(?:.*\D)?(\d+)\.db$'
+
+# File written by calibrationLocal.sh with the job,name of each run queued
+JOBS = 'jobs.csv'
+
+# Extension appended to the output filename for the checkpoint
+CHECKPOINT = '.checkpoint.json'
+
+# Number of databases to send to each worker at once
+CHUNK_SIZE = 16
+
+# Query for the mean PfPR of the last months, the column is filled in based upon the age band
+QUERY = '''
+SELECT AVG({0}), COUNT(DISTINCT monthlydataid) FROM monthlysitedata
+WHERE monthlydataid IN (SELECT id FROM monthlydata ORDER BY id DESC LIMIT ?)'''
+
+
+def load_jobs(path):
+    '''
+    Load the run name of each job number from the scheduler state and jobs.csv files in the path, when a job
+    number was used for more than one run the latest entry is used since the database belongs to the last run.
+    '''
+    entries = []
+    filename = os.path.join(path, JOBS)
+    if os.path.exists(filename):
+        with open(filename) as input:
+            entries = [(int(row[0]), row[1].strip()) for row in csv.reader(input) if len(row) == 2]
+    records = scheduler.load_state(os.path.join(path, scheduler.STATE)).values()
+    entries += [(int(record['job']), record['name']) for record in records]
+
+    jobs, reused = {}, set()
+    for job, name in entries:
+        if jobs.get(job, name) != name:
+            reused.add(job)
+        jobs[job] = name
+    if len(reused) > 0:
+        print("Warning: {} job numbers were used for more than one run, the latest run is used for each".format(
+            len(reused)))
+    return jobs
+
+
+def get_parameters(name):
+    '''Get the [zone, population, access, beta] from the run name, or None if it is not a run name'''
+    match = re.search(NAME, name)
+    if match is None:
+        return None
+    zone, population, access, beta = match.groups()[:4]
+    return [str(int(float(zone))), population, access, beta]
+
+
+def find_runs(path, harvested):
+    '''
+    Find the databases in the path that have not been harvested, returns [runs, unknown] where runs is a sorted
+    list of [filename, parameters, key] and unknown is the number of databases that could not be matched to a run.
+    The key of the database is noted in the checkpoint once it is harvested.
+    '''
+    jobs = load_jobs(path)
+    runs, unknown = [], 0
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith('.db'):
+            continue
+        name = filename[:-len('.db')]
+        if get_parameters(name) is None:
+            match = re.search(DATABASE, filename)
+            name = jobs.get(int(match.group(1))) if match is not None else None
+        parameters = get_parameters(name) if name is not None else None
+        if parameters is None:
+            unknown += 1
+            continue
+        stats = os.stat(os.path.join(path, filename))
+        key = (filename, name, stats.st_size, stats.st_mtime_ns)
+        if key not in harvested:
+            runs.append([filename, parameters, key])
+    return runs, unknown
+
+
+def read_pfpr(filename, column, months):
+    '''Read the mean PfPR for the last months from the database, returns None if the run is incomplete'''
+    try:
+        connection = sqlite3.connect('file:{}?mode=ro'.format(filename), uri=True)
+        try:
+            pfpr, count = connection.execute(QUERY.format(column), (months,)).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error as err:
+        sys.stderr.write("Unable to read {}: {}\n".format(filename, str(err)))
+        return None
+    if pfpr is None or count < months:
+        return None
+    return pfpr
+
+
+def load_checkpoint(filename):
+    '''Load the set of (filename, run, size, mtime_ns) keys of the databases that have been harvested'''
+    if not os.path.exists(filename):
+        return set()
+    with open(filename) as input:
+        return set(tuple(key) for key in json.load(input)['harvested'])
+
+
+def save_checkpoint(filename, harvested):
+    '''Save the keys of the databases that have been harvested, replacing the file once it is written'''
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temporary, 'w') as output:
+        json.dump({'harvested': sorted(harvested)}, output)
+    os.replace(temporary, filename)
+
+
+def write_results(filename, column, results):
+    '''Append the results, rows of [zone, population, access, beta, pfpr], to the CSV file or calibration store'''
+    if cs.is_store(filename):
+        zones, populations, treatments, betas, pfprs = [np.array(values, dtype=float) for values in zip(*results)]
+        with cs.CalibrationStore(filename, create=True) as store:
+            store.append(column, zones, populations, treatments, pfprs, betas, replicates=True)
+        return
+
+    exists = os.path.exists(filename)
+    with open(filename, 'a', newline='') as output:
+        writer = csv.writer(output)
+        if not exists:
+            writer.writerow(['zone', 'population', 'access', 'beta', column])
+        writer.writerows(results)
+
+
+def main(path, output, age, months, jobs):
+    # Note the column to read
+    column = 'pfprunder5' if age == '0-59' else 'pfpr2to10'
+
+    # Find the runs that still need to be harvested
+    checkpoint = output + CHECKPOINT
+    harvested = load_checkpoint(checkpoint)
+    runs, unknown = find_runs(path, harvested)
+    if unknown > 0:
+        print("Skipping {} databases that do not match a run in {} or {}".format(unknown, JOBS, scheduler.STATE))
+    if len(runs) == 0:
+        print("No new runs found in {}".format(path))
+        return
+    print("Harvesting {} runs from {}".format(len(runs), path))
+
+    # Read the databases, in parallel if requested
+    filenames = [os.path.join(path, filename) for filename, _, _ in runs]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            values = list(executor.map(read_pfpr, filenames, [column] * len(runs), [months] * len(runs),
+                                       chunksize=CHUNK_SIZE))
+    else:
+        values = [read_pfpr(filename, column, months) for filename in filenames]
+
+    # Note the incomplete runs, they will be checked again the next time
+    results, incomplete = [], 0
+    for (_, parameters, key), pfpr in zip(runs, values):
+        if pfpr is None:
+            incomplete += 1
+            continue
+        results.append(parameters + [pfpr])
+        harvested.add(key)
+
+    # Save the results then the checkpoint
+    if len(results) > 0:
+        write_results(output, column, results)
+        save_checkpoint(checkpoint, harvested)
+    print("Added {} runs to {}, {} incomplete".format(len(results), output, incomplete))
+
+
+if __name__ == "__main__":
+    # Parse the parameters
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', action='store', dest='path', required=True,
+        help='The path to the directory with the SQLite databases from the calibration runs')
+    parser.add_argument('-o', action='store', dest='output', required=True,
+        help='The CSV file, or calibration store (.db, .sqlite), to append the results to')
+    parser.add_argument('-a', action='store', dest='age', default='2-10',
+        help='The age band of the PfPR, either 0-59 (months) or 2-10 (years), default 2-10')
+    parser.add_argument('-m', action='store', dest='months', type=int, default=12,
+        help='The number of months at the end of the run to average the PfPR over, default 12')
+    parser.add_argument('-j', action='store', dest='jobs', type=int, default=os.cpu_count(),
+        help='The number of databases to read in parallel, default is the number of processors')
+    args = parser.parse_args()
+
+    # Check the parameters
+    if args.age not in ('0-59', '2-10'):
+        sys.stderr.write("Unknown age band: {}, expected 0-59 or 2-10\n".format(args.age))
+        sys.exit(cl.EXIT_FAILURE)
+    if args.months < 1 or args.jobs < 1:
+        sys.stderr.write("The months and jobs must be at least one\n")
+        sys.exit(cl.EXIT_FAILURE)
+    if not os.path.isdir(args.path):
+        sys.stderr.write("The directory, {}, does not appear to exist\n".format(args.path))
+        sys.exit(cl.EXIT_FAILURE)
+
+    # Defer to main for everything else
+    main(args.path, args.output, args.age, args.months, args.jobs)
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+# importCalibration.py
+#
+# This script appends the calibration results in one or more CSV files to a
+# calibration store (SQLite database), creating the store if needed. Rows that
+# are already in the store are skipped, so a file can be imported again, or
+# concatenated with new results and imported, while replicates are kept.
+import argparse
+import os
+import sys
+
+# Import our libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
+import include.calibrationLib as cl
+import include.calibrationStore as cs
+
+
+def main(store, filenames):
+    with cs.CalibrationStore(store, create=True) as database:
+        for filename in filenames:
+            try:
+                added, total = database.append_csv(filename)
+            except (OSError, ValueError) as err:
+                sys.stderr.write("Unable to import {}\n{}\n".format(filename, str(err)))
+                sys.exit(cl.EXIT_FAILURE)
+            print("Added {} of {} rows from {}".format(added, total, filename))
+        print("{} rows in {}".format(len(database), store))
+
+
+if __name__ == "__main__":
+    # Parse the parameters
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', action='store', dest='store', required=True,
+        help='The filename and path of the calibration store (.db, .sqlite) to append to')
+    parser.add_argument('-i', action='store', dest='filenames', nargs='+', required=True,
+        help='The CSV file(s) with the calibration data to import')
+    args = parser.parse_args()
+
+    # Check the store
+    if not cs.is_store(args.store):
+        sys.stderr.write("The calibration store must have one of the extensions: {}\n".format(", ".join(cs.EXTENSIONS)))
+        sys.exit(cl.EXIT_FAILURE)
+
+    # Defer to main for everything else
+    main(args.store, args.filenames)
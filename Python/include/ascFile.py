@@ -1,8 +1,45 @@
 # ascFile.py
 #
 # This module contains some common functions for working with ASC files.
+import gzip
+import hashlib
+import io
+import json
+import numpy as np
+import os
 import sys
 
+from contextlib import ExitStack
+from itertools import islice
+
+# Optional, zstandard is only needed for .zst files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Extensions of the compressed ASC files that are supported, and the pattern
+# that matches the filenames of ASC files
+COMPRESSED = ['.gz', '.zst']
+ASC_PATTERN = r'\.asc(\.gz|\.zst)?$'
+
+# Extension appended to the ASC filename for the row offset index
+ROW_INDEX = '.rows.npz'
+
+# Number of cells to format at once when writing, and to parse at once when
+# streaming rows
+WRITE_BLOCK = 1048576
+READ_BLOCK = 1048576
+
+# Environment variables that enable the raster cache in a directory, and the
+# size limit in bytes for it
+CACHE_VARIABLE = 'MASIM_ASC_CACHE'
+CACHE_LIMIT_VARIABLE = 'MASIM_ASC_CACHE_LIMIT'
+CACHE_LIMIT = 4 * 1024 ** 3
+
+# The raster cache settings, when None the environment variables are used
+cache = None
+
 
 # Compare the two header files, return True if they are the same, False otherwise.
 # If printError is set, then errors will be printed to stderr
@@ -38,26 +75,27 @@ def compare_header(one, two, printError=True):
 # Compare the two data sections, return True if they are the same, False otherwise.
 # If printError is set, then errors will be printed to stderr
 def compare_data(one, two, nodata, printError=True, errorLimit=-1):
-    result = True
-    count = 0
-    for row in range(0, len(one)):
-        for col in range(0, len(one[row])):
-            # Set the values
-            a = one[row][col]
-            b = two[row][col]
-
-            # Are they both nodata
-            if (a == nodata and a != b) or (b == nodata and a != b):
-                result = False
-                count += 1
-                if printError:
-                    if errorLimit == -1 or count < errorLimit:
-                        sys.stderr.write('Mismatched nodata at {}, {}\n'.format(row, col))
-                        sys.stderr.write('One: {}, Two {}\n'.format(a, b))
+    one, two = np.asarray(one), np.asarray(two)
+
+    # Find the cells where only one of the values is nodata, in row order
+    cells = np.argwhere(((one == nodata) | (two == nodata)) & (one != two))
+    count = len(cells)
+    if printError:
+        limit = count if errorLimit == -1 else max(0, min(count, errorLimit - 1))
+        for row, col in cells[:limit].tolist():
+            sys.stderr.write('Mismatched nodata at {}, {}\n'.format(row, col))
+            sys.stderr.write('One: {}, Two {}\n'.format(one[row, col], two[row, col]))
 
     if errorLimit != -1 and count > errorLimit:
         sys.stderr.write('Plus {} additional errors\n'.format(count - errorLimit))
-    return result
+    return count == 0
+
+
+# Get the fingerprint of the nodata mask, which is the hash of the mask packed
+# as a bitmap along with its shape
+def get_mask_hash(mask):
+    bits = np.packbits(np.asarray(mask, dtype=bool))
+    return '{}:{}'.format(mask.shape, hashlib.sha1(bits.tobytes()).hexdigest())
 
 
 # Generate an ASC header with values zeroed
@@ -72,44 +110,386 @@ def get_header():
     return header
 
 
-# Read the ASC file and return the header / data
+# Read the header values from the open ASC file, leaving it positioned at the data
+def read_header(input):
+    header = {}
+    header['ncols'] = int(input.readline().split()[1])
+    header['nrows'] = int(input.readline().split()[1])
+    header['xllcorner'] = float(input.readline().split()[1])
+    header['yllcorner'] = float(input.readline().split()[1])
+    header['cellsize'] = float(input.readline().split()[1])
+    header['nodata'] = int(input.readline().split()[1])
+    return header
+
+
+# Open the ASC file, which may be compressed with gzip (.gz) or zstandard (.zst)
+# based upon the extension of the filename, unless the compression is supplied.
+# Compressed files are decoded as a stream so there is no temporary file.
+def open_asc(filename, mode='rt', compression=None):
+    if compression is None:
+        compression = get_compression(filename)
+    if compression == '.gz':
+        return gzip.open(filename, mode)
+    if compression == '.zst':
+        if zstandard is None:
+            raise ImportError('The zstandard package is required for {}'.format(filename))
+        if 'r' in mode:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'))
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(open(filename, 'wb'))
+        return stream if 'b' in mode else io.TextIOWrapper(stream)
+    return open(filename, mode)
+
+
+# Get the compression used by the ASC file based upon the extension, or None
+def get_compression(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return extension if extension in COMPRESSED else None
+
+
+# Find the ASC file, if the filename does not exist then a compressed version
+# of it is returned if one exists, otherwise the filename is returned as-is
+def find_asc(filename):
+    if not os.path.exists(filename):
+        for extension in COMPRESSED:
+            if os.path.exists(filename + extension):
+                return filename + extension
+    return filename
+
+
+# Read the ASC file and return the header / data, the data is returned as a
+# list of rows so that it can be indexed as data[row][col]
 def load_asc(filename):
-    with open(filename) as input:
-        lines = input.readlines()
+    header, data, _ = load_asc_array(filename)
+    return header, data.tolist()
+
+
+# Read the ASC file and return the header / data / mask, where the data is a
+# contiguous float array with the shape (nrows, ncols) and the mask is True
+# where the data is nodata. If the raster cache is enabled then the data will
+# be loaded from the cache when possible.
+def load_asc_array(filename):
+    directory, limit = get_cache()
+    if directory is not None:
+        return load_cached(filename, directory, limit)
+    return parse_asc(filename)
+
+
+# Parse the ASC file and return the header / data / mask
+def parse_asc(filename):
+    with open_asc(filename) as input:
+        header = read_header(input)
+
+        # Parse the data block in one pass
+        size = header['nrows'] * header['ncols']
+        data = np.fromstring(input.read(), sep=' ')
+        if data.size < size:
+            raise ValueError('Expected {} values in {}, found {}'.format(size, filename, data.size))
+        data = np.ascontiguousarray(data[:size].reshape(header['nrows'], header['ncols']))
+
+        return header, data, data == header['nodata']
+
+
+# Enable the raster cache in the directory given, limited to the number of
+# bytes indicated. Setting the directory to None disables the cache.
+def set_cache(directory, limit=CACHE_LIMIT):
+    global cache
+    cache = (directory, limit)
+
+
+# Get the raster cache directory and size limit, if the cache has not been set
+# then the environment variables are checked. The directory is None when the
+# cache is disabled.
+def get_cache():
+    if cache is not None:
+        return cache
+    limit = int(os.environ.get(CACHE_LIMIT_VARIABLE, CACHE_LIMIT))
+    return os.environ.get(CACHE_VARIABLE), limit
+
+
+# Load the ASC file via the cache, the data is parsed and stored as a .npy file
+# when there is no entry or the source file has changed (size or mtime). Cached
+# data is memory mapped copy-on-write so callers may still update it.
+def load_cached(filename, directory, limit):
+    # Note the source file and the entry for it
+    stats = os.stat(filename)
+    source = {'path': os.path.abspath(filename), 'size': stats.st_size, 'mtime': stats.st_mtime_ns}
+    key = os.path.join(directory, hashlib.sha1(source['path'].encode('utf-8')).hexdigest())
+
+    # Return the cached data if the entry is valid
+    try:
+        with open(key + '.json') as input:
+            entry = json.load(input)
+        if entry['source'] == source:
+            data = np.load(key + '.npy', mmap_mode='c')
+            os.utime(key + '.json')
+            return entry['header'], data, data == entry['header']['nodata']
+    except (OSError, ValueError, KeyError):
+        pass
 
-        # Read the header values
-        header = {}
-        header['ncols'] = int(lines[0].split()[1])
-        header['nrows'] = int(lines[1].split()[1])
-        header['xllcorner'] = float(lines[2].split()[1])
-        header['yllcorner'] = float(lines[3].split()[1])
-        header['cellsize'] = float(lines[4].split()[1])
-        header['nodata'] = int(lines[5].split()[1])
+    # Parse the file and store it, writing to temporary files first so that
+    # concurrent processes never see a partial entry
+    header, data, mask = parse_asc(filename)
+    os.makedirs(directory, exist_ok=True)
+    temporary = '{}.{}.tmp'.format(key, os.getpid())
+    with open(temporary, 'wb') as output:
+        np.save(output, data)
+    os.replace(temporary, key + '.npy')
+    with open(temporary, 'w') as output:
+        json.dump({'source': source, 'header': header}, output)
+    os.replace(temporary, key + '.json')
 
-        # Read the rest of the entries
-        data = []
-        for ndx in range(6, header['nrows'] + 6):
-            row = [float(value) for value in lines[ndx].split()]
-            data.append(row)
+    # Make sure the cache is within the limit
+    evict_cache(directory, limit)
+    return header, data, mask
 
-        return header, data
 
+# Get the zero indexed (row, col) of the cell that contains the coordinates
+# given, based upon the header
+def get_cell(header, x, y):
+    col = int(np.floor((x - header['xllcorner']) / header['cellsize']))
+    row = header['nrows'] - 1 - int(np.floor((y - header['yllcorner']) / header['cellsize']))
+    return row, col
 
-# Write an ASC file using the data provided
-def write_asc(header, data, filename):
-    with open(filename, 'w') as output:
+
+# Apply the edits, a dictionary of values by (row, col), to the ASC file in a
+# single pass. Only the rows that contain an edit are reformatted, all other
+# lines are copied as-is, and the file is replaced once the pass is complete.
+# Assumes that each row of data is on its own line as written by write_asc.
+def edit_asc(filename, edits):
+    # Group the edits by row
+    rows = {}
+    for (row, col), value in edits.items():
+        rows.setdefault(row, {})[col] = value
+
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open_asc(filename) as input, open_asc(temporary, 'wt', get_compression(filename)) as output:
+            # Copy the header, checking the edits against it
+            lines = [input.readline() for _ in range(6)]
+            header = read_header(io.StringIO(''.join(lines)))
+            for row, col in edits:
+                if not (0 <= row < header['nrows'] and 0 <= col < header['ncols']):
+                    raise ValueError('Cell {}, {} is outside of {}'.format(row, col, filename))
+            output.writelines(lines)
+
+            # Copy the data, updating the rows with edits
+            for row, line in enumerate(input):
+                if row in rows:
+                    values = line.split()
+                    if len(values) != header['ncols']:
+                        raise ValueError('Expected {} values on row {} of {}, found {}'.format(
+                            header['ncols'], row, filename, len(values)))
+                    for col, value in rows[row].items():
+                        values[col] = '{0:.8g}'.format(value)
+                    line = ' '.join(values) + '\n'
+                output.write(line)
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+# Load the byte offset of each data row for the ASC file, using the index
+# stored next to the file if it is present and the file has not changed
+# (size or mtime). If sidecar is set then a new index is written after the
+# file is scanned. Returns the header and the offsets.
+def load_row_index(filename, sidecar=True):
+    stats = os.stat(filename)
+    source = np.array([stats.st_size, stats.st_mtime_ns], dtype=np.int64)
+    if sidecar:
+        try:
+            with np.load(filename + ROW_INDEX) as data:
+                if np.array_equal(data['source'], source):
+                    return json.loads(str(data['header'])), data['offsets']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    header, offsets = build_row_index(filename)
+    if sidecar:
+        temporary = '{}.{}.tmp'.format(filename + ROW_INDEX, os.getpid())
+        try:
+            with open(temporary, 'wb') as output:
+                np.savez(output, header=json.dumps(header), offsets=offsets, source=source)
+            os.replace(temporary, filename + ROW_INDEX)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+    return header, offsets
+
+
+# Scan the ASC file and return the header and the byte offset of each data
+# row. Assumes that each row of data is on its own line as written by write_asc.
+def build_row_index(filename):
+    if get_compression(filename) is not None:
+        raise ValueError('Row offsets are not supported for compressed files, {}'.format(filename))
+    with open(filename, 'rb') as input:
+        header = read_header(input)
+        offsets = np.zeros(header['nrows'], dtype=np.int64)
+        position = input.tell()
+        for row in range(header['nrows']):
+            line = input.readline()
+            if not line:
+                raise ValueError('Expected {} rows in {}, found {}'.format(header['nrows'], filename, row))
+            offsets[row] = position
+            position += len(line)
+    return header, offsets
+
+
+# Read the values of the cells, a list of (row, col), from the ASC file by
+# seeking to the rows that contain them, returns a list of the values in the
+# same order as the cells. Compressed files cannot be seeked so they are read
+# up to the last row needed instead.
+def read_cells(filename, cells):
+    offsets = None
+    if get_compression(filename) is None:
+        header, offsets = load_row_index(filename)
+    else:
+        header = load_header(filename)
+    needed = sorted(set(row for row, _ in cells))
+    for row in needed:
+        if not 0 <= row < header['nrows']:
+            raise ValueError('Row {} is outside of {}'.format(row, filename))
+
+    # Parse each row that is needed once
+    rows = {}
+    if offsets is not None:
+        with open(filename, 'rb') as input:
+            for row in needed:
+                input.seek(offsets[row])
+                rows[row] = input.readline().split()
+    elif len(needed) > 0:
+        with open_asc(filename) as input:
+            read_header(input)
+            wanted = set(needed)
+            for row, line in enumerate(islice(input, needed[-1] + 1)):
+                if row in wanted:
+                    rows[row] = line.split()
+
+    values = []
+    for row, col in cells:
+        if not 0 <= col < header['ncols']:
+            raise ValueError('Column {} is outside of {}'.format(col, filename))
+        values.append(float(rows[row][col]))
+    return values
+
+
+# Remove the least recently used entries from the cache until it is within
+# the limit given, in bytes
+def evict_cache(directory, limit):
+    entries, total = [], 0
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        key = os.path.join(directory, filename[:-5])
+        try:
+            size = os.path.getsize(key + '.json') + os.path.getsize(key + '.npy')
+            entries.append((os.path.getmtime(key + '.json'), size, key))
+            total += size
+        except OSError:
+            continue
+
+    for _, size, key in sorted(entries):
+        if total <= limit:
+            break
+        for extension in ('.json', '.npy'):
+            try:
+                os.remove(key + extension)
+            except OSError:
+                pass
+        total -= size
+
+
+# Write an ASC file using the data provided, the data may be either nested
+# lists or an array. If compress is set then the file will be written with gzip,
+# otherwise the extension of the filename determines the compression.
+def write_asc(header, data, filename, compress=False):
+    with AscWriter(header, filename, compress) as writer:
+        writer.write(np.asarray(data, dtype=float)[:header['nrows']])
+
+
+# Incremental writer for ASC files, the header is written when the file is
+# opened and blocks of rows are appended as they are produced so that the
+# whole raster never needs to be in memory, e.g.,
+#
+#   with AscWriter(header, filename) as writer:
+#       for _, [data] in iter_rows([source]):
+#           writer.write(data)
+class AscWriter:
+    def __init__(self, header, filename, compress=False):
+        self.output = open_asc(filename, 'wt', '.gz' if compress else None)
 
         # Write the header values
-        output.write('ncols         ' + str(header['ncols']) + '\n')
-        output.write('nrows         ' + str(header['nrows']) + '\n')
-        output.write('xllcorner     ' + str(header['xllcorner']) + '\n')
-        output.write('yllcorner     ' + str(header['yllcorner']) + '\n')
-        output.write('cellsize      ' + '{0:.8g}'.format(header['cellsize']) + '\n')
-        output.write('NODATA_value  ' + str(header['nodata']) + '\n')
-
-        # Write the data
-        for ndx in range(0, header['nrows']):
-            row = ['{0:.8g}'.format(value) for value in data[ndx]]
-            row = ' '.join(row)
-            output.write(row)
-            output.write('\n')
+        self.output.write('ncols         ' + str(header['ncols']) + '\n')
+        self.output.write('nrows         ' + str(header['nrows']) + '\n')
+        self.output.write('xllcorner     ' + str(header['xllcorner']) + '\n')
+        self.output.write('yllcorner     ' + str(header['yllcorner']) + '\n')
+        self.output.write('cellsize      ' + '{0:.8g}'.format(header['cellsize']) + '\n')
+        self.output.write('NODATA_value  ' + str(header['nodata']) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Write the rows, a two dimensional array, formatting a block of rows at a time
+    def write(self, rows):
+        rows = np.asarray(rows, dtype=float)
+        for text in format_rows(rows):
+            self.output.write(text)
+
+    def close(self):
+        self.output.close()
+
+
+# Read the header of the ASC file
+def load_header(filename):
+    with open_asc(filename) as input:
+        return read_header(input)
+
+
+# Read the ASC files, which must be aligned, in lockstep and yield the index of
+# the first row in the block along with a list of the blocks of rows from each
+# file as arrays. Only one block of rows from each file is held in memory at a
+# time. Assumes that each row of data is on its own line as written by write_asc.
+def iter_rows(filenames, block=READ_BLOCK):
+    with ExitStack() as stack:
+        inputs = [stack.enter_context(open_asc(filename)) for filename in filenames]
+        headers = [read_header(input) for input in inputs]
+        for filename, header in zip(filenames[1:], headers[1:]):
+            if not compare_header(headers[0], header, printError=False):
+                raise ValueError('{} is not aligned with {}'.format(filename, filenames[0]))
+
+        # Parse a block of rows from each file at a time
+        nrows, ncols = headers[0]['nrows'], headers[0]['ncols']
+        count = max(1, block // max(1, ncols))
+        for start in range(0, nrows, count):
+            rows = min(count, nrows - start)
+            yield start, [read_rows(input, rows, ncols, filename) for input, filename in zip(inputs, filenames)]
+
+
+# Read the number of rows indicated from the open ASC file and return them as
+# an array with the shape (rows, ncols)
+def read_rows(input, rows, ncols, filename):
+    data = np.fromstring(''.join(islice(input, rows)), sep=' ')
+    if data.size < rows * ncols:
+        raise ValueError('Expected {} values in block of {}, found {}'.format(rows * ncols, filename, data.size))
+    return data[:rows * ncols].reshape(rows, ncols)
+
+
+# Format the rows of the array provided as ASC data, values are written using
+# the '{0:.8g}' format with a space between columns and a newline after each
+# row. The text is yielded in blocks of WRITE_BLOCK cells.
+def format_rows(data):
+    if data.size == 0:
+        yield '\n' * len(data)
+        return
+
+    # Build the format for a block and apply it to as many rows as possible
+    nrows, ncols = data.shape
+    block = max(1, WRITE_BLOCK // ncols)
+    template = ' '.join(['%.8g'] * ncols) + '\n'
+    for ndx in range(0, nrows, block):
+        values = data[ndx:ndx + block]
+        yield (template * len(values)) % tuple(values.ravel().tolist())
@@ -4,12 +4,21 @@
 # run locally or on the cluster. The functions are intentionally pretty similar
 # since it's unclear how much they might drift over time as local versus 
 # cluster environments change.
+import csv
+import os
 import pathlib
 import stat
 
+import scheduler
+
+
+# The largest job array to submit, SLURM defaults to a MaxArraySize of 1001
+MAX_ARRAY = 1000
+
 
 # Prepare the script that will run the initial beta sweep on the cluster
-def run_cluster(pfpr, treatments, populationBreaks, filename, prefix, username):
+def run_cluster(pfpr, treatments, populationBreaks, filename, prefix, username, combinations=None, prioritize=False):
+    sweeps = get_sweeps(pfpr, treatments, populationBreaks, combinations, prioritize)
     with open(filename, 'w') as script:
         # Print the front matter
         script.write("#!/bin/bash\n")
@@ -18,16 +27,16 @@ def run_cluster(pfpr, treatments, populationBreaks, filename, prefix, username):
 
         # Print the ASC file generation commands
         script.write("generateAsc \"\\\"{}\\\"\"\n".format(
-            " ".join([str(int(x)) for x in sorted(populationBreaks)])))
+            " ".join([str(int(x)) for x in get_populations(sweeps)])))
         script.write("generateZoneAsc \"\\\"{}\\\"\"\n\n".format(
             " ".join([str(int(x)) for x in sorted(pfpr.keys())])))
 
         # Print the zone matter
-        for zone in pfpr.keys():
+        for zone, populations, accesses in sweeps:
             script.write("run {} \"\\\"{}\\\"\" \"\\\"{}\\\"\" {} {}\n".format(
                 zone,
-                " ".join([str(int(x)) for x in sorted(populationBreaks)]),
-                " ".join([str(x) for x in sorted(treatments[zone])]),
+                " ".join([str(int(x)) for x in populations]),
+                " ".join([str(x) for x in accesses]),
                 prefix, username))
 
     # Set the file as executable
@@ -56,6 +65,83 @@ def reduce_cluster(filename, prefix, population, zones, reduction, username):
     script.chmod(script.stat().st_mode | stat.S_IEXEC)            
 
 
+# Prepare the script that will run the initial beta sweep on the cluster as a
+# job array, the runs are written to the manifest next to the script
+def run_cluster_array(pfpr, treatments, populationBreaks, filename, manifest, prefix, chunk, combinations=None,
+                      prioritize=False):
+    sweeps = get_sweeps(pfpr, treatments, populationBreaks, combinations, prioritize)
+    runs = []
+    for zone, populations, accesses in sweeps:
+        runs.extend(scheduler.sweep_runs(str(zone), [str(int(x)) for x in populations], [str(x) for x in accesses]))
+    with open(os.path.join(os.path.dirname(filename), manifest), 'w', newline='') as output:
+        csv.writer(output, lineterminator='\n').writerows(runs)
+
+    with open(filename, 'w') as script:
+        # Print the front matter
+        script.write("#!/bin/bash\n")
+        script.write("source ./calibrationCluster.sh\n\n")
+        script.write("checkDependencies {} array.job\n\n".format(prefix))
+
+        # Print the ASC file generation commands
+        script.write("generateAsc \"\\\"{}\\\"\"\n".format(
+            " ".join([str(int(x)) for x in get_populations(sweeps)])))
+        script.write("generateZoneAsc \"\\\"{}\\\"\"\n\n".format(
+            " ".join([str(int(x)) for x in sorted(pfpr.keys())])))
+
+        # Print the submission for the manifest
+        script.write("runArray '{}' {} {}\n".format(manifest, prefix, get_chunk(len(runs), chunk)))
+
+    # Set the file as executable
+    script = pathlib.Path(filename)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+# Prepare the script that will use a CSV file to refine the betas on the cluster
+# as a job array, the CSV file is used as the manifest
+def reduce_cluster_array(filename, prefix, population, zones, reduction, count, chunk):
+    with open(filename, "w") as script:
+        # Print the front matter
+        script.write("#!/bin/bash\n")
+        script.write("source ./calibrationCluster.sh\n")
+        script.write("checkDependencies {} array.job\n".format(prefix))
+
+        # Print the ASC file generation commands
+        value = " ".join([str(int(x)) for x in sorted(population)])
+        script.write("generateAsc \"\\\"{}\\\"\"\n".format(value.strip()))
+        value = " ".join([str(int(x)) for x in sorted(zones.keys())])
+        script.write("generateZoneAsc \"\\\"{}\\\"\"\n".format(value.strip()))
+
+        # Print the submission for the manifest
+        script.write("runArray '{}' {} {}\n".format(reduction, prefix, get_chunk(count, chunk)))
+
+    # Set the file as executable
+    script = pathlib.Path(filename)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+# Get the sweeps to run as [zone, populations, treatments], when the cell counts
+# for the (zone, population bin, treatment bin) combinations on the map are
+# supplied only those are swept, otherwise every population and treatment is
+# swept for each zone. When prioritize is set the combinations that cover the
+# most cells are swept first.
+def get_sweeps(pfpr, treatments, populationBreaks, combinations=None, prioritize=False):
+    if combinations is None:
+        return [[zone, sorted(populationBreaks), sorted(treatments[zone])] for zone in pfpr.keys()]
+
+    zones = list(pfpr.keys())
+    keys = sorted(combinations.keys(), key=lambda key: (zones.index(key[0]), key[1], key[2]))
+    if prioritize:
+        keys = sorted(keys, key=lambda key: -combinations[key])
+    return [[zone, [population], [treatment]] for zone, population, treatment in keys]
+
+# Get the sorted populations used by the sweeps
+def get_populations(sweeps):
+    return sorted({population for _, populations, _ in sweeps for population in populations})
+
+# Get the number of runs for each array task, increased if needed so the number
+# of tasks does not exceed MAX_ARRAY
+def get_chunk(count, chunk):
+    return max(chunk, -(-count // MAX_ARRAY))
+
+
 # Prepare the script that will use a CSV file to refine the betas  locally
 def reduce_local(filename, prefix, population, zones, reduction):
     with open(filename, "w") as script:
@@ -79,7 +165,8 @@ def reduce_local(filename, prefix, population, zones, reduction):
     script.chmod(script.stat().st_mode | stat.S_IEXEC)   
 
 # Prepare the script that will run the initial beta sweep locally
-def run_local(pfpr, treatments, populationBreaks, filename, prefix):
+def run_local(pfpr, treatments, populationBreaks, filename, prefix, combinations=None, prioritize=False):
+    sweeps = get_sweeps(pfpr, treatments, populationBreaks, combinations, prioritize)
     with open(filename, 'w') as script:
         # Print the front matter
         script.write("#!/bin/bash\n")
@@ -89,16 +176,16 @@ def run_local(pfpr, treatments, populationBreaks, filename, prefix):
 
         # Print the ASC file generation commands
         script.write("generate_asc \"\\\"{}\\\"\"\n".format(
-            " ".join([str(int(x)) for x in sorted(populationBreaks)])))
+            " ".join([str(int(x)) for x in get_populations(sweeps)])))
         script.write("generate_zone_asc \"\\\"{}\\\"\"\n\n".format(
             " ".join([str(int(x)) for x in sorted(pfpr.keys())])))
 
         # Print the zone matter
-        for zone in pfpr.keys():
+        for zone, populations, accesses in sweeps:
             script.write("run_sweep {} \"\\\"{}\\\"\" \"\\\"{}\\\"\" {}\n".format(
                 zone,
-                " ".join([str(int(x)) for x in sorted(populationBreaks)]),
-                " ".join([str(x) for x in sorted(treatments[zone])]),
+                " ".join([str(int(x)) for x in populations]),
+                " ".join([str(x) for x in accesses]),
                 prefix))
 
     # Set the file as executable
@@ -0,0 +1,109 @@
+# betaCurve.py
+#
+# This module contains the monotone calibration curves used to interpolate the
+# beta for a PfPR. The calibration data for a (zone, population bin, treatment
+# bin) is fit as a non-decreasing PfPR(beta) using isotonic regression, and the
+# inverse, beta(PfPR), is a piecewise cubic Hermite (PCHIP) interpolant through
+# the fitted points so that the betas for all the cells in a bin can be found
+# with a single vectorized evaluation.
+import numpy as np
+
+
+def isotonic(values, weights):
+    '''
+    Fit the non-decreasing sequence closest to the values in the weighted least squares sense using the pool
+    adjacent violators algorithm.
+    '''
+    means, totals, counts = [], [], []
+    for value, weight in zip(values.tolist(), weights.tolist()):
+        means.append(value)
+        totals.append(weight)
+        counts.append(1)
+
+        # Pool the last two blocks until the means are in order
+        while len(means) > 1 and means[-2] > means[-1]:
+            weight = totals[-2] + totals[-1]
+            means[-2] = (means[-2] * totals[-2] + means[-1] * totals[-1]) / weight
+            totals[-2] = weight
+            counts[-2] += counts[-1]
+            del means[-1], totals[-1], counts[-1]
+
+    return np.repeat(means, counts)
+
+
+def pchip_slopes(x, y):
+    '''Get the slopes at the points for the shape preserving PCHIP interpolant (Fritsch and Carlson)'''
+    h = np.diff(x)
+    delta = np.diff(y) / h
+    if len(x) == 2:
+        return np.array([delta[0], delta[0]])
+
+    # Interior points use the weighted harmonic mean of the secants, or zero at an extrema
+    slopes = np.zeros(len(x))
+    w1, w2 = 2 * h[1:] + h[:-1], h[1:] + 2 * h[:-1]
+    same = (delta[:-1] * delta[1:]) > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes[1:-1] = np.where(same, (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:]), 0)
+
+    # End points use the three point formula, limited to preserve the shape
+    for end, h0, h1, d0, d1 in ((0, h[0], h[1], delta[0], delta[1]), (-1, h[-1], h[-2], delta[-1], delta[-2])):
+        slope = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        if np.sign(slope) != np.sign(d0):
+            slope = 0
+        elif np.sign(d0) != np.sign(d1) and abs(slope) > abs(3 * d0):
+            slope = 3 * d0
+        slopes[end] = slope
+    return slopes
+
+
+def pchip(x, y, slopes, values):
+    '''Evaluate the PCHIP interpolant at the values, which must be within the range of x'''
+    ndx = np.clip(np.searchsorted(x, values, side='right') - 1, 0, len(x) - 2)
+    h = x[ndx + 1] - x[ndx]
+    t = (values - x[ndx]) / h
+    return (1 + 2 * t) * (1 - t) ** 2 * y[ndx] + t * (1 - t) ** 2 * h * slopes[ndx] + \
+        t ** 2 * (3 - 2 * t) * y[ndx + 1] + t ** 2 * (t - 1) * h * slopes[ndx + 1]
+
+
+class MonotoneCurve:
+    '''
+    Monotone PfPR(beta) curve for a bin, the knots are the distinct PfPR values of the isotonic fit with the
+    mean beta of the runs fit to each, and the residual of each knot is the largest difference between the
+    PfPR of those runs and the fit.
+    '''
+
+    def __init__(self, pfprs, betas):
+        '''
+        pfprs - The PfPR values of the calibration runs, as a fraction
+        betas - The beta values of the calibration runs
+        '''
+        pfprs, betas = np.asarray(pfprs, dtype=float), np.asarray(betas, dtype=float)
+
+        # Fit the mean PfPR of the replicates of each beta
+        unique, replicates = np.unique(betas, return_inverse=True)
+        replicates = replicates.ravel()
+        weights = np.bincount(replicates)
+        fitted = isotonic(np.bincount(replicates, weights=pfprs) / weights, weights)
+
+        # Each distinct fitted PfPR is a knot
+        self.pfprs, knots = np.unique(fitted, return_inverse=True)
+        knots = knots.ravel()
+        self.betas = np.bincount(knots, weights=unique * weights) / np.bincount(knots, weights=weights)
+        self.residuals = np.zeros(len(self.pfprs))
+        np.maximum.at(self.residuals, knots[replicates], np.abs(pfprs - fitted[replicates]))
+        self.slopes = pchip_slopes(self.pfprs, self.betas) if len(self.pfprs) > 1 else None
+
+    def invert(self, values):
+        '''
+        Get the betas for the PfPR values, returns [betas, residuals] where the residual is the distance to the
+        range of the curve plus the residual of the knots either side of the value.
+        '''
+        values = np.asarray(values, dtype=float)
+        clipped = np.clip(values, self.pfprs[0], self.pfprs[-1])
+        distance = np.abs(values - clipped)
+        if self.slopes is None:
+            return np.full(len(values), self.betas[0]), distance + self.residuals[0]
+
+        ndx = np.clip(np.searchsorted(self.pfprs, clipped, side='right') - 1, 0, len(self.pfprs) - 2)
+        betas = pchip(self.pfprs, self.betas, self.slopes, clipped)
+        return betas, distance + np.maximum(self.residuals[ndx], self.residuals[ndx + 1])
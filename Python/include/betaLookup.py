@@ -0,0 +1,139 @@
+# betaLookup.py
+#
+# This module contains the lookup engine that is used to find the beta values
+# that produce a given PfPR from the calibration data. Each (zone, population
+# bin, treatment bin) curve is kept as a sorted PfPR array so that the smallest
+# epsilon resulting in a match can be found with a single binary search. Bins
+# that are not sorted by PfPR in the calibration file are matched row by row so
+# the results are the same as the original scan.
+from bisect import bisect_left, bisect_right
+
+
+class BetaLookup:
+    '''
+    Lookup engine for the beta values associated with a PfPR.
+
+    The epsilon that is returned is the same value that would be found by
+    starting at the step and incrementing by the step until at least one PfPR
+    in the calibration curve is within the window, however, the search is done
+    in constant time once the nearest PfPR values have been found.
+
+    The original scan stopped at the first row above the window, so when the
+    rows of a bin are not sorted by PfPR in the file, a row only matches once
+    every row before it is below the top of the window. These bins are checked
+    row by row to return the same epsilon and betas as the scan.
+    '''
+
+    def __init__(self, index, step=0.00001):
+        '''
+        index - The CalibrationIndex returned by calibrationLib.load_index
+        step - The increment used when searching for the epsilon
+        '''
+        self.index = index
+        self.step = step
+        self.curves = {}
+
+        # Accumulated epsilon values, extended as needed so the floating point
+        # values match those of an incremental search exactly
+        self.ladder = [0]
+
+    def __len__(self):
+        return len(self.index)
+
+    def population_bins(self, zone):
+        '''Get the sorted population bins for the zone'''
+        return self.index.population_bins(zone)
+
+    def treatment_bins(self, zone, populationBin):
+        '''Get the sorted treatment bins for the zone and population bin'''
+        return self.index.treatment_bins(zone, populationBin)
+
+    def resolve(self, zone, population, treatment):
+        '''Get the (population bin, treatment bin) for the values, this matches calibrationLib.get_bin'''
+        return self.index.resolve(zone, population, treatment)
+
+    def get_curve(self, zone, populationBin, treatmentBin):
+        '''
+        Get the [pfprs, betas, order, rows] lists for the bin, the lists are prepared the first time they are used.
+        The rows are None if the bin is sorted by PfPR in the file, otherwise they are the [pfprs, highs, betas]
+        in the order they were read, where the high is the largest PfPR up to and including the row.
+        '''
+        key = (zone, populationBin, treatmentBin)
+        if key not in self.curves:
+            pfprs, betas, order = [values.tolist() for values in self.index.curve(zone, populationBin, treatmentBin)]
+            read = sorted(range(len(order)), key=order.__getitem__)
+            values = [pfprs[ndx] for ndx in read]
+            rows = None
+            if any(value > after for value, after in zip(values, values[1:])):
+                highs, high = [], float('-inf')
+                for value in values:
+                    high = max(high, value)
+                    highs.append(high)
+                rows = [values, highs, [betas[ndx] for ndx in read]]
+            self.curves[key] = [pfprs, betas, order, rows]
+        return self.curves[key]
+
+    def get_betas(self, zone, pfpr, population, treatment):
+        '''
+        Get the beta values that generate the PfPR for the given population and treatment level using the
+        smallest epsilon that returns at least one value.
+
+        Returns [betas, epsilon], or [[], None] when there is no calibration data for the bin.
+        '''
+        pfprs, betas, order, rows = self.get_curve(zone, *self.resolve(zone, population, treatment))
+        if len(pfprs) == 0:
+            return [], None
+        if rows is not None:
+            return self.scan(rows, pfpr)
+
+        # Find the epsilon, then collect the betas within the window in the order they were loaded
+        epsilon = self.ladder[self.search(pfprs, pfpr)]
+        low = bisect_left(pfprs, pfpr - epsilon)
+        high = bisect_right(pfprs, pfpr + epsilon)
+        return [betas[ndx] for ndx in sorted(range(low, high), key=order.__getitem__)], epsilon
+
+    def scan(self, rows, pfpr):
+        '''
+        Get the betas for a bin that is not sorted by PfPR, each row matches once the bottom of the window is at
+        or below its PfPR and the top is at or above the largest PfPR up to and including it. Returns the betas
+        of the rows that match first, in the order they were read, and the epsilon.
+        '''
+        steps = [max(self.first(lambda epsilon: pfpr - epsilon <= value, pfpr - value),
+                     self.first(lambda epsilon: high <= pfpr + epsilon, high - pfpr))
+                 for value, high in zip(rows[0], rows[1])]
+        step = min(steps)
+        return [beta for beta, ndx in zip(rows[2], steps) if ndx == step], self.ladder[step]
+
+    def search(self, pfprs, pfpr):
+        '''Return the index into the epsilon ladder of the smallest epsilon with a match in the sorted PfPR values'''
+
+        # Only the nearest values on either side of the PfPR need to be checked
+        ndx = bisect_left(pfprs, pfpr)
+        result = None
+        if ndx < len(pfprs):
+            above = pfprs[ndx]
+            result = self.first(lambda epsilon: above <= pfpr + epsilon, above - pfpr)
+        if ndx > 0:
+            below = pfprs[ndx - 1]
+            step = self.first(lambda epsilon: pfpr - epsilon <= below, pfpr - below)
+            if result is None or step < result:
+                result = step
+        return result
+
+    def first(self, matches, distance):
+        '''Find the first ladder index where matches is True, starting from an estimate using the distance'''
+        ndx = max(1, int(distance / self.step))
+        self.extend(ndx + 1)
+
+        # The estimate is within a few steps due to rounding, so walk to the first match
+        while ndx > 1 and matches(self.ladder[ndx - 1]):
+            ndx -= 1
+        while not matches(self.ladder[ndx]):
+            ndx += 1
+            self.extend(ndx)
+        return ndx
+
+    def extend(self, ndx):
+        '''Extend the epsilon ladder so the index provided is valid'''
+        while len(self.ladder) <= ndx:
+            self.ladder.append(self.ladder[-1] + self.step)
@@ -0,0 +1,202 @@
+# betaPlanner.py
+#
+# This module contains the adaptive planner for the calibration runs. Rather
+# than sweeping every beta from 0.00 to 2.50 for each bin, a coarse set of betas
+# is run first and each later round only adds betas for the PfPR values of the
+# cells in the bin that are not yet within the tolerance of a run. New betas are
+# placed using the monotone curve through the runs so far (see betaCurve), falling
+# back to bisection of the two runs that bracket the target when the curve lands
+# near either end. When the betas will be interpolated (createBetaMap.py
+# --interpolate) the cells between two runs are resolved once the curve between
+# them is close enough to linear, so far fewer runs are needed.
+import numpy as np
+
+import betaCurve as bc
+import calibrationIndex as ci
+import calibrationStore as cs
+import scheduler
+
+
+# Betas for the coarse round, these span the same range as the sweep
+MAX_BETA = round(scheduler.SWEEP_STEPS * scheduler.SWEEP_STEP, 4)
+COARSE_BETAS = [0.0, 0.1, 0.2, 0.4, 0.8, 1.6, MAX_BETA]
+
+# Number of runs for each bin in the sweep
+SWEEP_RUNS = scheduler.SWEEP_STEPS + 1
+
+# Default tolerance, the largest difference in PfPR (as a fraction) between a
+# cell and the nearest run
+TOLERANCE = 0.01
+
+# Limits on where the curve may place a beta between two runs, as a fraction
+# of the interval, outside of them bisection is used
+CURVE_LIMITS = (0.1, 0.9)
+
+# Fraction of the tolerance that the estimated interpolation error between two
+# runs must be within for the cells between them to be resolved
+INTERPOLATION_MARGIN = 0.5
+
+
+def load_runs(filename):
+    '''
+    Load the calibration results from the CSV file or calibration store, returns a dictionary keyed by
+    (zone, population, access) of [betas, pfprs] arrays sorted by beta with the PfPR as a fraction. The PfPR
+    of replicates of the same beta are averaged.
+    '''
+    if cs.is_store(filename):
+        with cs.CalibrationStore(filename) as store:
+            _, zones, populations, treatments, pfprs, betas = store.read_columns()
+    else:
+        _, zones, populations, treatments, pfprs, betas = ci.read_columns(filename)
+
+    runs = {}
+    keys, inverse = np.unique(np.column_stack((zones, populations, treatments)), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    for ndx, (zone, population, treatment) in enumerate(keys.tolist()):
+        rows = inverse == ndx
+        values, groups = np.unique(betas[rows], return_inverse=True)
+        means = np.bincount(groups.ravel(), weights=pfprs[rows]) / np.bincount(groups.ravel())
+        runs[(int(zone), int(population), treatment)] = [values, means / 100]
+    return runs
+
+
+def get_uncovered(values, pfprs, tolerance):
+    '''Get the sorted unique PfPR values of the cells that are not within the tolerance of a run'''
+    values = np.unique(values)
+    if len(pfprs) > 0:
+        runs = np.sort(pfprs)
+        ndx = np.searchsorted(runs, values)
+        nearest = np.minimum(np.abs(values - runs[np.maximum(ndx - 1, 0)]),
+                             np.abs(values - runs[np.minimum(ndx, len(runs) - 1)]))
+        values = values[nearest > tolerance]
+    return values
+
+
+def get_targets(values, pfprs, tolerance):
+    '''
+    Get the PfPR targets for the cells that are not within the tolerance of a run, each target covers the
+    cells within the tolerance of it so the fewest targets are used.
+    '''
+    targets, covered = [], -np.inf
+    for value in get_uncovered(values, pfprs, tolerance).tolist():
+        if value > covered:
+            targets.append(value + tolerance)
+            covered = value + 2 * tolerance
+    return targets
+
+
+def get_interpolation_errors(curve):
+    '''
+    Estimate the error, in PfPR, of interpolating the betas between each pair of knots of the curve. The beta of
+    the curve at the middle of the interval is compared with the linear one, where they agree the curve is close
+    to linear and the interpolated betas can be trusted.
+    '''
+    middle = (curve.pfprs[:-1] + curve.pfprs[1:]) / 2
+    linear = (curve.betas[:-1] + curve.betas[1:]) / 2
+    slopes = np.diff(curve.pfprs) / np.diff(curve.betas)
+    return np.abs(curve.invert(middle)[0] - linear) * slopes
+
+
+def get_interpolation_targets(values, pfprs, curve, tolerance):
+    '''
+    Get the PfPR targets when the betas will be interpolated, the middle of each interval between the knots of the
+    curve is a target if it has cells that are not within the tolerance of a run and the estimated interpolation
+    error is not within the margin of the tolerance. Cells outside of the curve are targeted as get_targets.
+    '''
+    values = get_uncovered(values, pfprs, tolerance)
+    knots = curve.pfprs
+    inside = (values >= knots[0]) & (values <= knots[-1])
+    targets = get_targets(values[~inside], pfprs, tolerance)
+    if len(knots) > 1:
+        ndx = np.clip(np.searchsorted(knots, values[inside], side='right') - 1, 0, len(knots) - 2)
+        errors = get_interpolation_errors(curve)
+        ndx = np.unique(ndx[errors[ndx] > tolerance * INTERPOLATION_MARGIN])
+        targets.extend(((knots[ndx] + knots[ndx + 1]) / 2).tolist())
+    return sorted(targets)
+
+
+def refine(betas, pfprs, values, tolerance=TOLERANCE, interpolate=False):
+    '''
+    Get the betas to run next for a bin.
+
+    betas, pfprs - The results for the bin so far, sorted by beta, PfPR as a fraction
+    values - The PfPR of the cells in the bin
+    tolerance - The largest difference in PfPR allowed between a cell and the nearest run
+    interpolate - True if the betas will be interpolated, cells between two runs are then also resolved when the
+                  estimated interpolation error is within the margin of the tolerance
+
+    Returns [betas, reachable, stalled] where betas is the sorted list of new betas, empty if the bin is resolved,
+    reachable is False if a target is beyond the PfPR of the run at the largest beta, and stalled is True if
+    betas are still needed but all of them round onto betas that have already been run.
+    '''
+    if len(betas) == 0:
+        return list(COARSE_BETAS), True, False
+
+    curve = bc.MonotoneCurve(pfprs, betas)
+    if interpolate:
+        targets = get_interpolation_targets(values, pfprs, curve, tolerance)
+    else:
+        targets = get_targets(values, pfprs, tolerance)
+
+    proposals, reachable = set(), True
+    for target in targets:
+        # Find the first run at or above the target, a beta of zero is the lower bound
+        above = np.flatnonzero(pfprs >= target)
+        if len(above) == 0:
+            if betas[-1] >= MAX_BETA:
+                reachable = False
+                continue
+            beta = MAX_BETA
+            if len(betas) > 1 and pfprs[-1] > pfprs[-2]:
+                slope = (pfprs[-1] - pfprs[-2]) / (betas[-1] - betas[-2])
+                beta = min(MAX_BETA, betas[-1] + (target - pfprs[-1]) / slope)
+            proposals.add(round(beta, 4))
+            continue
+        ndx = above[0]
+        if ndx == 0:
+            proposals.add(0.0)
+            continue
+
+        # Place the beta between the bracketing runs using the curve, or bisection
+        b0, b1 = betas[ndx - 1], betas[ndx]
+        fraction = (curve.invert([target])[0][0] - b0) / (b1 - b0)
+        if not CURVE_LIMITS[0] <= fraction <= CURVE_LIMITS[1]:
+            fraction = 0.5
+        proposals.add(round(b0 + fraction * (b1 - b0), 4))
+
+    planned = sorted(proposals - set(np.round(betas, 4).tolist()))
+    return planned, reachable, len(proposals) > 0 and len(planned) == 0
+
+
+def plan(ranges, treatments, runs, tolerance=TOLERANCE, combinations=None, interpolate=False):
+    '''
+    Plan the next round of runs.
+
+    ranges - Dictionary of the PfPR values for the cells in ranges[zone][population] from generateBins.process
+    treatments - Dictionary of the treatments for each zone from generateBins.process
+    runs - The results so far as returned by load_runs, may be empty
+    tolerance - The largest difference in PfPR allowed between a cell and the nearest run for the bin
+    combinations - Optional, the (zone, population, treatment) combinations on the map from generateBins.process,
+                   if supplied only they are planned
+    interpolate - True if the betas will be interpolated, see refine
+
+    Returns [rows, unreachable, stalled] where rows is the list of [zone, population, access, beta] to run,
+    unreachable is the list of (zone, population, access) bins with cells whose PfPR cannot be reached, and
+    stalled is the list of bins that are not resolved but have no new betas to run.
+    '''
+    rows, unreachable, stalled = [], [], []
+    for zone in sorted(ranges.keys()):
+        for population in sorted(ranges[zone].keys()):
+            values = np.array(ranges[zone][population])
+            for treatment in sorted(treatments[zone]):
+                if combinations is not None and (zone, population, treatment) not in combinations:
+                    continue
+                key = (int(zone), int(population), treatment)
+                betas, pfprs = runs.get(key, [np.zeros(0), np.zeros(0)])
+                planned, reachable, stuck = refine(betas, pfprs, values, tolerance, interpolate)
+                if not reachable:
+                    unreachable.append(key)
+                if stuck:
+                    stalled.append(key)
+                rows.extend([[int(zone), int(population), treatment, beta] for beta in planned])
+    return rows, unreachable, stalled
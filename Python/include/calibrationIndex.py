@@ -0,0 +1,171 @@
+# calibrationIndex.py
+#
+# This module contains the compiled index of the calibration data. The PfPR and
+# beta values are stored as contiguous arrays sorted by (zone, population,
+# treatment, PfPR) so each bin is a slice that can be searched directly, and the
+# index is saved as a binary sidecar next to the CSV file so later runs can skip
+# parsing it.
+import csv
+import numpy as np
+import os
+
+from bisect import bisect_left
+
+
+# Extension appended to the CSV filename for the sidecar
+SIDECAR = '.index.npz'
+
+# Version of the sidecar format, sidecars written with another version are rebuilt
+FORMAT = 1
+
+
+class CalibrationIndex:
+    '''
+    Index of the calibration data, the bins are those of calibrationLib.load_betas, so a
+    curve is the list of [PfPR, beta] values stored in lookup[zone][population][treatment].
+    '''
+
+    def __init__(self, pfpr, keys, bounds, pfprs, betas, order):
+        '''
+        pfpr - The PfPR column used, either 'pfpr2to10' or 'pfprunder5'
+        keys - Array of (zone, population, treatment) for each bin, sorted
+        bounds - Array of the (start, end) of each bin in the data arrays
+        pfprs - The PfPR values, as a fraction, sorted within each bin
+        betas - The beta values aligned with the PfPR values
+        order - The row in the CSV file that each value was read from
+        '''
+        self.pfpr = pfpr
+        self.keys = keys
+        self.bounds = bounds
+        self.pfprs = pfprs
+        self.betas = betas
+        self.order = order
+
+        # Prepare the bin dictionaries
+        self.bins = {}
+        self.populations = {}
+        self.treatments = {}
+        for ndx, (zone, population, treatment) in enumerate(keys.tolist()):
+            zone, population = int(zone), int(population)
+            self.bins[(zone, population, treatment)] = ndx
+            self.populations.setdefault(zone, []).append(population)
+            self.treatments.setdefault((zone, population), []).append(treatment)
+        for zone in self.populations:
+            self.populations[zone] = sorted(set(self.populations[zone]))
+
+    def __len__(self):
+        return len(self.populations)
+
+    @classmethod
+    def load(cls, filename, sidecar=True):
+        '''
+        Load the index for the CSV file, using the sidecar if it is present, of the current format, and the CSV has
+        not changed since it was written. If sidecar is set then a new sidecar is written after parsing the CSV.
+        '''
+        stats = os.stat(filename)
+        source = np.array([stats.st_size, stats.st_mtime_ns], dtype=np.int64)
+        if sidecar:
+            try:
+                with np.load(filename + SIDECAR) as data:
+                    if int(data['version']) == FORMAT and np.array_equal(data['source'], source):
+                        return cls(str(data['label']), data['keys'], data['bounds'], data['pfprs'], data['betas'],
+                                   data['order'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+        index = cls.parse(filename)
+        if sidecar:
+            index.save(filename + SIDECAR, source)
+        return index
+
+    @classmethod
+    def parse(cls, filename):
+        '''Parse the CSV file and return the index'''
+        return cls.build(*read_columns(filename))
+
+    @classmethod
+    def build(cls, pfpr, zones, populations, treatments, pfprs, betas):
+        '''Build the index from the columns of calibration data, the PfPR values should be a percentage'''
+
+        # Every (zone, population, treatment) is a bin, even when all of its values are ignored
+        keys, inverse = np.unique(np.column_stack((zones, populations, treatments)), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+
+        # Ignore the zeros unless the beta is also zero
+        rows = np.flatnonzero(~((pfprs == 0) & (betas != 0)))
+        values = pfprs[rows] / 100
+
+        # Sort by bin, then PfPR, then the order the rows were read
+        order = rows[np.lexsort((rows, values, inverse[rows]))]
+        counts = np.bincount(inverse[order], minlength=len(keys))
+        ends = np.cumsum(counts)
+        bounds = np.column_stack((ends - counts, ends))
+        return cls(pfpr, keys, bounds, pfprs[order] / 100, betas[order], order)
+
+    def save(self, filename, source):
+        '''Save the index to the filename given, errors are ignored since the sidecar is optional'''
+        temporary = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            with open(temporary, 'wb') as output:
+                np.savez(output, label=self.pfpr, keys=self.keys, bounds=self.bounds, pfprs=self.pfprs,
+                         betas=self.betas, order=self.order, source=source, version=FORMAT)
+            os.replace(temporary, filename)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def zones(self):
+        '''Get the sorted zones'''
+        return sorted(self.populations.keys())
+
+    def population_bins(self, zone):
+        '''Get the sorted population bins for the zone'''
+        return self.populations[zone]
+
+    def treatment_bins(self, zone, populationBin):
+        '''Get the sorted treatment bins for the zone and population bin'''
+        return self.treatments[(zone, populationBin)]
+
+    def resolve(self, zone, population, treatment):
+        '''Get the (population bin, treatment bin) for the values, this matches calibrationLib.get_bin'''
+        if zone not in self.populations:
+            raise ValueError("Zone {} was not found in lookup".format(zone))
+        populationBin = find_bin(population, self.populations[zone])
+        treatmentBin = find_bin(treatment, self.treatments[(zone, populationBin)])
+        return populationBin, treatmentBin
+
+    def curve(self, zone, populationBin, treatmentBin):
+        '''Get the [pfprs, betas, order] arrays for the bin, sorted by PfPR'''
+        start, end = self.bounds[self.bins[(zone, populationBin, treatmentBin)]]
+        return self.pfprs[start:end], self.betas[start:end], self.order[start:end]
+
+
+def read_columns(filename):
+    '''
+    Read the calibration CSV file, returns [pfpr, zones, populations, treatments, pfprs, betas] where pfpr is the
+    PfPR column used and the rest are arrays of the columns with the PfPR values as a percentage
+    '''
+    with open(filename) as input:
+        fieldnames = next(csv.reader(input))
+
+        # Check to see if we are reading Under-5 or 2-10 PfPR values
+        if 'pfpr2to10' in fieldnames:
+            pfpr = 'pfpr2to10'
+        elif 'pfprunder5' in fieldnames:
+            pfpr = 'pfprunder5'
+        else:
+            raise Exception('Calibration data does not appear to have a valid PfPR header.')
+
+        # Read the relevant columns in one pass
+        columns = [fieldnames.index(name) for name in ('zone', 'population', 'access', pfpr, 'beta')]
+        data = np.loadtxt(input, delimiter=',', usecols=columns, ndmin=2)
+
+    return pfpr, np.trunc(data[:, 0]), np.trunc(data[:, 1]), data[:, 2], data[:, 3], data[:, 4]
+
+
+def find_bin(value, bins):
+    '''Get the bin that the value belongs to from the sorted bins, this matches calibrationLib.get_bin'''
+    ndx = bisect_left(bins, value)
+    if ndx < len(bins) and bins[ndx] == value:
+        return value
+    return bins[min(ndx, len(bins) - 1)]
@@ -2,6 +2,7 @@
 #
 # This module includes functions that are intended for use with calibration functions.
 import csv
+import numpy as np
 import os
 import re
 import sys
@@ -9,6 +10,8 @@ import yaml
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
 import ascFile as asc
+import calibrationIndex as ci
+import calibrationStore as cs
 import standards
 
 
@@ -35,6 +38,55 @@ def get_bin(value, bins):
     raise Exception("Matching bin not found for value: " + str(value))
 
 
+def get_bins(values, bins):
+    '''
+    Get the bins that an array of values belong to, this matches get_bin for each value so a value that is a bin
+    is returned as is, otherwise the first bin greater than the value is returned, or the largest bin.
+
+    values - The array of values to be binned.
+    bins - The bins to use, in any order.
+
+    Returns an array of bins with the same shape as the values.
+    '''
+
+    bins = np.sort(np.fromiter(bins, dtype=float))
+    if len(bins) == 0:
+        raise Exception("No bins were provided for the values")
+    ndx = np.searchsorted(bins, values, side='left')
+    return bins[np.minimum(ndx, len(bins) - 1)]
+
+
+def resolve_bins(lookup, zones, populations, treatments):
+    '''
+    Get the population and treatment bins for arrays of cells using the bins defined for each zone in the
+    calibration lookup, this matches using get_bin with the lookup bins for each cell.
+
+    lookup - The CalibrationIndex (or BetaLookup) with the bins.
+    zones, populations, treatments - Arrays with the values for each cell, nodata should already be removed.
+
+    Returns [populationBins, treatmentBins] as arrays.
+    '''
+
+    populationBins = np.zeros(len(zones))
+    treatmentBins = np.zeros(len(zones))
+    for zone in np.unique(zones).tolist():
+        try:
+            bins = lookup.population_bins(zone)
+        except KeyError:
+            raise ValueError("Zone {} was not found in lookup".format(zone))
+        cells = np.flatnonzero(zones == zone)
+        populationBins[cells] = get_bins(populations[cells], bins)
+        for populationBin in np.unique(populationBins[cells]).tolist():
+            match = cells[populationBins[cells] == populationBin]
+            treatmentBins[match] = get_bins(treatments[match], lookup.treatment_bins(zone, int(populationBin)))
+    return populationBins, treatmentBins
+
+
+def get_gis_file(gisPath, filename):
+    '''Get the path to the GIS file, which may be a compressed (.asc.gz, .asc.zst) version of the filename'''
+    return asc.find_asc(os.path.join(gisPath, filename))
+
+
 def get_prefix(filename):
     '''Get the three letter country code prefix from the filename'''
 
@@ -69,13 +121,13 @@ def get_climate_zones(configurationYaml, gisPath):
     # Start by checking if there is a raster defined, if so just load and return that
     if 'ecoclimatic_raster' in configurationYaml['raster_db']:
         filename = str(configurationYaml['raster_db']['ecoclimatic_raster'])
-        filename = os.path.join(gisPath, filename)
+        filename = get_gis_file(gisPath, filename)
         _, ascData = asc.load_asc(filename)
         return ascData
 
     # Get the filename of the district raster in case we need it
     filename = str(configurationYaml['raster_db']['district_raster'])
-    filename = os.path.join(gisPath, filename)
+    filename = get_gis_file(gisPath, filename)
 
     # Are we looking at a version 4.1 configuration?
     yaml = configurationYaml['seasonal_info']
@@ -120,10 +172,9 @@ def get_treatments_list(configurationYaml, gisPath):
     # Get the unique under five treatments
     try:
         filename = str(configurationYaml['raster_db']['pr_treatment_under5'])
-        filename = os.path.join(gisPath, filename)
-        acsHeader, ascData = asc.load_asc(filename)
-        underFive = list(set(i for j in ascData for i in j))
-        underFive.remove(acsHeader['nodata'])
+        filename = get_gis_file(gisPath, filename)
+        acsHeader, ascData, mask = asc.load_asc_array(filename)
+        underFive = np.unique(ascData[~mask]).tolist()
     except FileNotFoundError:
         # Warn and return when the U5 treatment rate cannot be opened
         sys.stderr.write("ERROR: Unable to open file associated with under five treatment rate: {}\n".format(filename))
@@ -132,10 +183,9 @@ def get_treatments_list(configurationYaml, gisPath):
     # Get the unique over five treatments
     try:
         filename = str(configurationYaml['raster_db']['pr_treatment_over5'])
-        filename = os.path.join(gisPath, filename)
-        _, ascData = asc.load_asc(filename)
-        overFive = list(set(i for j in ascData for i in j)) 
-        overFive.remove(acsHeader['nodata'])
+        filename = get_gis_file(gisPath, filename)
+        _, ascData, mask = asc.load_asc_array(filename)
+        overFive = np.unique(ascData[~mask]).tolist()
     except FileNotFoundError:
         # Warn and continue when the O5 rate cannot be opened
         sys.stderr.write("WARNING: Unable to open file associated with over five treatment rate: {}\n".format(filename))
@@ -144,10 +194,9 @@ def get_treatments_list(configurationYaml, gisPath):
 
     # Get the unique district ids
     filename = str(configurationYaml['raster_db']['district_raster'])
-    filename = os.path.join(gisPath, filename)
-    _, ascData = asc.load_asc(filename)
-    districts = list(set(i for j in ascData for i in j)) 
-    districts.remove(acsHeader['nodata'])
+    filename = get_gis_file(gisPath, filename)
+    _, ascData, mask = asc.load_asc_array(filename)
+    districts = np.unique(ascData[~mask]).tolist()
 
     # If either treatment list is greater than districts, binning is needed
     # NOTE This is just a rough heuristic for the time being
@@ -171,7 +220,7 @@ def get_treatments_raster(configurationYaml, gisPath):
     # Start by checking if there is a raster defined, if so just load and return that
     if 'pr_treatment_under5' in configurationYaml['raster_db']:
         filename = str(configurationYaml['raster_db']['pr_treatment_under5'])
-        filename = os.path.join(gisPath, filename)
+        filename = get_gis_file(gisPath, filename)
         _, ascData = asc.load_asc(filename)
         return ascData
 
@@ -186,7 +235,7 @@ def get_treatments_raster(configurationYaml, gisPath):
 
     # Generate and return the reference raster
     filename = str(configurationYaml['raster_db']['district_raster'])
-    filename = os.path.join(gisPath, filename)
+    filename = get_gis_file(gisPath, filename)
     return generate_raster(filename, underFive)
 
 
@@ -235,6 +284,28 @@ def load_betas(filename):
     return [pfpr, lookup]
 
 
+def load_index(filename, zones=None, populations=None, treatments=None):
+    '''
+    Load the compiled index of the calibration data in the CSV file, a binary sidecar is used to skip parsing
+    the CSV file when it has not changed. The file may also be a calibration store (.db, .sqlite), in which
+    case only the bins used by the cells are loaded when they are supplied.
+
+    filename - The file, with or without the path attached, to be loaded
+    zones, populations, treatments - Optional arrays with the values for each cell, nodata should already be removed
+    '''
+
+    if not cs.is_store(filename):
+        return ci.CalibrationIndex.load(filename)
+
+    with cs.CalibrationStore(filename) as store:
+        if zones is None:
+            return store.load_index()
+
+        # Resolve the bins for the cells, then load only those bins
+        populationBins, treatmentBins = resolve_bins(store.load_bins(), zones, populations, treatments)
+        return store.load_index(np.unique(np.column_stack((zones, populationBins, treatmentBins)), axis=0))
+
+
 def load_configuration(configuration):
     '''
     Load the configuration file provided and return the parsed YAML
@@ -0,0 +1,162 @@
+# calibrationStore.py
+#
+# This module contains the SQLite store of calibration results. New sweeps are
+# appended to the store as they finish and the rows are indexed by (zone,
+# population, access, PfPR) so that only the bins used by a raster need to be
+# loaded as a CalibrationIndex. Identical rows are told apart by an occurrence
+# number so a CSV file can be imported again, or concatenated with new results
+# and imported, without adding the rows already present while replicates with
+# the same values are kept.
+import numpy as np
+import os
+import sqlite3
+
+import calibrationIndex as ci
+
+
+# Extensions of the files that are treated as calibration stores
+EXTENSIONS = ['.db', '.sqlite']
+
+# Schema of the store, the PfPR is stored as a percentage as in the CSV files
+# and the occurrence counts the rows before it with the same values
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS calibration (
+    id INTEGER PRIMARY KEY,
+    zone INTEGER NOT NULL,
+    population INTEGER NOT NULL,
+    access REAL NOT NULL,
+    beta REAL NOT NULL,
+    pfpr REAL NOT NULL,
+    occurrence INTEGER NOT NULL,
+    UNIQUE (zone, population, access, beta, pfpr, occurrence));
+CREATE INDEX IF NOT EXISTS calibration_bin ON calibration (zone, population, access, pfpr);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL);
+'''
+
+
+def is_store(filename):
+    '''Check to see if the filename is a calibration store based upon the extension'''
+    return os.path.splitext(filename)[1].lower() in EXTENSIONS
+
+
+class CalibrationStore:
+    '''
+    SQLite store of calibration results, the rows are kept in the order they were appended so that indices
+    loaded from the store match those loaded from the equivalent CSV file.
+    '''
+
+    def __init__(self, filename, create=False):
+        '''
+        filename - The path to the SQLite database
+        create - True if the database should be created if it does not exist, the tables are only created when
+                 this is set so opening the store to read it does not write to it
+        '''
+        if not create and not os.path.exists(filename):
+            raise FileNotFoundError("Calibration store not found: {}".format(filename))
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        if create:
+            self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM calibration').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def get_label(self):
+        '''Get the PfPR column used by the store, either 'pfpr2to10' or 'pfprunder5', or None if it is empty'''
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'pfpr'").fetchone()
+        return None if row is None else row[0]
+
+    def append_csv(self, filename):
+        '''
+        Append the rows of the calibration CSV file, returns [added, total] for the rows in the file. A row is only
+        added when the file has more rows with the same values than the store, so importing a file again, or a
+        file that was concatenated with one already imported, only adds the new rows.
+        '''
+        pfpr, zones, populations, treatments, pfprs, betas = ci.read_columns(filename)
+        return self.append(pfpr, zones, populations, treatments, pfprs, betas), len(zones)
+
+    def append(self, pfpr, zones, populations, treatments, pfprs, betas, replicates=False):
+        '''
+        Append the calibration results in a single transaction.
+
+        pfpr - The PfPR column of the results, either 'pfpr2to10' or 'pfprunder5'
+        zones, populations, treatments, pfprs, betas - The columns of the results, PfPR as a percentage
+        replicates - True if the results are new runs, in which case rows with the same values as rows in the store
+                     are added as replicates rather than being treated as already imported
+
+        Returns the number of rows that were added.
+        '''
+        label = self.get_label()
+        if label is not None and label != pfpr:
+            raise ValueError("Calibration store contains {} values, cannot append {} values".format(label, pfpr))
+
+        # Number the rows with the same values in the order they appear
+        rows, counts = [], {}
+        for row in zip(np.asarray(zones, dtype=np.int64).tolist(), np.asarray(populations, dtype=np.int64).tolist(),
+                       np.asarray(treatments, dtype=float).tolist(), np.asarray(betas, dtype=float).tolist(),
+                       np.asarray(pfprs, dtype=float).tolist()):
+            counts[row] = counts.get(row, -1) + 1
+            rows.append(row + (counts[row],))
+
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('pfpr', ?)", (pfpr,))
+            before = self.connection.total_changes
+            if replicates:
+                # Number the rows after those already in the store
+                self.connection.executemany(
+                    'INSERT INTO calibration (zone, population, access, beta, pfpr, occurrence) '
+                    'SELECT ?1, ?2, ?3, ?4, ?5, COUNT(*) FROM calibration '
+                    'WHERE zone = ?1 AND population = ?2 AND access = ?3 AND beta = ?4 AND pfpr = ?5',
+                    [row[:5] for row in rows])
+            else:
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO calibration (zone, population, access, beta, pfpr, occurrence) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            return self.connection.total_changes - before
+
+    def read_columns(self):
+        '''Read the rows in the order they were appended, returns the same columns as calibrationIndex.read_columns'''
+        rows = self.connection.execute('SELECT zone, population, access, pfpr, beta FROM calibration ORDER BY id')
+        data = np.array(rows.fetchall(), dtype=float).reshape(-1, 5)
+        return self.get_label(), data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4]
+
+    def load_bins(self):
+        '''Load a CalibrationIndex with the bins, but not the values, which can be used to resolve bins'''
+        keys = np.array(self.connection.execute(
+            'SELECT DISTINCT zone, population, access FROM calibration ORDER BY zone, population, access').fetchall(),
+            dtype=float).reshape(-1, 3)
+        empty = np.zeros(0)
+        return ci.CalibrationIndex(self.get_label(), keys, np.zeros((len(keys), 2), dtype=np.int64), empty, empty,
+                                   np.zeros(0, dtype=np.int64))
+
+    def load_index(self, keys=None):
+        '''
+        Load the CalibrationIndex for the store.
+
+        keys - Optional array of (zone, population, access) bins, if supplied only the rows for them are loaded.
+        '''
+        query = 'SELECT zone, population, access, pfpr, beta FROM calibration'
+        if keys is None:
+            rows = self.connection.execute(query + ' ORDER BY id').fetchall()
+        else:
+            self.connection.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS bins (zone INTEGER, population INTEGER, access REAL)')
+            self.connection.execute('DELETE FROM bins')
+            self.connection.executemany('INSERT INTO bins VALUES (?, ?, ?)',
+                                        [(int(zone), int(population), access) for zone, population, access in
+                                         np.asarray(keys, dtype=float).tolist()])
+            rows = self.connection.execute(query + ' JOIN bins USING (zone, population, access) ORDER BY id').fetchall()
+
+        data = np.array(rows, dtype=float).reshape(-1, 5)
+        return ci.CalibrationIndex.build(self.get_label(), data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4])
@@ -0,0 +1,205 @@
+# scheduler.py
+#
+# This module contains the local calibration scheduler, which runs the plan in
+# the scripts prepared by bashWriter.run_local and bashWriter.reduce_local
+# without the task-spooler. The configuration for each run is rendered from the
+# template in memory and the simulation is run in a bounded pool of workers,
+# with the finished and failed runs noted in a state file so that an
+# interrupted sweep can be resumed.
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# Values used by calibrationLocal.sh, the betas for a sweep are 0.00 to 2.50
+# in steps of 0.05 and the over five access is adjusted from the under five
+SWEEP_STEPS = 50
+SWEEP_STEP = 0.05
+O5ADJUST = 1.0
+
+# Default state file, one JSON record per completed run
+STATE = 'scheduler.state'
+
+# Commands in the plan, the cluster names are accepted as well
+COMMANDS = {
+    'check_dependencies': 'dependencies', 'checkDependencies': 'dependencies',
+    'generate_asc': 'populations', 'generateAsc': 'populations',
+    'generate_zone_asc': 'zones', 'generateZoneAsc': 'zones',
+    'run_sweep': 'sweep', 'run': 'sweep',
+    'run_csv': 'csv', 'runCsv': 'csv', 'runArray': 'csv',
+    'set_spooler': None, 'source': None
+}
+
+
+def load_plan(filename):
+    '''
+    Load the plan from the script prepared by bashWriter, returns a dictionary with the country 'prefix', the
+    'populations' and 'zones' to generate ASC files for, and the 'runs' as [zone, population, access, beta]
+    lists of strings in the order they would have been queued.
+    '''
+    plan = {'prefix': None, 'populations': [], 'zones': [], 'runs': []}
+    with open(filename) as input:
+        for line in input:
+            arguments = [argument.strip('"') for argument in shlex.split(line, comments=True)]
+            if len(arguments) == 0:
+                continue
+            if arguments[0] not in COMMANDS:
+                raise ValueError("Unknown command in {}: {}".format(filename, arguments[0]))
+            command = COMMANDS[arguments[0]]
+            if command == 'dependencies':
+                plan['prefix'] = arguments[1]
+            elif command == 'populations':
+                plan['populations'].extend(arguments[1].split())
+            elif command == 'zones':
+                plan['zones'].extend(arguments[1].split())
+            elif command == 'sweep':
+                plan['runs'].extend(sweep_runs(arguments[1], arguments[2].split(), arguments[3].split()))
+            elif command == 'csv':
+                plan['runs'].extend(csv_runs(os.path.join(os.path.dirname(filename), arguments[1])))
+    return plan
+
+
+def sweep_runs(zone, populations, treatments):
+    '''Get the runs for the initial beta sweep of the zone, this matches run_sweep in calibrationLocal.sh'''
+    betas = ['{:.2f}'.format(step * SWEEP_STEP) for step in range(SWEEP_STEPS + 1)]
+    return [[zone, population, access, beta] for population in populations for access in treatments for beta in betas]
+
+
+def csv_runs(filename):
+    '''Get the runs in the CSV file of zone, population, access, beta prepared by reduceEpsilons'''
+    runs = []
+    with open(filename) as input:
+        for line in input:
+            values = [value.strip() for value in line.split(',')]
+            if len(values) == 4:
+                runs.append(values)
+    return runs
+
+
+def get_name(run, prefix):
+    '''Get the name of the run, ZONE-POPULATION-ACCESS-BETA-COUNTRY'''
+    return '-'.join(run + [prefix])
+
+
+def render(template, run):
+    '''Render the configuration for the run, [zone, population, access, beta], from the template'''
+    zone, population, access, beta = run
+    return template.replace('#BETA#', beta).replace('#POPULATION#', population).replace(
+        '#ACCESSU5#', access).replace('#ACCESSO5#', str(float(access) * O5ADJUST)).replace('#ZONE#', zone)
+
+
+def generate_asc(plan):
+    '''Generate the population and zone ASC files for the plan from population.asc and zone.asc'''
+    for template, key, values in (('population.asc', '#POPULATION#', plan['populations']),
+                                  ('zone.asc', '#ZONE#', plan['zones'])):
+        with open(template) as input:
+            text = input.read()
+        for value in values:
+            with open('{}.asc'.format(value), 'w') as output:
+                output.write(text.replace(key, value))
+
+
+def open_state(filename):
+    '''Open the state file to append to, starting a new line if the last record is partial'''
+    partial = False
+    if os.path.exists(filename) and os.path.getsize(filename) > 0:
+        with open(filename, 'rb') as input:
+            input.seek(-1, os.SEEK_END)
+            partial = input.read(1) != b'\n'
+    output = open(filename, 'a')
+    if partial:
+        output.write('\n')
+    return output
+
+
+def load_state(filename):
+    '''Load the state file, returns a dictionary of the last record for each run by name'''
+    state = {}
+    if os.path.exists(filename):
+        with open(filename) as input:
+            for line in input:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be partial if the scheduler was killed
+                    continue
+                state[record['name']] = record
+    return state
+
+
+def execute(executable, template, name, run, job):
+    '''Write the configuration for the run and run the simulation, returns the exit code'''
+    with open(name + '.yml', 'w') as output:
+        output.write(render(template, run))
+    with open('{}.log'.format(job), 'w') as log:
+        try:
+            return subprocess.run([executable, '-i', name + '.yml', '-r', 'SQLitePixelReporter', '-j', str(job)],
+                                  stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as err:
+            log.write("{}\n".format(str(err)))
+            return -1
+
+
+def run(plan, executable='./MaSim', limit=None, stateFile=STATE, retry=False):
+    '''
+    Run the plan in the current directory using a bounded pool of workers.
+
+    plan - The plan returned by load_plan
+    executable - The simulation to run
+    limit - The maximum number of simulations to run at once, default is one less than the number of processors
+    stateFile - The file to record the finished and failed runs in, runs that are already finished are skipped
+    retry - True if runs that previously failed should be run again
+
+    Returns [finished, failed] counts for the runs started.
+    '''
+    if limit is None:
+        limit = max(1, (os.cpu_count() or 2) - 1)
+
+    # Check the dependencies and load the template
+    filename = '{}-calibration.yml'.format(plan['prefix'])
+    missing = [file for file in (filename, 'population.asc', 'zone.asc') if not os.path.exists(file)]
+    if missing:
+        raise FileNotFoundError("Missing files: {}".format(', '.join(missing)))
+    with open(filename) as input:
+        template = input.read()
+    generate_asc(plan)
+
+    # Determine the runs to start, runs keep their job number when they are run
+    # again, otherwise they are numbered after the runs in the state file
+    state = load_state(stateFile)
+    pending, counter = [], max([record['job'] for record in state.values()], default=0)
+    for values in plan['runs']:
+        name = get_name(values, plan['prefix'])
+        record = state.get(name, {})
+        if record.get('status') == 'finished' or (record.get('status') == 'failed' and not retry):
+            continue
+        if 'job' not in record:
+            counter += 1
+        pending.append((name, values, record.get('job', counter)))
+    print("{} runs in the plan, {} to run with a limit of {}".format(len(plan['runs']), len(pending), limit))
+
+    # Run the simulations, noting each one as it completes
+    finished, failed = 0, 0
+    with open_state(stateFile) as output, ThreadPoolExecutor(max_workers=limit) as executor:
+        futures = {executor.submit(execute, executable, template, name, values, job): (name, job)
+                   for name, values, job in pending}
+        try:
+            for future in as_completed(futures):
+                name, job = futures[future]
+                code = future.result()
+                if code == 0:
+                    finished += 1
+                else:
+                    failed += 1
+                    sys.stderr.write("Run {} (job {}) failed with exit code {}\n".format(name, job, code))
+                output.write(json.dumps({'name': name, 'job': job, 'status': 'finished' if code == 0 else 'failed',
+                                         'code': code}) + '\n')
+                output.flush()
+        except KeyboardInterrupt:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+    return finished, failed
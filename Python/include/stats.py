@@ -5,29 +5,64 @@ import jenkspy
 import numpy as np
 
 # Find the goodness of variance fit (GVF) for the data set provided and the 
-# number of classes (bins) indicated
+# number of classes (bins) indicated, the data may be prepared once using
+# prepare_gvf when trying different numbers of classes
 #
 # Source: https://stats.stackexchange.com/q/144075
-def goodness_of_variance_fit(data, classes):
-    # Find the break points and classify the data
-    classes = jenkspy.jenks_breaks(data, classes)
-    classified = np.array([classify(i, classes) for i in data])
-
-    # Nested list of zone indices
-    zone_indices = [[idx for idx, val in enumerate(classified) if zone + 1 == val] for zone in range(max(classified))]
-
-    # Sum of squared deviations from array mean
+def goodness_of_variance_fit(data, classes, prepared=None):
+    if prepared is None:
+        prepared = prepare_gvf(data)
+
+    # Find the break points and calculate the GVF
+    classes = jenkspy.jenks_breaks(prepared[2], classes)
+    return breaks_gvf(prepared, classes), classes
+
+# Prepare the data set for goodness_of_variance_fit, returns the data as an
+# array, the stable sort order, the sorted data, and the sum of squared
+# deviations from the array mean
+def prepare_gvf(data):
+    data = np.asarray(data, dtype=float)
+    order = np.argsort(data, kind='stable')
     sdam = np.sum((data - np.mean(data)) ** 2)
-
-    # Sorted polygon stats
-    array_sort = [np.array([data[index] for index in zone]) for zone in zone_indices]
+    return data, order, data[order], sdam
+
+# Take a stratified sample of the prepared data, the sample is evenly spaced
+# by rank so each part of the distribution is represented in proportion. The
+# prepared sample is returned, or the prepared data if it is not larger than
+# the sample size.
+def stratified_sample(prepared, samples):
+    sortedData = prepared[2]
+    if len(sortedData) <= samples:
+        return prepared
+    ndx = np.round(np.linspace(0, len(sortedData) - 1, samples)).astype(int)
+    return prepare_gvf(sortedData[ndx])
+
+# Find the GVF for the prepared data using the breaks provided, the data is
+# classified the same as classify and each class is summed in data order
+def breaks_gvf(prepared, breaks):
+    data, order, sortedData, sdam = prepared
+
+    # Classify the sorted data, class i holds the values less than breaks[i]
+    # that are not in a lower class, with the last class holding the rest
+    bounds = np.searchsorted(sortedData, breaks[1:-1], side='left')
+    bounds = np.concatenate(([0], np.maximum.accumulate(bounds), [len(data)])).astype(int)
+    classified = np.empty(len(data), dtype=np.min_scalar_type(len(breaks)))
+    classified[order] = np.repeat(np.arange(1, len(breaks)), np.diff(bounds))
+
+    # Group the data by class, keeping the data order within each class
+    grouped = data[np.argsort(classified, kind='stable')]
+    ends = np.cumsum(np.bincount(classified, minlength=len(breaks))[1:])
 
     # Sum of squared deviations of class means
-    sdcm = sum([np.sum((classified - classified.mean()) ** 2) for classified in array_sort])
+    sdcm, start = 0, 0
+    for end in ends:
+        if end > start:
+            zone = grouped[start:end]
+            sdcm += np.sum((zone - zone.mean()) ** 2)
+        start = end
 
     # Calculate the GVF and return
-    gvf = (sdam - sdcm) / sdam
-    return gvf, classes
+    return (sdam - sdcm) / sdam
 
 # Helper function for goodness_of_variance_fit, note that this presumes the 
 # breaks are structured as follows: 
@@ -0,0 +1,88 @@
+# zonal.py
+#
+# This module contains the accumulator for zonal statistics (e.g., the
+# population weighted PfPR for each district) over ASC data streamed a block
+# of rows at a time.
+import numpy as np
+
+
+class ZonalAccumulator:
+    '''
+    Accumulates the zonal statistics over blocks of rows so that rasters that do not fit in memory can be
+    processed using ascFile.iter_rows. Sums are accumulated in row order so they match summing cell by cell,
+    regardless of the size of the blocks.
+    '''
+
+    def __init__(self, names, layers, nodata=None):
+        '''
+        names - The names of the zone layers (e.g., ['district', 'province'])
+        layers - The names of the value layers (e.g., ['pfpr'])
+        nodata - The nodata value for the zone arrays, cells that are nodata are skipped for those zones.
+        '''
+        self.layers = list(layers)
+        self.nodata = nodata
+        self.zones = {name: {'index': {}, 'ids': [], 'count': np.zeros(0, dtype=np.int64), 'weight': np.zeros(0),
+                             'sum': {layer: np.zeros(0) for layer in self.layers}} for name in names}
+
+    def add(self, zones, values, weights=None):
+        '''
+        Add a block of rows.
+
+        zones - Dictionary of zone arrays by name.
+        values - Dictionary of value arrays by name, aligned with the zones.
+        weights - Optional array of weights (e.g., population), if not supplied every cell has a weight of one.
+        '''
+        for name, zone in zones.items():
+            # Find the valid cells and the zone they belong to
+            zone = np.asarray(zone).ravel()
+            cells = np.flatnonzero(zone != self.nodata)
+            ids, inverse = np.unique(zone[cells], return_inverse=True)
+            positions = self.positions(self.zones[name], ids.tolist())[inverse.ravel()]
+
+            # Add the counts, weights, and weighted values for each zone
+            totals = self.zones[name]
+            if weights is None:
+                weight = np.ones(len(cells))
+            else:
+                weight = np.asarray(weights, dtype=float).ravel()[cells]
+            np.add.at(totals['count'], positions, 1)
+            np.add.at(totals['weight'], positions, weight)
+            for layer in self.layers:
+                value = np.asarray(values[layer], dtype=float).ravel()[cells]
+                np.add.at(totals['sum'][layer], positions, value * weight)
+
+    def positions(self, totals, ids):
+        '''Get the positions of the zone ids in the totals, adding any that have not been seen'''
+        added = [id for id in ids if id not in totals['index']]
+        if added:
+            for id in added:
+                totals['index'][id] = len(totals['ids'])
+                totals['ids'].append(id)
+            totals['count'] = np.concatenate((totals['count'], np.zeros(len(added), dtype=np.int64)))
+            totals['weight'] = np.concatenate((totals['weight'], np.zeros(len(added))))
+            for layer in self.layers:
+                totals['sum'][layer] = np.concatenate((totals['sum'][layer], np.zeros(len(added))))
+        return np.array([totals['index'][id] for id in ids], dtype=np.int64)
+
+    def results(self):
+        '''
+        Get the results as a dictionary by zone name with the sorted zone 'ids', the number of cells ('count'), the
+        sum of the weights ('weight'), and dictionaries by value name of the weighted sums ('sum') and weighted
+        means ('mean').
+        '''
+        results = {}
+        for name, totals in self.zones.items():
+            order = np.argsort(totals['ids'], kind='stable')
+            result = {
+                'ids': np.array(totals['ids'])[order],
+                'count': totals['count'][order],
+                'weight': totals['weight'][order],
+                'sum': {},
+                'mean': {}
+            }
+            for layer in self.layers:
+                result['sum'][layer] = totals['sum'][layer][order]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    result['mean'][layer] = result['sum'][layer] / result['weight']
+            results[name] = result
+        return results
@@ -2,32 +2,72 @@
 
 # pixelEditor.py
 #
-# This script takes an ASC filename, x, y, and pixel value as an input. The 
+# This script takes an ASC filename, x, y, and pixel value as an input. The
 # file is then opened and the pixel at that location is updated to be the value
 # and saved.
+#
+# In batch mode the edits are read from a CSV file with either row,col,value or
+# x,y,value columns and all of them are applied in a single pass over the file.
+import csv
 import os
 import sys
 
 # Import our libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
 import include.ascFile as asc
+import include.calibrationLib as cl
 
 
 def main(filename, row, col, value):
-    # Load the ASC file
-    header, data = asc.load_asc(filename)
+    # Edit the value, only the row that contains it is rewritten
+    try:
+        asc.edit_asc(filename, {(row, col): value})
+    except ValueError as err:
+        sys.stderr.write("{}\n".format(str(err)))
+        sys.exit(cl.EXIT_FAILURE)
+
+
+def batch(filename, editsFile):
+    # Read the header for converting coordinates
+    header = asc.load_header(filename)
 
-    # Edit the value
-    data[row][col] = value
+    try:
+        # Read the edits, later edits to the same cell replace earlier ones
+        edits = {}
+        with open(editsFile) as input:
+            reader = csv.DictReader(input)
+            fields = reader.fieldnames or []
+            if 'value' not in fields:
+                raise ValueError('{} must have either row,col,value or x,y,value columns'.format(editsFile))
+            for line in reader:
+                if None in line.values():
+                    raise ValueError('Line {} of {} is missing values'.format(reader.line_num, editsFile))
+                if 'row' in fields and 'col' in fields:
+                    cell = (int(line['row']), int(line['col']))
+                elif 'x' in fields and 'y' in fields:
+                    cell = asc.get_cell(header, float(line['x']), float(line['y']))
+                else:
+                    raise ValueError('{} must have either row,col,value or x,y,value columns'.format(editsFile))
+                edits[cell] = float(line['value'])
 
-    # Write the ASC file
-    asc.write_asc(header, data, filename)
+        # Apply the edits
+        asc.edit_asc(filename, edits)
+    except ValueError as err:
+        sys.stderr.write("{}\n".format(str(err)))
+        sys.exit(cl.EXIT_FAILURE)
+    print("Applied {} edits to {}".format(len(edits), filename))
 
 
 if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[2] == '--batch':
+        batch(str(sys.argv[1]), str(sys.argv[3]))
+        exit(0)
+
     if len(sys.argv) != 5:
         print("Usage: ./pixelEditor.py [filename] [row] [col] [value]")
+        print("       ./pixelEditor.py [filename] --batch [edits.csv]")
         print("Coordinates are assumed to be zero indexed and the file specified will be updated following execution")
+        print("The edits CSV must have a header with either row,col,value or x,y,value columns")
         exit(0)
 
     # Parse the parameters
@@ -36,4 +76,4 @@ if __name__ == "__main__":
     col = int(sys.argv[3])
     value = float(sys.argv[4])
 
-    main(filename, row, col, value)
\ No newline at end of file
+    main(filename, row, col, value)
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# queryRaster.py
+#
+# This script reads the values of a few cells from one or more aligned ASC
+# files without parsing the whole file. The byte offset of each row is stored
+# next to the raster (see ascFile.load_row_index) the first time it is queried
+# so that later queries only need to seek to, and parse, the rows needed.
+# Compressed files (.asc.gz, .asc.zst) are read up to the last row needed.
+import argparse
+import os
+import sys
+
+# Import our libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
+import include.ascFile as asc
+import include.calibrationLib as cl
+
+
+def main(filenames, cells, coordinates=False):
+    try:
+        # Make sure the rasters are aligned
+        header = asc.load_header(filenames[0])
+        for filename in filenames[1:]:
+            if not asc.compare_header(header, asc.load_header(filename)):
+                sys.stderr.write("{} is not aligned with {}\n".format(filename, filenames[0]))
+                sys.exit(cl.EXIT_FAILURE)
+
+        # Convert any coordinates to cells
+        if coordinates:
+            cells = [asc.get_cell(header, x, y) for x, y in cells]
+        else:
+            cells = [(int(row), int(col)) for row, col in cells]
+
+        # Read the values from each file and print them as a table
+        values = [asc.read_cells(filename, cells) for filename in filenames]
+    except (ImportError, ValueError) as err:
+        sys.stderr.write("{}\n".format(str(err)))
+        sys.exit(cl.EXIT_FAILURE)
+    print(','.join(['row', 'col'] + [os.path.basename(filename) for filename in filenames]))
+    for ndx, (row, col) in enumerate(cells):
+        print(','.join([str(row), str(col)] + ['{0:.8g}'.format(value[ndx]) for value in values]))
+
+
+if __name__ == "__main__":
+    # Parse the parameters
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', action='store', dest='filenames', nargs='+', required=True,
+        help='The ASC file(s) to read the cells from, they must be aligned')
+    parser.add_argument('-c', action='store', dest='cells', nargs='+', required=True,
+        help='The cells to read as row,col (zero indexed), or x,y when --xy is supplied')
+    parser.add_argument('--xy', action='store_true', dest='coordinates',
+        help='The cells are map coordinates instead of row,col')
+    args = parser.parse_args()
+
+    # Parse the cells
+    try:
+        cells = [[float(value) for value in cell.split(',')] for cell in args.cells]
+        if any(len(cell) != 2 for cell in cells):
+            raise ValueError
+    except ValueError:
+        sys.stderr.write("Cells must be supplied as row,col or x,y pairs\n")
+        sys.exit(cl.EXIT_FAILURE)
+
+    # Defer to main for everything else
+    main(args.filenames, cells, args.coordinates)
@@ -6,6 +6,7 @@
 # file to prepare. 
 import argparse
 import csv
+import numpy as np
 import os
 import sys
 
@@ -15,7 +16,6 @@ import include.ascFile as asc
 import include.bashWriter as bash
 import include.calibrationLib as cl
 import include.standards as std
-import include.utility as utility
 
 
 # Default output
@@ -26,31 +26,51 @@ SCRIPT = "out/script.sh"
 parameters = {}
 
 
-def addBeta(lookup, step, zone, beta, population, treatment):
+def plan(zones, populationBins, treatmentBins, betas, step):
     global parameters
-    
-    # Determine the population and treatment bin we are working with
-    populationBin = int(cl.get_bin(population, lookup[zone].keys()))
-    treatmentBin = cl.get_bin(treatment, lookup[zone][populationBin].keys())
-
-    # Update the dictionary
-    if zone not in parameters:
-        parameters[zone] = {}
-    if populationBin not in parameters[zone]:
-        parameters[zone][populationBin] = {}
-    if treatmentBin not in parameters[zone][populationBin]:
-        parameters[zone][populationBin][treatmentBin] = set()
-
-    # Add the stepped betas to the set
-    value = round(beta - (step * 10), 4)
-    while value < beta + (step * 10):
-        # Only add values greater than zero
-        if value > 0:
-            parameters[zone][populationBin][treatmentBin].add(value)
-        value = round(value + step, 4)
-
-
-def writeBetas(lookup, prefix, username):
+
+    # Group the cells by bin
+    keys, inverse = np.unique(np.column_stack((zones, populationBins, treatmentBins)), axis=0, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    groups = np.split(betas[order], np.cumsum(np.bincount(inverse.ravel(), minlength=len(keys)))[:-1])
+
+    # Add the merged stepped betas for each bin
+    for (zone, populationBin, treatmentBin), values in zip(keys.tolist(), groups):
+        populationBin = int(populationBin)
+        if zone not in parameters:
+            parameters[zone] = {}
+        if populationBin not in parameters[zone]:
+            parameters[zone][populationBin] = {}
+        parameters[zone][populationBin][treatmentBin] = getSteppedBetas(np.unique(values).tolist(), step)
+
+
+def getSteppedBetas(betas, step):
+    # Find the starting point for each beta, rounded to four decimal places
+    starts = [round(beta - (step * 10), 4) for beta in betas]
+    limits = np.array(betas) + (step * 10)
+
+    # When the step is also four decimal places the betas are integer multiples
+    # of 0.0001 so the ladders, at most 21 steps, can be generated as arrays
+    if round(step, 4) == step:
+        units = int(round(step * 10000))
+        ladders = np.rint(np.array(starts) * 10000).astype(np.int64)[:, None] + \
+            units * np.arange(22, dtype=np.int64)
+        ladders = ladders[ladders / 10000 < limits[:, None]]
+        return np.unique(ladders[ladders > 0]) / 10000
+
+    # Otherwise, step each beta, which requires the step to advance the value
+    values = set()
+    for value, limit in zip(starts, limits.tolist()):
+        while value < limit:
+            if value > 0:
+                values.add(value)
+            if round(value + step, 4) == value:
+                raise ValueError("The step, {}, does not change betas rounded to four decimal places".format(step))
+            value = round(value + step, 4)
+    return np.array(sorted(values))
+
+
+def writeBetas(lookup, prefix, username, array):
     global parameters
 
     # Generate a list of populations to create ASC files for
@@ -63,9 +83,8 @@ def writeBetas(lookup, prefix, username):
             populationAsc.add(population)
             for treatment in sorted(parameters[zone][population]):
                 betas = getLookupBetas(lookup, zone, population, treatment)
-                for beta in sorted(parameters[zone][population][treatment]):
-                    if beta not in betas:
-                        reduced.append([int(zone), int(population), treatment, beta])
+                for beta in np.setdiff1d(parameters[zone][population][treatment], betas).tolist():
+                    reduced.append([int(zone), int(population), treatment, beta])
 
     # Double check to see if the list was cleared out
     if len(reduced) == 0:
@@ -80,19 +99,19 @@ def writeBetas(lookup, prefix, username):
 
     # Generate the bash script
     print("Preparing script, {}".format(SCRIPT))
-    if username:
+    if username and array:
+        bash.reduce_cluster_array(SCRIPT, prefix, populationAsc, parameters, RESULTS[4:], len(reduced), array)
+    elif username:
         bash.reduce_cluster(SCRIPT, prefix, populationAsc, parameters, RESULTS[4:], username)
     else:
         bash.reduce_local(SCRIPT, prefix, populationAsc, parameters, RESULTS[4:])
 
 def getLookupBetas(lookup, zone, population, treatment):
-    betas = set()
-    for row in lookup[zone][population][treatment]:
-        betas.add(row[1])
-    return betas
+    _, betas, _ = lookup.curve(zone, population, treatment)
+    return np.unique(betas)
         
 
-def main(betas, configuration, gisPath, tolerance, step, username):
+def main(betas, configuration, gisPath, tolerance, step, username, array):
     global parameters
 
     # Determine the country prefix
@@ -104,51 +123,51 @@ def main(betas, configuration, gisPath, tolerance, step, username):
     try:
         # Load the configuration, and potentially raster data
         cfg = cl.load_configuration(configuration)
-        climate = cl.get_climate_zones(cfg, gisPath)
-        treatment = cl.get_treatments_raster(cfg, gisPath)
+        climate = np.asarray(cl.get_climate_zones(cfg, gisPath), dtype=float)
+        treatment = np.asarray(cl.get_treatments_raster(cfg, gisPath), dtype=float)
 
         # Load the relevant raster data
-        filename = os.path.join(gisPath, std.POPULATION_FILE.format(prefix))    
-        header, population = asc.load_asc(filename)
-        _, lookup = cl.load_betas(betas)
+        filename = cl.get_gis_file(gisPath, std.POPULATION_FILE.format(prefix))
+        header, population, _ = asc.load_asc_array(filename)
+
+        # Read the epsilons file in
+        _, beta, _ = asc.load_asc_array(std.BETA_VALUES.format(prefix))
+        _, epsilon, mask = asc.load_asc_array(std.EPSILON_VALUES.format(prefix))
+
+        # Select the cells that are not nodata and at least the tolerance, and
+        # load the calibration data for them
+        cells = ~mask & ~(epsilon < tolerance)
+        zones = climate[cells]
+        lookup = cl.load_index(betas, zones, population[cells], treatment[cells])
     except FileNotFoundError as err:
         sys.stderr.write("Unable to load required file!\n{}\n".format(str(err)))
         sys.exit(cl.EXIT_FAILURE)
- 
-    # Read the epsilons file in
-    _, beta = asc.load_asc(std.BETA_VALUES.format(prefix))
-    _, epsilon = asc.load_asc(std.EPSILON_VALUES.format(prefix))
 
     print ("Evaluating epsilons for {} rows, {} columns".format(header['nrows'], header['ncols']))
 
-    # Scan each of the epsilons
-    for row in range(0, header['nrows']):
-        for col in range(0, header['ncols']):
-            # Pass on nodata
-            value = epsilon[row][col]
-            if value == header['nodata']: continue
-
-            # Pass when value is less than maximum
-            if value < tolerance: continue
-
-            # Update the running list
-            addBeta(lookup, step, climate[row][col], beta[row][col], population[row][col], treatment[row][col])
+    # Resolve the bins for the cells
+    populationBins, treatmentBins = cl.resolve_bins(lookup, zones, population[cells], treatment[cells])
 
-        # Note the progress
-        utility.progressBar(row + 1, header['nrows'])
+    # Plan the betas to run for each bin
+    try:
+        plan(zones, populationBins, treatmentBins, beta[cells], step)
+    except ValueError as err:
+        sys.stderr.write("{}\n".format(str(err)))
+        sys.exit(cl.EXIT_FAILURE)
 
     # Check to see if we are done
     if len(parameters) == 0:
         print("Nothing to reduce!")
     else:
-        writeBetas(lookup, prefix, username)
+        writeBetas(lookup, prefix, username, array)
 
 
 if __name__ == "__main__":
     # Parse the parameters
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', action='store', dest='betas', required=True, 
-        help='The filename and path of the CSV file that contains calibration data')
+        help='The filename and path of the CSV file, or calibration store (.db, .sqlite), that contains '
+             'calibration data')
     parser.add_argument('-c', action='store', dest='configuration', required=True,
         help='The configuration file to reference when reducing the epsilon values')
     parser.add_argument('-g', action='store', dest='gis', required=True,
@@ -159,6 +178,8 @@ if __name__ == "__main__":
         help='float, increment +/- 10x around known beta (maximum 0.00001)')
     parser.add_argument('-u', action='store', dest='username', required=False,
         help='Optional, if supplied scripts will be produced to run on the cluster with the user indicated')    
+    parser.add_argument('--array', action='store', dest='array', type=int, required=False,
+        help='Optional, with -u, submit the runs as a SLURM job array with the number of runs per task given')
     args = parser.parse_args()
                 
     # Check the step and tolerance
@@ -173,6 +194,9 @@ if __name__ == "__main__":
     if tolerance < step:
         sys.stderr.write("The tolerance, {}, is less than the step, {}\n".format(step, tolerance))
         exit(cl.EXIT_FAILURE)
+    if args.array is not None and (args.array < 1 or not args.username):
+        sys.stderr.write("The --array option requires a username and at least one run per task\n")
+        exit(cl.EXIT_FAILURE)
 
     # Defer to main to do everything else
-    main(args.betas, args.configuration, args.gis, tolerance, step, args.username)
\ No newline at end of file
+    main(args.betas, args.configuration, args.gis, tolerance, step, args.username, args.array)
\ No newline at end of file
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+# runCalibration.py
+#
+# This script runs the calibration plan in a script prepared by generateBins.py
+# or reduceEpsilons.py (e.g., out/calibration.sh or out/script.sh) locally,
+# without the task-spooler. It should be run from the directory that contains
+# the simulation, the COUNTRY-calibration.yml template, population.asc, and
+# zone.asc. Finished and failed runs are recorded in a state file so running
+# the script again resumes the plan.
+import argparse
+import os
+import sys
+
+# Import our libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
+import include.calibrationLib as cl
+import include.scheduler as scheduler
+
+
+def main(filename, executable, limit, state, retry):
+    try:
+        plan = scheduler.load_plan(filename)
+        if plan['prefix'] is None:
+            raise ValueError("No country prefix found in {}".format(filename))
+        finished, failed = scheduler.run(plan, executable, limit, state, retry)
+    except (OSError, ValueError) as err:
+        sys.stderr.write("{}\n".format(str(err)))
+        sys.exit(cl.EXIT_FAILURE)
+    print("{} runs finished, {} runs failed".format(finished, failed))
+    if failed > 0:
+        sys.exit(cl.EXIT_FAILURE)
+
+
+if __name__ == "__main__":
+    # Parse the parameters
+    parser = argparse.ArgumentParser()
+    parser.add_argument('plan', help='The script with the plan prepared by generateBins.py or reduceEpsilons.py')
+    parser.add_argument('-e', action='store', dest='executable', default='./MaSim',
+        help='The simulation to run, default ./MaSim')
+    parser.add_argument('-l', action='store', dest='limit', type=int, default=None,
+        help='The number of simulations to run at once, default is one less than the number of processors')
+    parser.add_argument('-s', action='store', dest='state', default=scheduler.STATE,
+        help='The file to record finished and failed runs in, default {}'.format(scheduler.STATE))
+    parser.add_argument('--retry', action='store_true', dest='retry',
+        help='Run the runs that failed previously again')
+    args = parser.parse_args()
+
+    if args.limit is not None and args.limit < 1:
+        sys.stderr.write("The limit must be at least one\n")
+        sys.exit(cl.EXIT_FAILURE)
+
+    # Defer to main for everything else
+    main(args.plan, args.executable, args.limit, args.state, args.retry)
@@ -0,0 +1,164 @@
+# test_ascFile.py
+#
+# Tests for reading cells from plain and compressed ASC files.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'include'))
+import ascFile as asc
+
+
+def write_raster(filename, compress=False):
+    header = asc.get_header()
+    header['ncols'], header['nrows'] = 4, 3
+    data = np.arange(12, dtype=float).reshape(3, 4)
+    asc.write_asc(header, data, filename, compress)
+    return data
+
+
+def test_read_cells(tmp_path):
+    data = write_raster(str(tmp_path / 'plain.asc'))
+    write_raster(str(tmp_path / 'packed.asc.gz'), compress=True)
+    cells = [(2, 3), (0, 1), (2, 0)]
+    expected = [data[row, col] for row, col in cells]
+    assert asc.read_cells(str(tmp_path / 'plain.asc'), cells) == expected
+    assert asc.read_cells(str(tmp_path / 'packed.asc.gz'), cells) == expected
+
+
+def test_read_cells_outside(tmp_path):
+    write_raster(str(tmp_path / 'packed.asc.gz'), compress=True)
+    with pytest.raises(ValueError, match='Row 3'):
+        asc.read_cells(str(tmp_path / 'packed.asc.gz'), [(3, 0)])
+
+
+def load_asc_original(filename):
+    '''The original load_asc, which parsed each value with float'''
+    with open(filename) as input:
+        lines = input.readlines()
+        header = {}
+        header['ncols'] = int(lines[0].split()[1])
+        header['nrows'] = int(lines[1].split()[1])
+        header['xllcorner'] = float(lines[2].split()[1])
+        header['yllcorner'] = float(lines[3].split()[1])
+        header['cellsize'] = float(lines[4].split()[1])
+        header['nodata'] = int(lines[5].split()[1])
+        data = []
+        for ndx in range(6, header['nrows'] + 6):
+            data.append([float(value) for value in lines[ndx].split()])
+        return header, data
+
+
+def test_load_asc(tmp_path):
+    # Values written by hand in a few different ways, with uneven spacing and line endings
+    filename = str(tmp_path / 'mixed.asc')
+    with open(filename, 'w', newline='') as output:
+        output.write('ncols 4\nnrows 3\nxllcorner -12.5\nyllcorner 3.25\ncellsize 0.0083333333\nNODATA_value -9999\n')
+        output.write('-9999 1 2.5 3e-05\n')
+        output.write('  0.1234567891234 -0  17   -9999 \r\n')
+        output.write('1E3\t2.000 0.30000000000000004 -9999\n')
+    header, data = asc.load_asc(filename)
+    assert (header, data) == load_asc_original(filename)
+
+    _, array, mask = asc.load_asc_array(filename)
+    assert array.shape == (3, 4) and array.flags['C_CONTIGUOUS']
+    assert mask.tolist() == [[value == -9999 for value in row] for row in data]
+
+
+def write_asc_original(header, data, filename):
+    '''The original write_asc, which formatted each value in turn'''
+    with open(filename, 'w') as output:
+        output.write('ncols         ' + str(header['ncols']) + '\n')
+        output.write('nrows         ' + str(header['nrows']) + '\n')
+        output.write('xllcorner     ' + str(header['xllcorner']) + '\n')
+        output.write('yllcorner     ' + str(header['yllcorner']) + '\n')
+        output.write('cellsize      ' + '{0:.8g}'.format(header['cellsize']) + '\n')
+        output.write('NODATA_value  ' + str(header['nodata']) + '\n')
+        for ndx in range(0, header['nrows']):
+            row = ['{0:.8g}'.format(value) for value in data[ndx]]
+            row = ' '.join(row)
+            output.write(row)
+            output.write('\n')
+
+
+def test_write_asc(tmp_path, monkeypatch):
+    # Blocks smaller than the raster so the rows are written in several blocks, with a partial one at the end
+    monkeypatch.setattr(asc, 'WRITE_BLOCK', 10)
+    rng = np.random.default_rng(5)
+    data = rng.normal(0, 1000, (7, 4)) ** 3
+    data[rng.random(data.shape) < 0.2] = -9999
+    data[0, :3] = [0, -0.0, 1 / 3]
+    header = asc.get_header()
+    header['nrows'], header['ncols'], header['cellsize'] = 7, 4, 0.0083333333
+    write_asc_original(header, data.tolist(), str(tmp_path / 'original.asc'))
+    for rows in (data, data.tolist()):
+        asc.write_asc(header, rows, str(tmp_path / 'block.asc'))
+        with open(str(tmp_path / 'block.asc')) as one, open(str(tmp_path / 'original.asc')) as two:
+            assert one.read() == two.read()
+
+
+def test_cache(tmp_path):
+    filename, directory = str(tmp_path / 'raster.asc'), str(tmp_path / 'cache')
+    data = write_raster(filename)
+    data[1, 2] = -9999
+    header = asc.load_header(filename)
+    header['nodata'] = -9999
+    asc.write_asc(header, data, filename)
+    try:
+        # The first load parses and stores the raster, the second loads it from the cache
+        asc.set_cache(directory)
+        for _ in range(2):
+            cached = asc.load_asc_array(filename)
+            assert cached[0] == asc.parse_asc(filename)[0]
+            assert np.array_equal(cached[1], data) and np.array_equal(cached[2], data == -9999)
+        assert len([name for name in os.listdir(directory) if name.endswith('.npy')]) == 1
+
+        # Changing the file replaces the entry
+        data[0, 0] = 42
+        asc.write_asc(header, data, filename)
+        os.utime(filename, ns=(0, 0))
+        assert np.array_equal(asc.load_asc_array(filename)[1], data)
+        assert len(os.listdir(directory)) == 2
+    finally:
+        asc.set_cache(None)
+
+
+@pytest.mark.parametrize('block', [1, 5, 8, 1000])
+def test_iter_rows(tmp_path, block):
+    # Blocks of rows from aligned files, when rejoined, match the whole rasters
+    rng = np.random.default_rng(block)
+    header = asc.get_header()
+    header['nrows'], header['ncols'], header['nodata'] = 7, 4, -9999
+    rasters = [rng.uniform(0, 100, (7, 4)), rng.integers(1, 5, (7, 4)).astype(float)]
+    filenames = [str(tmp_path / 'one.asc'), str(tmp_path / 'two.asc.gz')]
+    for filename, data in zip(filenames, rasters):
+        asc.write_asc(header, data, filename)
+
+    starts, blocks = [], [[], []]
+    for start, rows in asc.iter_rows(filenames, block=block):
+        starts.append(start)
+        for ndx, data in enumerate(rows):
+            blocks[ndx].append(data)
+    assert starts == sorted(set(starts)) and starts[0] == 0
+    for filename, parts in zip(filenames, blocks):
+        assert np.array_equal(np.concatenate(parts), asc.parse_asc(filename)[1])
+
+    # Writing the blocks in turn gives the same file as writing the whole raster
+    with asc.AscWriter(header, str(tmp_path / 'blocks.asc')) as writer:
+        for data in blocks[0]:
+            writer.write(data)
+    asc.write_asc(header, rasters[0], str(tmp_path / 'whole.asc'))
+    with open(str(tmp_path / 'blocks.asc')) as one, open(str(tmp_path / 'whole.asc')) as two:
+        assert one.read() == two.read()
+
+
+def test_iter_rows_aligned(tmp_path):
+    header = asc.get_header()
+    header['nrows'], header['ncols'] = 3, 4
+    asc.write_asc(header, np.zeros((3, 4)), str(tmp_path / 'one.asc'))
+    header['ncols'] = 3
+    asc.write_asc(header, np.zeros((3, 3)), str(tmp_path / 'two.asc'))
+    with pytest.raises(ValueError, match='is not aligned'):
+        list(asc.iter_rows([str(tmp_path / 'one.asc'), str(tmp_path / 'two.asc')]))
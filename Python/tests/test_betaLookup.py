@@ -0,0 +1,87 @@
+# test_betaLookup.py
+#
+# Tests that the beta lookup returns the same epsilon and betas as the original
+# scan in createBetaMap, which stepped the epsilon and scanned the rows of the
+# bin in file order until the first row above the window.
+import csv
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'include'))
+import betaLookup as bl
+import calibrationIndex as ci
+
+EPSILON = 0.00001
+
+
+def load_betas(filename):
+    '''Load the calibration data as the original calibrationLib.load_betas did'''
+    lookup = {}
+    with open(filename) as input:
+        for row in csv.DictReader(input):
+            curve = lookup.setdefault(int(float(row['zone'])), {}).setdefault(
+                int(float(row['population'])), {}).setdefault(float(row['access']), [])
+            if float(row['pfpr2to10']) == 0 and float(row['beta']) != 0:
+                continue
+            curve.append([float(row['pfpr2to10']) / 100, float(row['beta'])])
+    return lookup
+
+
+def scan(curve, pfpr):
+    '''The original get_betas and get_betas_scan loop for a single bin'''
+    epsilon, betas = 0, []
+    while len(betas) == 0:
+        epsilon += EPSILON
+        low, high = pfpr - epsilon, pfpr + epsilon
+        for value in curve:
+            if low <= value[0] and value[0] <= high:
+                betas.append(value[1])
+            if high < value[0]:
+                break
+    return betas, epsilon
+
+
+def write_calibration(filename, rows):
+    with open(filename, 'w') as output:
+        output.write('zone,population,access,beta,pfpr2to10\n')
+        for row in rows:
+            output.write('{},{},{},{},{}\n'.format(*row))
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_sweep_order(tmp_path, shuffle):
+    # Rows in sweep order (sorted by beta) with noisy PfPR, so the bins are not sorted by PfPR
+    rng = np.random.default_rng(11)
+    rows = []
+    for population in (100, 1000):
+        for beta in np.round(np.arange(0, 2.51, 0.05), 2):
+            for _ in range(3):
+                pfpr = max(0, 50 * (1 - np.exp(-beta * population / 500)) + rng.normal(0, 2))
+                rows.append([1, population, 0.5, beta, round(pfpr, 5)])
+    if shuffle:
+        rng.shuffle(rows)
+    filename = str(tmp_path / 'calibration.csv')
+    write_calibration(filename, rows)
+
+    lookup = bl.BetaLookup(ci.CalibrationIndex.parse(filename), EPSILON)
+    original = load_betas(filename)
+    for population in (100, 1000):
+        curve = original[1][population][0.5]
+        targets = np.concatenate([rng.uniform(0.01, 0.45, 40), [value for value, _ in curve[::15]]])
+        for pfpr in targets.tolist():
+            betas, epsilon = lookup.get_betas(1, pfpr, population, 0.5)
+            assert (betas, epsilon) == scan(curve, pfpr)
+
+
+def test_sorted(tmp_path):
+    # A sweep sorted by PfPR uses the binary search
+    filename = str(tmp_path / 'calibration.csv')
+    write_calibration(filename, [[1, 100, 0.5, beta, beta * 20] for beta in np.round(np.arange(0, 2.51, 0.05), 2)])
+    lookup = bl.BetaLookup(ci.CalibrationIndex.parse(filename), EPSILON)
+    curve = load_betas(filename)[1][100][0.5]
+    for pfpr in np.linspace(0, 0.5, 101).tolist():
+        assert lookup.get_betas(1, pfpr, 100, 0.5) == scan(curve, pfpr)
+    assert lookup.get_curve(1, 100, 0.5)[3] is None
@@ -0,0 +1,80 @@
+# test_betaPlanner.py
+#
+# Tests for the rounds planned by the adaptive beta planner.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'include'))
+import betaCurve as bc
+import betaPlanner as planner
+
+
+def get_pfpr(betas):
+    '''PfPR, as a fraction, of a representative calibration curve that saturates as the beta increases'''
+    return 0.6 * (1 - np.exp(-3 * betas))
+
+
+def simulate(values, tolerance=planner.TOLERANCE, interpolate=False):
+    '''Run the rounds planned for the cells of a bin on the curve until it is resolved, returns the betas run'''
+    betas = np.zeros(0)
+    for _ in range(20):
+        planned, reachable, stalled = planner.refine(betas, get_pfpr(betas), values, tolerance, interpolate)
+        assert reachable and not stalled
+        if len(planned) == 0:
+            return betas
+        betas = np.sort(np.concatenate((betas, planned)))
+    raise AssertionError('The bin was not resolved')
+
+
+def test_coarse():
+    assert planner.refine(np.zeros(0), np.zeros(0), np.array([0.1])) == (planner.COARSE_BETAS, True, False)
+
+
+def test_resolved():
+    betas, pfprs = np.array([0.0, 0.1, 0.2]), np.array([0.0, 0.1, 0.2])
+    assert planner.refine(betas, pfprs, np.array([0.1, 0.195])) == ([], True, False)
+
+
+def test_secant():
+    betas, pfprs = np.array([0.0, 0.2]), np.array([0.0, 0.4])
+    planned, reachable, stalled = planner.refine(betas, pfprs, np.array([0.2]))
+    assert planned == [0.105] and reachable and not stalled
+
+
+def test_unreachable():
+    betas, pfprs = np.array([0.0, planner.MAX_BETA]), np.array([0.0, 0.5])
+    assert planner.refine(betas, pfprs, np.array([0.9])) == ([], False, False)
+
+
+def test_stalled():
+    # The runs bracketing the target are too close for a new beta to be placed between them
+    betas, pfprs = np.array([0.0, 0.0001]), np.array([0.0, 0.5])
+    assert planner.refine(betas, pfprs, np.array([0.25])) == ([], True, True)
+
+    # The bin is reported rather than treated as resolved
+    ranges, treatments = {1: {100: [0.25]}}, {1: [0.5]}
+    runs = {(1, 100, 0.5): [betas, pfprs]}
+    assert planner.plan(ranges, treatments, runs) == ([], [], [(1, 100, 0.5)])
+
+
+@pytest.mark.parametrize('low, high', [(0.0, 0.59), (0.05, 0.3), (0.1, 0.15)])
+def test_rounds(low, high):
+    # Every cell is within the tolerance of a run, using fewer runs than the sweep
+    values = np.random.default_rng(1).uniform(low, high, 300)
+    betas = simulate(values)
+    assert len(betas) < planner.SWEEP_RUNS
+    runs = get_pfpr(betas)
+    assert np.all(np.min(np.abs(values[:, None] - runs[None, :]), axis=1) <= planner.TOLERANCE)
+
+
+@pytest.mark.parametrize('low, high', [(0.0, 0.59), (0.05, 0.3), (0.1, 0.15)])
+def test_interpolate_rounds(low, high):
+    # Every cell is within the tolerance when the betas are interpolated from the runs, using a fraction of the sweep
+    values = np.random.default_rng(2).uniform(low, high, 300)
+    betas = simulate(values, interpolate=True)
+    assert len(betas) <= planner.SWEEP_RUNS / 3
+    interpolated, _ = bc.MonotoneCurve(get_pfpr(betas), betas).invert(values)
+    assert np.max(np.abs(get_pfpr(interpolated) - values)) <= planner.TOLERANCE
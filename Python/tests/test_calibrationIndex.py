@@ -0,0 +1,88 @@
+# test_calibrationIndex.py
+#
+# Tests that the compiled calibration index holds the same bins and curves as
+# the nested dictionaries of calibrationLib.load_betas, and that the sidecar
+# returns the same index as parsing the CSV file.
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'include'))
+import calibrationIndex as ci
+import calibrationLib as cl
+
+
+def write_calibration(filename):
+    rng = np.random.default_rng(13)
+    with open(filename, 'w') as output:
+        output.write('zone,population,access,beta,pfpr2to10\n')
+        for _ in range(300):
+            beta = rng.choice([0, 0.1, 0.25, 0.5])
+            pfpr = 0 if rng.random() < 0.1 else round(rng.uniform(0, 60), 4)
+            output.write('{}.0,{},{},{},{}\n'.format(rng.integers(1, 3), rng.choice([100, 1250]),
+                                                     rng.choice([0.25, 0.5]), beta, pfpr))
+
+
+def get_curves(index):
+    '''Get the curves of the index in the nested dictionaries of load_betas, the values are in file order'''
+    lookup = {}
+    for zone in index.zones():
+        for population in index.population_bins(zone):
+            for treatment in index.treatment_bins(zone, population):
+                pfprs, betas, order = index.curve(zone, population, treatment)
+                rows = np.argsort(order)
+                lookup.setdefault(zone, {}).setdefault(population, {})[treatment] = \
+                    np.column_stack((pfprs[rows], betas[rows])).tolist()
+    return lookup
+
+
+def test_load_betas(tmp_path):
+    filename = str(tmp_path / 'calibration.csv')
+    write_calibration(filename)
+    pfpr, lookup = cl.load_betas(filename)
+    index = ci.CalibrationIndex.parse(filename)
+    assert index.pfpr == pfpr
+    assert get_curves(index) == lookup
+
+    # Each curve is sorted by PfPR
+    for start, end in index.bounds.tolist():
+        assert np.all(np.diff(index.pfprs[start:end]) >= 0)
+
+
+def test_sidecar(tmp_path):
+    filename = str(tmp_path / 'calibration.csv')
+    write_calibration(filename)
+    parsed = ci.CalibrationIndex.load(filename)
+    assert os.path.exists(filename + ci.SIDECAR)
+
+    # The sidecar is used while the file is unchanged
+    loaded = ci.CalibrationIndex.load(filename)
+    assert loaded.pfpr == parsed.pfpr
+    for name in ('keys', 'bounds', 'pfprs', 'betas', 'order'):
+        assert np.array_equal(getattr(loaded, name), getattr(parsed, name))
+    assert get_curves(loaded) == cl.load_betas(filename)[1]
+
+    # Changing the file rebuilds the index
+    with open(filename, 'a') as output:
+        output.write('3,100,0.5,0.1,12\n')
+    assert 3 in ci.CalibrationIndex.load(filename).zones()
+
+
+def test_sidecar_version(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'calibration.csv')
+    write_calibration(filename)
+    ci.CalibrationIndex.load(filename)
+
+    # Note when the CSV is parsed
+    parsed = []
+    parse = ci.CalibrationIndex.parse
+    monkeypatch.setattr(ci.CalibrationIndex, 'parse', lambda filename: parsed.append(filename) or parse(filename))
+    ci.CalibrationIndex.load(filename)
+    assert parsed == []
+
+    # A sidecar written with another format is rebuilt, and the new one is used
+    monkeypatch.setattr(ci, 'FORMAT', ci.FORMAT + 1)
+    ci.CalibrationIndex.load(filename)
+    ci.CalibrationIndex.load(filename)
+    assert parsed == [filename]
@@ -0,0 +1,76 @@
+# test_calibrationLib.py
+#
+# Tests that the array versions of the functions in calibrationLib return the
+# same results as the original loops over the cells.
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'include'))
+import ascFile as asc
+import calibrationIndex as ci
+import calibrationLib as cl
+
+
+def write_raster(filename, data):
+    header = asc.get_header()
+    header['nrows'], header['ncols'] = data.shape
+    header['cellsize'], header['nodata'] = 1, -9999
+    asc.write_asc(header, data, filename)
+
+
+def unique_original(filename):
+    '''The unique values of the raster as the original get_treatments_list found them'''
+    header, data = asc.load_asc(filename)
+    values = list(set(i for j in data for i in j))
+    values.remove(header['nodata'])
+    return values
+
+
+def test_treatments_list(tmp_path):
+    rng = np.random.default_rng(3)
+    shape = (9, 7)
+    mask = rng.random(shape) < 0.25
+    rasters = {'under5.asc': rng.choice([0.25, 0.5, 0.75], shape), 'over5.asc': rng.choice([0.3, 0.6], shape),
+               'district.asc': rng.integers(1, 4, shape)}
+    for filename, data in rasters.items():
+        write_raster(str(tmp_path / filename), np.where(mask, -9999, data))
+
+    configuration = {'raster_db': {'p_treatment_for_less_than_5_by_location': [cl.standards.YAML_SENTINEL],
+                                   'p_treatment_for_more_than_5_by_location': [cl.standards.YAML_SENTINEL],
+                                   'pr_treatment_under5': 'under5.asc', 'pr_treatment_over5': 'over5.asc',
+                                   'district_raster': 'district.asc'}}
+    treatments, needsBinning = cl.get_treatments_list(configuration, str(tmp_path))
+    underFive, overFive, districts = [unique_original(str(tmp_path / filename)) for filename in rasters]
+    assert treatments == set(underFive + overFive)
+    assert needsBinning == ((len(underFive) > len(districts)) or (len(overFive) > len(districts)))
+
+
+def test_get_bins():
+    rng = np.random.default_rng(8)
+    bins = [2500, 100, 750, 1250.5]
+    values = np.concatenate([rng.uniform(0, 3000, 50), bins, [0, 3000, 99.999, 100.001]])
+    assert cl.get_bins(values, bins).tolist() == [cl.get_bin(value, bins) for value in values.tolist()]
+    assert cl.get_bins(values.reshape(2, -1), set(bins)).shape == (2, len(values) // 2)
+
+
+def test_resolve_bins(tmp_path):
+    rng = np.random.default_rng(9)
+    filename = str(tmp_path / 'calibration.csv')
+    with open(filename, 'w') as output:
+        output.write('zone,population,access,beta,pfpr2to10\n')
+        for zone, population, treatment in ((1, 100, 0.25), (1, 100, 0.75), (1, 1000, 0.5), (2, 500, 0.25),
+                                            (2, 500, 0.5), (2, 2000, 0.75)):
+            output.write('{},{},{},0.1,5\n'.format(zone, population, treatment))
+    _, lookup = cl.load_betas(filename)
+
+    zones = rng.choice([1, 2], 60).astype(float)
+    populations = np.concatenate([rng.uniform(0, 2500, 56), [100, 500, 1000, 2000]])
+    treatments = np.round(rng.uniform(0, 1, 60), 2)
+    populationBins, treatmentBins = cl.resolve_bins(ci.CalibrationIndex.parse(filename), zones, populations, treatments)
+    for zone, population, treatment, populationBin, treatmentBin in zip(
+            zones.tolist(), populations.tolist(), treatments.tolist(), populationBins.tolist(), treatmentBins.tolist()):
+        expected = cl.get_bin(population, lookup[zone].keys())
+        assert populationBin == expected
+        assert treatmentBin == cl.get_bin(treatment, lookup[zone][expected].keys())
@@ -0,0 +1,76 @@
+# test_calibrationStore.py
+#
+# Tests for appending calibration results to the calibration store.
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'include'))
+import calibrationStore as cs
+
+
+def write_csv(filename, rows):
+    with open(filename, 'w') as output:
+        output.write('zone,population,access,beta,pfpr2to10\n')
+        for row in rows:
+            output.write(','.join(str(value) for value in row) + '\n')
+
+
+def test_replicates(tmp_path):
+    # The same run twice is a replicate and both rows are kept
+    filename = str(tmp_path / 'calibration.csv')
+    write_csv(filename, [[1, 120, 0.3, 0.1, 5.0], [1, 120, 0.3, 0.1, 5.0]])
+    with cs.CalibrationStore(str(tmp_path / 'store.db'), create=True) as store:
+        assert store.append_csv(filename) == (2, 2)
+        assert len(store) == 2
+
+
+def test_import_again(tmp_path):
+    filename = str(tmp_path / 'calibration.csv')
+    write_csv(filename, [[1, 120, 0.3, 0.1, 5.0], [1, 120, 0.3, 0.2, 9.0]])
+    with cs.CalibrationStore(str(tmp_path / 'store.db'), create=True) as store:
+        assert store.append_csv(filename) == (2, 2)
+
+        # Importing the file again adds nothing, even if the rows are in a different order
+        assert store.append_csv(filename) == (0, 2)
+        write_csv(filename, [[1, 120, 0.3, 0.2, 9.0], [1, 120, 0.3, 0.1, 5.0]])
+        assert store.append_csv(filename) == (0, 2)
+        assert len(store) == 2
+
+
+def test_concatenated(tmp_path):
+    first, second = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+    write_csv(first, [[1, 120, 0.3, 0.1, 5.0], [1, 120, 0.3, 0.2, 9.0]])
+    with cs.CalibrationStore(str(tmp_path / 'store.db'), create=True) as store:
+        assert store.append_csv(first) == (2, 2)
+
+        # A file that starts with one that was imported only adds the new rows, which include a replicate
+        write_csv(second, [[1, 120, 0.3, 0.1, 5.0], [1, 120, 0.3, 0.2, 9.0], [1, 120, 0.3, 0.3, 12.0],
+                           [1, 120, 0.3, 0.1, 5.0]])
+        assert store.append_csv(second) == (2, 4)
+        assert store.append_csv(second) == (0, 4)
+        assert store.append_csv(first) == (0, 2)
+        assert len(store) == 4
+
+
+def test_new_runs(tmp_path):
+    # New runs are always added, even with the same values as rows in the store
+    with cs.CalibrationStore(str(tmp_path / 'store.db'), create=True) as store:
+        assert store.append('pfpr2to10', [1, 1], [120, 120], [0.3, 0.3], [5.0, 5.0], [0.1, 0.1]) == 2
+        assert store.append('pfpr2to10', [1, 1], [120, 120], [0.3, 0.3], [5.0, 5.0], [0.1, 0.1]) == 0
+        assert store.append('pfpr2to10', [1, 1], [120, 120], [0.3, 0.3], [5.0, 5.0], [0.1, 0.1],
+                            replicates=True) == 2
+        assert len(store) == 4
+
+
+def test_read_only(tmp_path):
+    # Opening an existing database to read it does not create the tables
+    filename = str(tmp_path / 'other.db')
+    sqlite3.connect(filename).close()
+    with cs.CalibrationStore(filename) as store:
+        with pytest.raises(sqlite3.OperationalError):
+            len(store)
+    with pytest.raises(FileNotFoundError):
+        cs.CalibrationStore(str(tmp_path / 'missing.db'))
@@ -0,0 +1,136 @@
+# test_createBetaMap.py
+#
+# Tests for createBetaMap.py using a small synthetic study, the PfPR of the
+# calibration runs is a smooth function of the beta so every cell can be matched.
+import os
+import re
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import createBetaMap
+import include.ascFile as asc
+import include.calibrationLib as cl
+
+# Betas of the calibration sweep
+BETAS = np.round(np.arange(0, 2.51, 0.05), 2)
+
+CONFIGURATION = '''raster_db:
+  ecoclimatic_raster: xyz_zone.asc
+  pr_treatment_under5: xyz_treatment.asc
+  pr_treatment_over5: xyz_treatment.asc
+'''
+
+
+def get_pfpr(beta, population):
+    '''PfPR, as a percentage, of the synthetic calibration runs'''
+    return 60 * (1 - np.exp(-beta * population / 1000))
+
+
+def write_raster(filename, data):
+    header = asc.get_header()
+    header['nrows'], header['ncols'] = data.shape
+    header['cellsize'], header['nodata'] = 1, -9999
+    asc.write_asc(header, data, filename)
+
+
+def write_calibration(filename, rows):
+    with open(filename, 'w') as output:
+        output.write('zone,population,access,beta,pfpr2to10\n')
+        for row in rows:
+            output.write('{},{},{},{},{}\n'.format(*row))
+
+
+@pytest.fixture
+def study(tmp_path, monkeypatch):
+    '''Prepare the GIS files, configuration, and calibration data for the study, then change to the directory'''
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('gis')
+    rng = np.random.default_rng(7)
+    shape = (6, 8)
+    mask = rng.random(shape) < 0.2
+    population = np.where(rng.random(shape) < 0.5, 1200, 3000)
+    pfpr = rng.uniform(0.01, 0.5, shape)
+    for name, data in (('zone', np.ones(shape)), ('treatment', np.full(shape, 0.5)), ('population', population),
+                       ('pfpr2to10', pfpr)):
+        write_raster(os.path.join('gis', 'xyz_{}.asc'.format(name)), np.where(mask, -9999, data))
+    with open('xyz-calibration.yml', 'w') as output:
+        output.write(CONFIGURATION)
+    write_calibration('calibration.csv', [[1, bin, 0.5, beta, get_pfpr(beta, bin)] for bin in (1000, 2000)
+                                          for beta in BETAS])
+    return int(np.count_nonzero(~mask))
+
+
+def run(capsys, betas='calibration.csv', jobs=1, interpolate=False):
+    '''Run the script, returns the printed output and the beta and epsilon rasters'''
+    createBetaMap.main(betas, 'xyz-calibration.yml', 'gis', '2-10', None, jobs, interpolate)
+    output = capsys.readouterr().out
+    return output, asc.load_asc_array('out/xyz_beta.asc')[1], asc.load_asc_array('out/xyz_epsilons.asc')[1]
+
+
+def get_total(output):
+    return int(re.search(r'Total Cells: (\d+)', output).group(1))
+
+
+def test_total(study, capsys):
+    output, _, _ = run(capsys)
+    assert get_total(output) == study
+
+
+def test_interpolate_total(study, capsys):
+    # The cells are within the range of smooth curves, so most have a residual of zero
+    output, betas, residuals = run(capsys, interpolate=True)
+    assert get_total(output) == study
+    assert np.count_nonzero(residuals[residuals != -9999] < 0.00001) > 0
+
+
+def original_beta_map(betas):
+    '''Get the mean betas for the study with the original loop, which searched each cell in turn'''
+    _, lookup = cl.load_betas(betas)
+    header, pfpr = asc.load_asc(os.path.join('gis', 'xyz_pfpr2to10.asc'))
+    _, population = asc.load_asc(os.path.join('gis', 'xyz_population.asc'))
+    _, treatments = asc.load_asc(os.path.join('gis', 'xyz_treatment.asc'))
+    _, climate = asc.load_asc(os.path.join('gis', 'xyz_zone.asc'))
+    results = np.full((header['nrows'], header['ncols']), float(header['nodata']))
+    for row in range(header['nrows']):
+        for col in range(header['ncols']):
+            if pfpr[row][col] == header['nodata']:
+                continue
+            zone = climate[row][col]
+            populationBin = cl.get_bin(population[row][col], lookup[zone].keys())
+            curve = lookup[zone][populationBin][cl.get_bin(treatments[row][col], lookup[zone][populationBin].keys())]
+            epsilon, values = 0, []
+            while len(values) == 0:
+                epsilon += createBetaMap.EPSILON
+                low, high = pfpr[row][col] - epsilon, pfpr[row][col] + epsilon
+                for value in curve:
+                    if low <= value[0] and value[0] <= high:
+                        values.append(value[1])
+                    if high < value[0]:
+                        break
+            if pfpr[row][col] == 0 and sum(values) > 0:
+                values = [0]
+            results[row][col] = sum(values) / len(values)
+    return results
+
+
+def test_memo(study, capsys):
+    # Round the PfPR so that many cells share a key
+    header, pfpr, mask = asc.load_asc_array(os.path.join('gis', 'xyz_pfpr2to10.asc'))
+    write_raster(os.path.join('gis', 'xyz_pfpr2to10.asc'), np.where(mask, -9999, np.round(pfpr, 1)))
+    output, betas, _ = run(capsys)
+    assert np.array_equal(betas, original_beta_map('calibration.csv'))
+    unique, rate = re.search(r'Unique Lookups: (\d+), Hit Rate: ([\d.]+)%', output).groups()
+    assert int(unique) <= 12 and float(rate) > 50
+
+
+@pytest.mark.parametrize('jobs', [2, 5])
+def test_jobs(study, capsys, jobs):
+    # The bands are processed with a memo in each worker, the results match a single job and the original loop
+    output, betas, epsilons = run(capsys)
+    parallel, parallelBetas, parallelEpsilons = run(capsys, jobs=jobs)
+    assert np.array_equal(parallelBetas, betas) and np.array_equal(parallelEpsilons, epsilons)
+    assert np.array_equal(betas, original_beta_map('calibration.csv'))
+    assert re.sub(r'Unique Lookups.*\n', '', output) == parallel
@@ -0,0 +1,76 @@
+# test_extractDistrict.py
+#
+# Tests that extractDistrict matches the original loop over the cells, and that
+# cropping keeps only the bounding box of the districts.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import extractDistrict
+import include.ascFile as asc
+
+
+def write_raster(filename, data):
+    header = asc.get_header()
+    header['nrows'], header['ncols'] = data.shape
+    header['xllcorner'], header['yllcorner'] = 10, 20
+    header['cellsize'], header['nodata'] = 0.5, -9999
+    asc.write_asc(header, data, filename)
+
+
+def extract_original(districtsFile, targetFile, districts):
+    '''The original main, which replaced the cells outside of the districts one at a time'''
+    [ascHeader, ascDistricts] = asc.load_asc(districtsFile)
+    _, data = asc.load_asc(targetFile)
+    for row in range(ascHeader['nrows']):
+        for col in range(ascHeader['ncols']):
+            if ascDistricts[row][col] == ascHeader['nodata']:
+                continue
+            if ascDistricts[row][col] in districts:
+                continue
+            data[row][col] = ascHeader['nodata']
+    asc.write_asc(ascHeader, data, 'original_{}'.format(targetFile))
+
+
+@pytest.fixture
+def study(tmp_path, monkeypatch):
+    '''Prepare the district and target rasters, then change to the directory'''
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(12)
+    shape = (10, 12)
+    mask = rng.random(shape) < 0.15
+    district = np.ones(shape)
+    district[2:5, 3:7], district[4:8, 8:11] = 2, 3
+    write_raster('district.asc', np.where(mask, -9999, district))
+    write_raster('pfpr.asc', np.where(mask, -9999, rng.uniform(0, 0.5, shape)))
+
+
+@pytest.mark.parametrize('districts', [[2], [2, 3], [1, 4]])
+def test_extract(study, districts):
+    extractDistrict.main('district.asc', ['pfpr.asc'], districts)
+    extract_original('district.asc', 'pfpr.asc', districts)
+    with open('extract_pfpr.asc') as one, open('original_pfpr.asc') as two:
+        assert one.read() == two.read()
+
+
+def test_crop(study):
+    extractDistrict.main('district.asc', ['pfpr.asc'], [2, 3], crop=True)
+    extract_original('district.asc', 'pfpr.asc', [2, 3])
+
+    # The cropped raster is the bounding box of the districts, rows 2 to 7 and columns 3 to 10
+    header, data, _ = asc.load_asc_array('extract_pfpr.asc')
+    expected = asc.load_asc_array('original_pfpr.asc')[1]
+    assert np.array_equal(data, expected[2:8, 3:11])
+    assert (header['nrows'], header['ncols'], header['xllcorner'], header['yllcorner']) == (6, 8, 11.5, 21)
+
+
+def test_crop_missing(study, capsys):
+    # Cropping to districts that are not in the raster is an error, and nothing is written
+    with pytest.raises(SystemExit) as exit:
+        extractDistrict.main('district.asc', ['pfpr.asc'], [7], crop=True)
+    assert exit.value.code != 0
+    assert 'None of the districts were found' in capsys.readouterr().err
+    assert not os.path.exists('extract_pfpr.asc')
@@ -0,0 +1,67 @@
+# test_generateBins.py
+#
+# Tests that the natural breaks found by generateBins match the original search
+# over the number of classes, and that the approximate breaks from a sample fit
+# the full data nearly as well.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import generateBins
+import include.stats as stats
+
+sys.path.insert(0, os.path.dirname(__file__))
+from test_stats import goodness_of_variance_fit_original
+
+
+def bin_data_original(data, minimumClasses=5, maximumClasses=30, delta=0.01):
+    '''The original bin_data, which found the GVF for each number of classes with the original loop'''
+    previousGvf = 0
+    for classes in range(minimumClasses, maximumClasses + 1):
+        gvf, breaks = goodness_of_variance_fit_original(data, classes)
+        if abs(previousGvf - gvf) <= delta:
+            return breaks[1:]
+        previousGvf = gvf
+    return breaks[1:]
+
+
+def get_population(size, seed):
+    '''Skewed data with ties, like a population raster'''
+    rng = np.random.default_rng(seed)
+    return np.round(rng.lognormal(6, 1.5, size))
+
+
+@pytest.mark.parametrize('samples', [None, 1000])
+def test_exact(capsys, samples):
+    # A sample that is not smaller than the data uses all of it
+    data = get_population(600, 1)
+    assert generateBins.bin_data(data, 'population', samples=samples) == bin_data_original(data)
+    assert 'Approximated' not in capsys.readouterr().out
+
+
+def gvf_original(data, breaks):
+    '''The GVF of the breaks on the data, classified one value at a time as the original goodness_of_variance_fit'''
+    classified = np.array([stats.classify(value, breaks) for value in data])
+    sdam = np.sum((data - np.mean(data)) ** 2)
+    sdcm = sum([np.sum((data[classified == zone] - data[classified == zone].mean()) ** 2)
+                for zone in range(1, len(breaks)) if np.any(classified == zone)])
+    return (sdam - sdcm) / sdam
+
+
+def test_approximate(capsys):
+    data = get_population(20000, 2)
+    breaks = [data.min()] + generateBins.bin_data(data, 'population', samples=2000)
+    output = capsys.readouterr().out
+    assert 'Approximated using 2,000 of 20,000 values' in output
+
+    # The reported GVF is that of the sample breaks on the full data
+    prepared = stats.prepare_gvf(data)
+    gvf = stats.breaks_gvf(prepared, breaks)
+    assert gvf == pytest.approx(gvf_original(data, breaks), rel=1e-12)
+    assert 'GVF = {:.6f},'.format(gvf) in output
+
+    # The fit is close to that of the exact breaks with the same number of classes
+    assert gvf >= stats.goodness_of_variance_fit(data, len(breaks) - 1, prepared)[0] - 0.05
@@ -0,0 +1,91 @@
+# test_generateMetrics.py
+#
+# Tests that the weighted PfPR reported by generateMetrics, which accumulates the
+# zonal statistics a block of rows at a time, matches the original loop over the
+# cells.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import generateMetrics
+import include.ascFile as asc
+
+
+def write_raster(filename, data):
+    header = asc.get_header()
+    header['nrows'], header['ncols'] = data.shape
+    header['cellsize'], header['nodata'] = 1, -9999
+    asc.write_asc(header, data, filename)
+
+
+def calculate_original(gisPath, prefix, division):
+    '''The original calculate, which summed the weighted PfPR cell by cell'''
+    header, district = asc.load_asc("{}/{}_{}.asc".format(gisPath, prefix, division))
+    _, pfpr = asc.load_asc("{}/{}_pfpr2to10.asc".format(gisPath, prefix))
+    _, population = asc.load_asc("{}/{}_population.asc".format(gisPath, prefix))
+    data, cells, totalPopulation = {}, 0, 0
+    for row in range(header['nrows']):
+        for col in range(header['ncols']):
+            if district[row][col] == header['nodata']:
+                continue
+            key = district[row][col]
+            if key not in data.keys():
+                data[key] = [0, 0]
+            if pfpr[row][col] == header['nodata']:
+                print('No data in PfPR values at {}, {}'.format(row, col))
+            data[key][0] += pfpr[row][col] * population[row][col]
+            data[key][1] += population[row][col]
+            totalPopulation += population[row][col]
+            cells += 1
+
+    numerator, denominator = 0, 0
+    filename = "weighted_pfpr_{}.csv".format(division)
+    print("Saving data to: {}".format(filename))
+    with open(filename, 'w') as out:
+        for key in sorted(data.keys()):
+            numerator += data[key][0]
+            denominator += data[key][1]
+            result = round((data[key][0] / data[key][1]) * 100, 2)
+            out.write("{},{}\n".format(int(key), result))
+            print("{}: {}, PfPR: {}%".format(division.capitalize(), int(key), result))
+    print("\nFull Map, PfPR: {0}%".format(round(numerator * 100 / denominator, 2)))
+    print("Population: {:,}".format(totalPopulation))
+    print("Cells: {}\n".format(cells))
+
+
+@pytest.fixture
+def study(tmp_path, monkeypatch):
+    '''Prepare the GIS files for the study, then change to the directory'''
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('gis')
+    rng = np.random.default_rng(4)
+    shape = (9, 11)
+    mask = rng.random(shape) < 0.2
+    district = np.where(mask, -9999, rng.integers(1, 6, shape))
+    pfpr = np.where(rng.random(shape) < 0.05, -9999, rng.uniform(0, 0.6, shape))
+    write_raster('gis/xyz_district.asc', district)
+    write_raster('gis/xyz_province.asc', np.where(mask, -9999, (district + 1) // 2))
+    write_raster('gis/xyz_pfpr2to10.asc', np.where(mask, -9999, pfpr))
+    write_raster('gis/xyz_population.asc', np.where(mask, -9999, np.round(rng.lognormal(6, 1.5, shape))))
+
+
+def test_calculate(study, capsys, monkeypatch):
+    # Read a few rows at a time so the totals are accumulated over several blocks
+    iter_rows = asc.iter_rows
+    monkeypatch.setattr(generateMetrics.asc, 'iter_rows', lambda filenames: iter_rows(filenames, block=20))
+    expected = {}
+    for division in ('district', 'province'):
+        calculate_original('gis', 'xyz', division)
+        with open('weighted_pfpr_{}.csv'.format(division)) as input:
+            expected[division] = (capsys.readouterr().out, input.read())
+
+    # Both divisions are calculated in one pass, with the same output for each
+    generateMetrics.calculate('gis', 'xyz', ['district', 'province'])
+    output = capsys.readouterr().out
+    assert output == expected['district'][0] + expected['province'][0]
+    for division in ('district', 'province'):
+        with open('weighted_pfpr_{}.csv'.format(division)) as input:
+            assert input.read() == expected[division][1]
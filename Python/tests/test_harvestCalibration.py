@@ -0,0 +1,90 @@
+# test_harvestCalibration.py
+#
+# Tests for harvestCalibration.py using synthetic databases laid out the way
+# the runners write them, named after the job number of the run.
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import harvestCalibration as harvest
+
+
+def write_database(filename, pfprs):
+    '''Write a database with one month of site data for each PfPR'''
+    connection = sqlite3.connect(filename)
+    connection.execute('CREATE TABLE monthlydata (id INTEGER PRIMARY KEY)')
+    connection.execute('CREATE TABLE monthlysitedata (monthlydataid INTEGER, pfpr2to10 REAL, pfprunder5 REAL)')
+    for ndx, pfpr in enumerate(pfprs, start=1):
+        connection.execute('INSERT INTO monthlydata (id) VALUES (?)', (ndx,))
+        connection.execute('INSERT INTO monthlysitedata VALUES (?, ?, ?)', (ndx, pfpr, pfpr * 2))
+    connection.commit()
+    connection.close()
+
+
+def read_results(filename):
+    with open(filename) as input:
+        return list(csv.reader(input))
+
+
+def test_jobs_csv(tmp_path):
+    # Runs queued by calibrationLocal.sh, note job 3 was never written
+    with open(tmp_path / harvest.JOBS, 'w') as output:
+        output.write('1,1-120-0.3-0.00-xyz\n2,1-120-0.3-0.05-xyz\n3,1-120-0.3-0.10-xyz\n')
+    write_database(tmp_path / 'monthly_data_1.db', [0, 0, 0])
+    write_database(tmp_path / 'monthly_data_2.db', [5, 10, 20])
+    write_database(tmp_path / 'monthly_data_9.db', [1, 1, 1])
+
+    output = str(tmp_path / 'calibration.csv')
+    harvest.main(str(tmp_path), output, '2-10', 2, 1)
+    assert read_results(output) == [['zone', 'population', 'access', 'beta', 'pfpr2to10'],
+                                    ['1', '120', '0.3', '0.00', '0.0'], ['1', '120', '0.3', '0.05', '15.0']]
+
+    # Running again only harvests the new databases
+    write_database(tmp_path / 'monthly_data_3.db', [30, 40])
+    harvest.main(str(tmp_path), output, '2-10', 2, 1)
+    assert read_results(output)[-1] == ['1', '120', '0.3', '0.10', '35.0']
+    assert len(read_results(output)) == 4
+
+
+def test_scheduler_state(tmp_path):
+    # Runs from runCalibration.py, the zone may be written as a float by generateBins.py
+    with open(tmp_path / 'scheduler.state', 'w') as output:
+        output.write(json.dumps({'name': '1.0-800-0.5-0.25-xyz', 'job': 7, 'status': 'finished', 'code': 0}) + '\n')
+        output.write(json.dumps({'name': '2.0-800-0.5-0.25-xyz', 'job': 8, 'status': 'finished', 'code': 0}) + '\n')
+    write_database(tmp_path / 'monthly_data_7.db', [10, 20])
+    write_database(tmp_path / 'monthly_data_8.db', [10])
+
+    output = str(tmp_path / 'calibration.csv')
+    harvest.main(str(tmp_path), output, '0-59', 2, 2)
+
+    # Job 8 has too few months so it is left for the next harvest
+    assert read_results(output) == [['zone', 'population', 'access', 'beta', 'pfprunder5'],
+                                    ['1', '800', '0.5', '0.25', '30.0']]
+    with open(output + harvest.CHECKPOINT) as input:
+        [key] = json.load(input)['harvested']
+    assert key[:2] == ['monthly_data_7.db', '1.0-800-0.5-0.25-xyz']
+
+
+def test_reused_jobs(tmp_path, capsys):
+    # A later sweep started the job numbers from one again, so the database was replaced
+    with open(tmp_path / harvest.JOBS, 'w') as output:
+        output.write('1,1-120-0.3-0.00-xyz\n')
+    write_database(tmp_path / 'monthly_data_1.db', [0, 0])
+    output = str(tmp_path / 'calibration.csv')
+    harvest.main(str(tmp_path), output, '2-10', 2, 1)
+
+    with open(tmp_path / harvest.JOBS, 'a') as output_jobs:
+        output_jobs.write('1,2-800-0.5-0.40-xyz\n')
+    os.remove(tmp_path / 'monthly_data_1.db')
+    write_database(tmp_path / 'monthly_data_1.db', [20, 30])
+    capsys.readouterr()
+    harvest.main(str(tmp_path), output, '2-10', 2, 1)
+    assert 'Warning: 1 job numbers were used for more than one run' in capsys.readouterr().out
+    assert read_results(output)[1:] == [['1', '120', '0.3', '0.00', '0.0'], ['2', '800', '0.5', '0.40', '25.0']]
+
+    # Nothing changed, so nothing is harvested
+    harvest.main(str(tmp_path), output, '2-10', 2, 1)
+    assert len(read_results(output)) == 3
@@ -0,0 +1,62 @@
+# test_pixelEditor.py
+#
+# Tests for editing cells with pixelEditor, both one at a time and in batches.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pixelEditor
+import include.ascFile as asc
+
+
+@pytest.fixture
+def raster(tmp_path):
+    '''Write a small raster, returns the filename'''
+    filename = str(tmp_path / 'raster.asc')
+    header = asc.get_header()
+    header['nrows'], header['ncols'], header['cellsize'], header['nodata'] = 3, 4, 1, -9999
+    asc.write_asc(header, np.arange(12, dtype=float).reshape(3, 4), filename)
+    return filename
+
+
+def write_edits(filename, text):
+    with open(filename, 'w') as output:
+        output.write(text)
+
+
+def test_batch(raster, tmp_path):
+    edits = str(tmp_path / 'edits.csv')
+    write_edits(edits, 'row,col,value\n0,1,0.5\n2,3,-9999\n0,1,7\n')
+    pixelEditor.batch(raster, edits)
+    expected = np.arange(12, dtype=float).reshape(3, 4)
+    expected[0, 1], expected[2, 3] = 7, -9999
+    assert np.array_equal(asc.load_asc_array(raster)[1], expected)
+
+
+@pytest.mark.parametrize('text, message', [('row,col,value\n0,1,0.5\n3,0,1\n', 'Cell 3, 0 is outside'),
+                                           ('row,col,value\n0,-1,1\n', 'Cell 0, -1 is outside'),
+                                           ('row,col,value\n0,1\n', 'Line 2 of'),
+                                           ('row,col\n0,1\n', 'must have either'),
+                                           ('row,col,value\n0,one,1\n', 'invalid literal')])
+def test_batch_invalid(raster, tmp_path, capsys, text, message):
+    # Invalid edits are reported and the raster is left as it was
+    with open(raster) as input:
+        original = input.read()
+    edits = str(tmp_path / 'edits.csv')
+    write_edits(edits, text)
+    with pytest.raises(SystemExit) as exit:
+        pixelEditor.batch(raster, edits)
+    assert exit.value.code != 0
+    assert message in capsys.readouterr().err
+    with open(raster) as input:
+        assert input.read() == original
+
+
+def test_outside(raster, capsys):
+    with pytest.raises(SystemExit) as exit:
+        pixelEditor.main(raster, 0, 4, 1.0)
+    assert exit.value.code != 0
+    assert 'Cell 0, 4 is outside' in capsys.readouterr().err
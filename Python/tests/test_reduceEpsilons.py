@@ -0,0 +1,61 @@
+# test_reduceEpsilons.py
+#
+# Tests that the stepped betas planned by reduceEpsilons match the original,
+# which stepped each beta of each cell in turn.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import reduceEpsilons
+
+
+def add_beta_original(values, beta, step):
+    '''The stepped betas that the original addBeta added to the set for the bin'''
+    value = round(beta - (step * 10), 4)
+    while value < beta + (step * 10):
+        if value > 0:
+            values.add(value)
+        value = round(value + step, 4)
+
+
+# Steps that are four decimal places use the integer ladders, the others step each beta
+@pytest.mark.parametrize('step', [0.0001, 0.001, 0.005, 0.05, 0.00015, 0.0123])
+def test_stepped_betas(step):
+    rng = np.random.default_rng(int(step * 100000))
+    betas = np.concatenate([rng.uniform(0, 1, 40), [0, 0.0005, 0.25, 0.1234, 1.5]])
+    expected = set()
+    for beta in betas.tolist():
+        add_beta_original(expected, beta, step)
+    assert reduceEpsilons.getSteppedBetas(np.unique(betas).tolist(), step).tolist() == sorted(expected)
+
+
+def test_stalled_step():
+    with pytest.raises(ValueError, match='does not change'):
+        reduceEpsilons.getSteppedBetas([0.5], 0.00001)
+
+
+def test_plan(monkeypatch):
+    # Cells in a few bins, several with the same beta
+    monkeypatch.setattr(reduceEpsilons, 'parameters', {})
+    rng = np.random.default_rng(6)
+    zones = rng.choice([1.0, 2.0], 50)
+    populationBins = rng.choice([100.0, 1000.0], 50)
+    treatmentBins = rng.choice([0.25, 0.5], 50)
+    betas = np.round(rng.uniform(0, 0.5, 50), 3)
+    reduceEpsilons.plan(zones, populationBins, treatmentBins, betas, 0.001)
+
+    expected = {}
+    for zone, populationBin, treatmentBin, beta in zip(zones.tolist(), populationBins.tolist(), treatmentBins.tolist(),
+                                                       betas.tolist()):
+        add_beta_original(expected.setdefault(zone, {}).setdefault(int(populationBin), {}).setdefault(
+            treatmentBin, set()), beta, 0.001)
+    assert get_sorted(reduceEpsilons.parameters) == get_sorted(expected)
+
+
+def get_sorted(parameters):
+    '''Get the betas for each bin of the parameters as sorted lists'''
+    return {(zone, population, treatment): sorted(values) for zone, populations in parameters.items()
+            for population, treatments in populations.items() for treatment, values in treatments.items()}
@@ -0,0 +1,99 @@
+# test_scheduler.py
+#
+# Tests for running a calibration plan with runCalibration.py against a stub
+# simulation that notes each run and fails the runs it is told to.
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import runCalibration
+import include.scheduler as scheduler
+
+# The stub notes the job number and configuration of each run, and fails if the
+# configuration is listed in the fail file
+STUB = '''#!{}
+import sys
+arguments = sys.argv[1:]
+name, job = arguments[arguments.index('-i') + 1], arguments[arguments.index('-j') + 1]
+with open('runs.log', 'a') as output:
+    output.write('{{}} {{}}\\n'.format(job, name))
+try:
+    with open('fail') as input:
+        sys.exit(1 if name in input.read().split() else 0)
+except FileNotFoundError:
+    pass
+'''
+
+
+@pytest.fixture
+def study(tmp_path, monkeypatch):
+    '''Prepare the directory with the plan, template, and stub simulation, then change to it'''
+    monkeypatch.chdir(tmp_path)
+    with open('MaSim', 'w') as output:
+        output.write(STUB.format(sys.executable))
+    os.chmod('MaSim', os.stat('MaSim').st_mode | stat.S_IEXEC)
+    with open('xyz-calibration.yml', 'w') as output:
+        output.write('beta: #BETA#\npopulation: #POPULATION#\naccess: #ACCESSU5#, #ACCESSO5#\nzone: #ZONE#\n')
+    with open('population.asc', 'w') as output:
+        output.write('#POPULATION#\n')
+    with open('zone.asc', 'w') as output:
+        output.write('#ZONE#\n')
+    with open('calibration.csv', 'w') as output:
+        output.write('1,100,0.5,0.1\n1,100,0.5,0.2\n1,100,0.5,0.3\n')
+    with open('calibration.sh', 'w') as output:
+        output.write('#!/bin/bash\nsource ./calibrationLocal.sh\nset_spooler\ncheck_dependencies xyz\n'
+                     'generate_asc "\\"100\\""\ngenerate_zone_asc "\\"1\\""\nrun_csv \'calibration.csv\' xyz\n')
+    return tmp_path
+
+
+def read_runs():
+    '''Read the runs noted by the stub and clear them'''
+    if not os.path.exists('runs.log'):
+        return []
+    with open('runs.log') as input:
+        runs = [line.split() for line in input]
+    os.remove('runs.log')
+    return sorted(runs)
+
+
+def run(retry=False):
+    runCalibration.main('calibration.sh', './MaSim', 2, scheduler.STATE, retry)
+
+
+def test_resume(study):
+    # The second run fails, so the exit code notes the failure
+    with open('fail', 'w') as output:
+        output.write('1-100-0.5-0.2-xyz.yml\n')
+    with pytest.raises(SystemExit):
+        run()
+    assert read_runs() == [['1', '1-100-0.5-0.1-xyz.yml'], ['2', '1-100-0.5-0.2-xyz.yml'],
+                           ['3', '1-100-0.5-0.3-xyz.yml']]
+    assert os.path.exists('100.asc') and os.path.exists('1.asc')
+
+    # Running again skips the finished and failed runs
+    run()
+    assert read_runs() == []
+
+    # The failed run is run again with the same job number when retrying
+    os.remove('fail')
+    run(retry=True)
+    assert read_runs() == [['2', '1-100-0.5-0.2-xyz.yml']]
+    state = scheduler.load_state(scheduler.STATE)
+    assert {name: record['status'] for name, record in state.items()} == {
+        '1-100-0.5-0.1-xyz': 'finished', '1-100-0.5-0.2-xyz': 'finished', '1-100-0.5-0.3-xyz': 'finished'}
+
+
+def test_interrupted(study):
+    # The scheduler was killed while noting a run, the partial record is ignored
+    with open(scheduler.STATE, 'w') as output:
+        output.write(json.dumps({'name': '1-100-0.5-0.2-xyz', 'job': 4, 'status': 'finished', 'code': 0}) + '\n')
+        output.write('{"name": "1-100-0.5-0.3-xyz", "jo')
+
+    # Only the runs that did not finish are run, numbered after the jobs in the state file
+    run()
+    assert read_runs() == [['5', '1-100-0.5-0.1-xyz.yml'], ['6', '1-100-0.5-0.3-xyz.yml']]
+    assert len(scheduler.load_state(scheduler.STATE)) == 3
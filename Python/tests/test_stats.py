@@ -0,0 +1,40 @@
+# test_stats.py
+#
+# Tests that the goodness of variance fit matches the original, which
+# classified and grouped the data one value at a time.
+import os
+import sys
+
+import jenkspy
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'include'))
+import stats
+
+
+def goodness_of_variance_fit_original(data, classes):
+    '''The original goodness_of_variance_fit'''
+    classes = jenkspy.jenks_breaks(data, classes)
+    classified = np.array([stats.classify(i, classes) for i in data])
+    zone_indices = [[idx for idx, val in enumerate(classified) if zone + 1 == val] for zone in range(max(classified))]
+    sdam = np.sum((data - np.mean(data)) ** 2)
+    array_sort = [np.array([data[index] for index in zone]) for zone in zone_indices]
+    sdcm = sum([np.sum((classified - classified.mean()) ** 2) for classified in array_sort])
+    gvf = (sdam - sdcm) / sdam
+    return gvf, classes
+
+
+@pytest.mark.parametrize('classes', [2, 3, 5, 8])
+def test_goodness_of_variance_fit(classes):
+    # Skewed data with ties, like a population raster
+    rng = np.random.default_rng(classes)
+    data = np.concatenate([np.round(rng.lognormal(6, 1.5, 400)), [0] * 20, [1000] * 10])
+    rng.shuffle(data)
+    gvf, breaks = stats.goodness_of_variance_fit(data, classes)
+    expected, expectedBreaks = goodness_of_variance_fit_original(data, classes)
+    assert breaks == expectedBreaks
+    assert gvf == expected
+
+    # The prepared data gives the same result
+    assert stats.goodness_of_variance_fit(data, classes, stats.prepare_gvf(data)) == (gvf, breaks)
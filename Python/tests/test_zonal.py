@@ -0,0 +1,78 @@
+# test_zonal.py
+#
+# Tests that the zonal statistics accumulated a block of rows at a time match
+# the original loops over the cells.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import createValidationReference
+import include.ascFile as asc
+import include.zonal as zonal
+
+
+def weighted_original(districts, pfpr, population, nodata):
+    '''The weighted PfPR sums and population for each district, as the original createValidationReference'''
+    data = {}
+    for row in range(len(districts)):
+        for col in range(len(districts[0])):
+            if districts[row][col] == nodata:
+                continue
+            district = int(districts[row][col])
+            if district not in data:
+                data[district] = [0, 0]
+            data[district][0] += ((pfpr[row][col] * population[row][col]) * 100.0)
+            data[district][1] += population[row][col]
+    return data
+
+
+def get_study(seed):
+    '''Get the districts, PfPR, and population for a small study'''
+    rng = np.random.default_rng(seed)
+    shape = (13, 9)
+    mask = rng.random(shape) < 0.2
+    districts = np.where(mask, -9999, rng.integers(1, 7, shape))
+    pfpr = np.where(mask, -9999, rng.uniform(0, 0.6, shape))
+    population = np.where(mask, -9999, np.round(rng.lognormal(6, 1.5, shape)))
+    return districts, pfpr, population
+
+
+@pytest.mark.parametrize('rows', [1, 4, 13])
+def test_accumulator(rows):
+    # Adding the rows in blocks gives the same sums as adding the cells one at a time
+    districts, pfpr, population = get_study(rows)
+    accumulator = zonal.ZonalAccumulator(['district'], ['pfpr'], nodata=-9999)
+    for start in range(0, len(districts), rows):
+        block = slice(start, start + rows)
+        accumulator.add({'district': districts[block]}, {'pfpr': pfpr[block]}, weights=population[block])
+    results = accumulator.results()['district']
+
+    # Sum the cells in row order
+    expected = {}
+    for district, value, weight in zip(districts.ravel().tolist(), pfpr.ravel().tolist(), population.ravel().tolist()):
+        if district != -9999:
+            totals = expected.setdefault(district, [0, 0, 0])
+            totals[0], totals[1], totals[2] = totals[0] + value * weight, totals[1] + weight, totals[2] + 1
+    assert results['ids'].tolist() == sorted(expected)
+    assert results['sum']['pfpr'].tolist() == [expected[key][0] for key in sorted(expected)]
+    assert results['weight'].tolist() == [expected[key][1] for key in sorted(expected)]
+    assert results['count'].tolist() == [expected[key][2] for key in sorted(expected)]
+
+
+def test_validation_reference(tmp_path, monkeypatch):
+    districts, pfpr, population = get_study(3)
+    header = asc.get_header()
+    header['nrows'], header['ncols'], header['cellsize'], header['nodata'] = 13, 9, 1, -9999
+    for name, data in (('district', districts), ('pfpr2to10', pfpr), ('population', population)):
+        asc.write_asc(header, data, str(tmp_path / 'xyz_{}.asc'.format(name)))
+    monkeypatch.chdir(tmp_path)
+    createValidationReference.main(str(tmp_path))
+
+    expected = weighted_original(*[asc.load_asc('xyz_{}.asc'.format(name))[1] for name in
+                                   ('district', 'pfpr2to10', 'population')], -9999)
+    with open('xyz_weighted-pfpr.asc') as input:
+        assert input.read() == ''.join('{},{}\n'.format(key, round(expected[key][0] / expected[key][1], 2))
+                                       for key in sorted(expected))
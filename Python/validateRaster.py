@@ -3,9 +3,15 @@
 # validate_raster.py
 #
 # This script is intended to validate raster files to ensure they are aligned correctly.
+# The headers are compared first and then the nodata masks are compared using a hash of
+# the packed bitmap, the cell by cell comparison is only done for files that mismatch.
+import argparse
 import os
+import re
 import sys
 
+from concurrent.futures import ProcessPoolExecutor
+
 
 # Import our libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), "include"))
@@ -13,49 +19,63 @@ import include.ascFile as asc
 import include.calibrationLib as cl
 
 def compare(one, two):
-    # Load the ASC files
-    oneHeader, oneValues = asc.load_asc(one)
-    twoHeader, twoValues = asc.load_asc(two)
+    # Check the headers before loading the data
+    oneHeader, twoHeader = asc.load_header(one), asc.load_header(two)
+    if not asc.compare_header(oneHeader, twoHeader):
+        return False
 
-    # Check the files
-    result = True
-    result = result and asc.compare_header(oneHeader, twoHeader)
-    result = result and asc.compare_data(oneValues, twoValues, oneHeader['nodata'], errorLimit=10)
-    return result
+    # Load the ASC files and check the data
+    _, oneValues, _ = asc.load_asc_array(one)
+    _, twoValues, _ = asc.load_asc_array(two)
+    return asc.compare_data(oneValues, twoValues, oneHeader['nodata'], errorLimit=10)
 
 
-def main(path):
-    # Prepare the variables
-    count = 0
-    first = ''
-    error = False
+def fingerprint(filename):
+    # Load the ASC file and return the header and hash of the nodata mask
+    header, _, mask = asc.load_asc_array(filename)
+    return header, asc.get_mask_hash(mask)
+
+
+def check(reference, filename):
+    # Compare the header first, then the nodata mask if the header matches
+    referenceHeader, referenceHash = reference
+    if not asc.compare_header(referenceHeader, asc.load_header(filename), printError=False):
+        return False
+    return fingerprint(filename)[1] == referenceHash
+
 
+def main(path, jobs=1):
     # Start by checking to see if this directory exists
     if not os.path.isdir(path):
         print('The directory, {}, does not appear to exist'.format(path))
         exit(cl.EXIT_FAILURE)
-    
-    # Walk the files in the directory given
-    for filename in next(os.walk(path))[2]:
-        # Continue if we this is not an ASC
-        if not filename.endswith(".asc"): continue
-
-        # If the first one has not been set, do so and continue
-        if first == '':
-            print("Using {} as reference".format(filename))
-            first = os.path.join(path, filename)
-            continue
-
-        # We now have two paths, so compare the first versus the new one
-        second = os.path.join(path, filename)
-        if not compare(first, second):
+
+    # Find the ASC files in the directory given, the first is the reference
+    filenames = [os.path.join(path, filename) for filename in next(os.walk(path))[2]
+                 if re.search(asc.ASC_PATTERN, filename)]
+    first, others = filenames[:1], filenames[1:]
+    if first:
+        first = first[0]
+        print("Using {} as reference".format(os.path.basename(first)))
+        reference = fingerprint(first)
+
+    # Check the files, in parallel if requested
+    if jobs > 1 and len(others) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(check, [reference] * len(others), others))
+    else:
+        results = [check(reference, filename) for filename in others]
+
+    # Report the details for any mismatches
+    error = False
+    for second, result in zip(others, results):
+        if not result:
+            compare(first, second)
             error = True
             print('Error with alignment between {} and {}'.format(first, second))
 
-        # Update the count
-        count = count + 1
-    
     # Print the status
+    count = len(others)
     print("{} files crosschecked, {} total files".format(count, count + 1))
 
     if not error:
@@ -63,14 +83,16 @@ def main(path):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: ./validateRaster.py [path]")
-        print("path - path to GIS files relative to this script")
-        print("\nExample: ./validateRaster.py ../GIS\n")
-        exit(0)
-
     # Parse the parameters
-    path = sys.argv[1]
+    parser = argparse.ArgumentParser(
+        description='Validate that the ASC files in the path are aligned, e.g., ./validateRaster.py ../GIS')
+    parser.add_argument('path', help='path to GIS files relative to this script')
+    parser.add_argument('-j', '--jobs', action='store', dest='jobs', type=int, default=1,
+        help='The number of files to check in parallel (default 1)')
+    args = parser.parse_args()
+    if args.jobs < 1:
+        sys.stderr.write("The number of jobs must be at least one\n")
+        exit(cl.EXIT_FAILURE)
 
     # Main entry point
-    main(path)
\ No newline at end of file
+    main(args.path, args.jobs)
@@ -3,6 +3,11 @@
 # This script will queue processes on the cluster up to the configured limit. The filenames
 # will encode the values based using the name ZONE-POPUATION-ACCESS-BETA-COUNTRY.yml although a fixed
 # study id is in place as well.
+#
+# Runs may also be submitted as a SLURM job array using runArray, in which case
+# each task of the array runs a chunk of the runs in a manifest (CSV file of
+# zone, population, access, beta) and the throttle is set on the array instead
+# of polling the queue.
 
 # The maximum number of jobs that can run
 LIMIT=100
@@ -22,9 +27,10 @@ function check_delay {
 
 function checkDependencies {
   eval country=$1
+  eval job=${2:-template.job}
 
   missing=false
-  declare -a files=("$country-calibration.yml" "template.job" "population.asc" "zone.asc")
+  declare -a files=("$country-calibration.yml" "$job" "population.asc" "zone.asc")
   for file in "${files[@]}"; do
     if [ ! -f "$file" ]; then
       echo "$file does not appear to exist!"
@@ -51,6 +57,16 @@ function generateZoneAsc() {
   done
 }
 
+# Prepare the configuration file for the run, sets filename to the name of the run
+function prepareConfiguration() {
+  filename=$1-$2-$3-$4-$5
+  sed 's/#BETA#/'"$4"'/g' $5-calibration.yml > $filename.yml
+  sed -i 's/#POPULATION#/'"$2"'/g' $filename.yml
+  sed -i 's/#ACCESSU5#/'"$3"'/g' $filename.yml
+  sed -i 's/#ACCESSO5#/'"$(bc -l <<< $3*$O5ADJUST)"'/g' $filename.yml
+  sed -i 's/#ZONE#/'"$1"'/g' $filename.yml
+}
+
 function run() {
   eval zone=$1
   eval population_list=$2
@@ -66,12 +82,7 @@ function run() {
         check_delay $user
 
         # Prepare the configuration file
-        filename=$zone-$population-$access-$beta-$country
-        sed 's/#BETA#/'"$beta"'/g' $country-calibration.yml > $filename.yml
-        sed -i 's/#POPULATION#/'"$population"'/g' $filename.yml
-        sed -i 's/#ACCESSU5#/'"$access"'/g' $filename.yml
-        sed -i 's/#ACCESSO5#/'"$(bc -l <<< $access*$O5ADJUST)"'/g' $filename.yml
-        sed -i 's/#ZONE#/'"$zone"'/g' $filename.yml
+        prepareConfiguration $zone $population $access $beta $country
     
         # Prepare and queue the job file
         sed 's/#FILENAME#/'"$filename"'/g' template.job > $filename.job    
@@ -94,12 +105,7 @@ function runCsv() {
     beta="$(echo "$beta"|tr -d '\r')"
 
     # Prepare the configuration file
-    filename=$zone-$population-$access-$beta-$country
-    sed 's/#BETA#/'"$beta"'/g' $country-calibration.yml > $filename.yml
-    sed -i 's/#POPULATION#/'"$population"'/g' $filename.yml
-    sed -i 's/#ACCESSU5#/'"$access"'/g' $filename.yml
-    sed -i 's/#ACCESSO5#/'"$(bc -l <<< $access*$O5ADJUST)"'/g' $filename.yml
-    sed -i 's/#ZONE#/'"$zone"'/g' $filename.yml
+    prepareConfiguration $zone $population $access $beta $country
 
     # Prepare and queue the job file
     sed 's/#FILENAME#/'"$filename"'/g' template.job > $filename.job    
@@ -108,6 +114,47 @@ function runCsv() {
   done < $filename
 }
 
+# Queue the runs in the manifest as a job array of array.job, each task runs
+# chunk lines of the manifest and at most LIMIT tasks run at once
+function runArray() {
+  eval manifest=$1
+  eval country=$2
+  eval chunk=$3
+
+  count=`grep -c . $manifest`
+  if [ $count -eq 0 ]; then
+    echo "No runs found in $manifest"
+    return
+  fi
+  tasks=$(( (count + chunk - 1) / chunk ))
+  echo "Queuing $count runs from $manifest as $tasks tasks"
+  sbatch --array=1-$tasks%$LIMIT array.job $manifest $country $chunk
+}
+
+# Run the chunk of the manifest for the array task, called by array.job
+function runTask() {
+  eval manifest=$1
+  eval country=$2
+  eval chunk=$3
+
+  # Select the lines of the manifest for the task
+  first=$(( (SLURM_ARRAY_TASK_ID - 1) * chunk + 1 ))
+  last=$(( first + chunk - 1 ))
+
+  status=0
+  while IFS=, read -r zone population access beta
+  do
+    prepareConfiguration $zone $population $access $beta $country
+    echo "Running $filename"
+    # MaSim must not read from the manifest being looped over
+    if ! ./MaSim -i $filename.yml -s 1 </dev/null; then
+      echo "$filename failed!"
+      status=1
+    fi
+  done < <(sed -n "${first},${last}p" $manifest | tr -d '\r')
+  return $status
+}
+
 function runReplicates() {
   eval filename=$1
   eval user=$2
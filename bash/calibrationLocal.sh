@@ -2,7 +2,8 @@
 
 # This script uses the task-spooler to queue up replicates to run locally.
 # For calibration replicates, filenames are encoded using values for the 
-# replicate as follows: ZONE-POPUATION-ACCESS-BETA-COUNTRY.yml
+# replicate as follows: ZONE-POPUATION-ACCESS-BETA-COUNTRY.yml and the job
+# number of each run is noted in jobs.csv so the results can be harvested.
 #
 # NOTE This script is dependent upon task-spooler, https://viric.name/soft/ts/
 
@@ -68,8 +69,10 @@ function run_sweep() {
   eval country=$4
   eval user=$5
 
-  # Set the initial job counter
-  counter=1
+  # Set the initial job counter, this continues from any previous call so that
+  # each sweep in the script gets unique job numbers (and logs)
+  counter=${counter:-1}
+  initial=$counter
 
   echo "Running zone, $zone"
   sed 's/#ZONE#/'"$zone"'/g' zone.asc > $zone.asc
@@ -85,15 +88,16 @@ function run_sweep() {
         sed -i 's/#ACCESSO5#/'"$(bc -l <<< $access*$O5ADJUST)"'/g' $filename.yml
         sed -i 's/#ZONE#/'"$zone"'/g' $filename.yml
     
-        # Queue the job, update the counter
+        # Queue the job, note the run for the job, and update the counter
         tsp bash -c "./MaSim -i $filename.yml -r SQLitePixelReporter -j $counter &> $counter.log"
+        echo "$counter,$filename" >> jobs.csv
         ((counter++))
       done
     done
   done
 
   # Report the total number of jobs queued
-  echo "Started $counter jobs!"
+  echo "Started $((counter - initial)) jobs!"
 }
 
 # Run a beta calibration CSV file
@@ -119,14 +123,15 @@ function run_csv() {
     sed -i 's/#ACCESSO5#/'"$(bc -l <<< $access*$O5ADJUST)"'/g' $filename.yml
     sed -i 's/#ZONE#/'"$zone"'/g' $filename.yml
 
-    # Queue the job, update the counter
+    # Queue the job, note the run for the job, and update the counter
     tsp bash -c "./MaSim -i $filename.yml -r SQLitePixelReporter -j $counter &> $counter.log"
+    echo "$counter,$filename" >> jobs.csv
     ((counter++))
 
   done < $filename
 
   # Report the total number of jobs queued
-  total=(($counter-$initial))
+  total=$((counter - initial))
   echo "Started $total jobs!"
 }
 
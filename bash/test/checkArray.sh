@@ -0,0 +1,84 @@
+#!/bin/bash
+
+# This script checks runArray and runTask from calibrationCluster.sh without a
+# cluster. Stand-ins for sbatch, squeue, MaSim, and bc are placed on the PATH,
+# the manifest is queued as a job array, and each task of the array is run in
+# turn to check that it ran its slice of the manifest. Usage,
+#
+#   bash bash/test/checkArray.sh
+
+# Number of runs in the manifest, and the number of runs for each task
+RUNS=7
+CHUNK=3
+
+source=$(cd "$(dirname "$0")/.." && pwd)
+work=$(mktemp -d)
+trap 'rm -rf "$work"' EXIT
+
+failed=false
+function fail() {
+  echo "FAIL: $1"
+  failed=true
+}
+
+# Prepare the stand-ins, sbatch notes the arguments and MaSim notes the run for
+# the task, reading stdin as MaSim would if it were not redirected
+mkdir $work/bin
+cat > $work/bin/sbatch << 'EOF'
+#!/bin/bash
+echo "$@" >> sbatch.log
+EOF
+cat > $work/bin/squeue << 'EOF'
+#!/bin/bash
+echo "squeue" >> sbatch.log
+EOF
+cat > $work/bin/bc << 'EOF'
+#!/bin/bash
+read expression; python3 -c "print($expression)"
+EOF
+cat > $work/MaSim << 'EOF'
+#!/bin/bash
+cat > /dev/null
+echo "$SLURM_ARRAY_TASK_ID $2" >> runs.log
+EOF
+chmod +x $work/bin/* $work/MaSim
+export PATH=$work/bin:$PATH
+
+# Prepare the files for the runs
+cp $source/calibrationCluster.sh $source/array.job $source/population.asc $source/zone.asc $work
+echo "beta: #BETA#, population: #POPULATION#, zone: #ZONE#" > $work/xyz-calibration.yml
+for ndx in `seq 1 $RUNS`; do
+  echo "1,$((ndx * 100)),0.5,0.$ndx" >> $work/manifest.csv
+done
+cd $work
+
+# Queue the manifest, the array should cover it with the throttle applied
+source ./calibrationCluster.sh
+runArray manifest.csv xyz $CHUNK > /dev/null
+tasks=$(( (RUNS + CHUNK - 1) / CHUNK ))
+expected="--array=1-$tasks%$LIMIT array.job manifest.csv xyz $CHUNK"
+if [ "$(cat sbatch.log)" != "$expected" ]; then
+  fail "expected sbatch $expected, got $(cat sbatch.log)"
+fi
+
+# Run each task and check that it ran its slice of the manifest
+for id in `seq 1 $tasks`; do
+  rm -f runs.log
+  if ! SLURM_SUBMIT_DIR=$work SLURM_ARRAY_TASK_ID=$id bash array.job manifest.csv xyz $CHUNK > task-$id.out; then
+    fail "task $id returned an error"
+  fi
+  first=$(( (id - 1) * CHUNK + 1 ))
+  last=$(( first + CHUNK - 1 ))
+  expected=$(sed -n "${first},${last}p" manifest.csv | awk -F, -v id=$id '{print id " " $1 "-" $2 "-" $3 "-" $4 "-xyz.yml"}')
+  if [ "$(cat runs.log)" != "$expected" ]; then
+    fail "task $id expected runs"$'\n'"$expected"$'\n'"got"$'\n'"$(cat runs.log)"
+  fi
+done
+
+if grep -q squeue sbatch.log; then
+  fail "squeue was polled for the job array"
+fi
+if [ "$failed" = true ]; then
+  exit 1
+fi
+echo "All $tasks tasks ran their runs"